@@ -1,40 +1,19 @@
 import logging
-import sys
 from typing import Any, Dict
-from flask import Flask, render_template, request, Response, send_from_directory
+from flask import Flask, render_template, request, Response, jsonify, send_from_directory
 from flask_cors import CORS
 from routes.chat import chat_bp
 from routes.quiz import quiz_bp
-from config import DEBUG
+from routes.search import search_bp
+from services.vector_store import preload, readiness, start_warm_up
+from config import PREFORK, SECRET_KEY, TIMING_HEADER, WARM_UP_ON_START
+from utils.metrics import finish_request, render, server_timing, start_request
+from utils.logging import configure_logging
 import os
 import secrets
 
 # Configure logging when app is imported
-log_level: int = logging.DEBUG if DEBUG else logging.INFO
-print(f"Debug mode is {'enabled' if DEBUG else 'disabled'}")
-
-# Remove any existing handlers
-root_logger: logging.Logger = logging.getLogger()
-for handler in root_logger.handlers[:]:
-    root_logger.removeHandler(handler)
-
-# Configure root logger
-root_logger.setLevel(log_level)
-
-# Create console handler
-console_handler: logging.StreamHandler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(log_level)
-
-# Create formatter
-formatter: logging.Formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
-
-# Add handler to root logger
-root_logger.addHandler(console_handler)
-
-# Test logging
-logging.debug("This is a debug message")
-logging.info("This is an info message")
+configure_logging()
 
 # Get the absolute path to the LitLoot directory
 base_dir: str = os.path.dirname(os.path.abspath(__file__))
@@ -48,8 +27,10 @@ app: Flask = Flask(__name__,
     static_folder=static_dir
 )
 
-# Set a secret key for session management
-app.secret_key = secrets.token_hex(32)
+# Set a secret key for session management, shared by all workers
+if not SECRET_KEY:
+    logging.warning("LITLOOT_SECRET_KEY is not set; sessions will not survive restarts or span workers")
+app.secret_key = SECRET_KEY or secrets.token_hex(32)
 
 # Enable CORS with more permissive settings
 CORS(app, resources={
@@ -62,12 +43,40 @@ CORS(app, resources={
 
 app.register_blueprint(chat_bp)
 app.register_blueprint(quiz_bp)
+app.register_blueprint(search_bp)
+
+if PREFORK:
+    # Imported in the gunicorn master: load everything once, before the workers are forked
+    preload()
+elif WARM_UP_ON_START:
+    # Load the encoder and index in the background; /readyz reports when they are done
+    start_warm_up()
 
 @app.route("/", methods=["GET"])
 def index() -> str:
     logging.debug("Index route accessed")
     return render_template("index.html")
 
+@app.route("/healthz", methods=["GET"])
+def healthz() -> Response:
+    """Liveness: the process is up and serving, even while still warming up."""
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz() -> Response:
+    """Readiness: 200 once the encoder and index are loaded, 503 until then."""
+    status = readiness()
+    return jsonify(status), 200 if status["status"] == "ready" else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics() -> Response:
+    """This process's metrics in the Prometheus text format."""
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+@app.before_request
+def time_request() -> None:
+    start_request()
+
 @app.route('/static/<path:filename>')
 def serve_static(filename: str) -> Response:
     try:
@@ -79,7 +88,10 @@ def serve_static(filename: str) -> Response:
 
 @app.after_request
 def after_request(response: Response) -> Response:
-    """Add CORS headers to all responses."""
+    """Record the request's latency and add CORS (and optionally timing) headers to all responses."""
+    total = finish_request(request.endpoint, request.method, response.status_code)
+    if TIMING_HEADER and total is not None:
+        response.headers['Server-Timing'] = server_timing(total)
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
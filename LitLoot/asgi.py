@@ -0,0 +1,78 @@
+"""
+ASGI entry point for the chat and quiz APIs.
+
+Serves the same endpoints as app.py from an event loop, so one process can keep
+hundreds of OpenAI requests in flight instead of one per worker thread:
+
+    hypercorn asgi:app --bind 127.0.0.1:5001
+"""
+import logging
+import os
+import secrets
+from quart import Quart, Response, jsonify, render_template, request
+from routes.chat_async import chat_async_bp
+from routes.quiz_async import quiz_async_bp
+from routes.search_async import search_async_bp
+from services.vector_store import readiness, start_warm_up
+from config import SECRET_KEY, TIMING_HEADER, WARM_UP_ON_START
+from utils.metrics import finish_request, render, server_timing, start_request
+from utils.logging import configure_logging
+
+configure_logging()
+
+base_dir: str = os.path.dirname(os.path.abspath(__file__))
+
+app: Quart = Quart(__name__,
+    template_folder=os.path.join(base_dir, 'templates'),
+    static_folder=os.path.join(base_dir, 'static')
+)
+
+# Set a secret key for session management, shared by all workers
+if not SECRET_KEY:
+    logging.warning("LITLOOT_SECRET_KEY is not set; sessions will not survive restarts or span workers")
+app.secret_key = SECRET_KEY or secrets.token_hex(32)
+
+app.register_blueprint(chat_async_bp)
+app.register_blueprint(quiz_async_bp)
+app.register_blueprint(search_async_bp)
+
+@app.before_serving
+async def warm_up() -> None:
+    # Load the encoder and index in the background; /readyz reports when they are done
+    if WARM_UP_ON_START:
+        start_warm_up()
+
+@app.route("/", methods=["GET"])
+async def index() -> str:
+    return await render_template("index.html")
+
+@app.route("/healthz", methods=["GET"])
+async def healthz() -> Response:
+    """Liveness: the process is up and serving, even while still warming up."""
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+async def readyz() -> Response:
+    """Readiness: 200 once the encoder and index are loaded, 503 until then."""
+    status = readiness()
+    return jsonify(status), 200 if status["status"] == "ready" else 503
+
+@app.route("/metrics", methods=["GET"])
+async def metrics() -> Response:
+    """This process's metrics in the Prometheus text format."""
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+@app.before_request
+async def time_request() -> None:
+    start_request()
+
+@app.after_request
+async def after_request(response: Response) -> Response:
+    """Record the request's latency and add CORS (and optionally timing) headers to all responses."""
+    total = finish_request(request.endpoint, request.method, response.status_code)
+    if TIMING_HEADER and total is not None:
+        response.headers['Server-Timing'] = server_timing(total)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
@@ -0,0 +1,134 @@
+"""
+Recall/latency/memory benchmark for the FAISS index kinds in services/index_factory.
+
+Builds every index kind over the same vectors, uses the flat index as ground
+truth, and reports recall@k, single-query p50/p99 latency and serialized size
+for each nprobe / efSearch setting.
+
+Vectors come from an existing flat index (default ``vector_index/books.index``)
+or are generated with ``--synthetic N``. Queries are held-out database vectors
+with a little noise added, which stands in for real queries landing near chunks.
+
+    python benchmarks/ann_benchmark.py --synthetic 200000 --k 10 --json ann.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.index_factory import INDEX_KINDS, build_index, index_size_bytes, set_search_params
+
+NPROBE_SWEEP = (1, 4, 16, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128)
+
+
+def load_vectors(args):
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        # Clustered data is closer to real embeddings than uniform noise
+        centers = rng.normal(size=(max(1, args.synthetic // 500), args.dim)).astype("float32")
+        assignment = rng.integers(0, len(centers), size=args.synthetic)
+        vectors = centers[assignment] + 0.3 * rng.normal(size=(args.synthetic, args.dim)).astype("float32")
+        return np.ascontiguousarray(vectors, dtype="float32")
+    index = faiss.read_index(args.index)
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIDMap):
+        # Built indexes map ids to chunk rows; read vectors by position from the wrapped index
+        inner = faiss.downcast_index(inner.index)
+    return inner.reconstruct_n(0, inner.ntotal)
+
+def make_queries(vectors, n_queries, seed):
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    scale = float(np.std(vectors)) * 0.05
+    noise = rng.normal(scale=scale, size=(len(picks), vectors.shape[1])).astype("float32")
+    return np.ascontiguousarray(vectors[picks] + noise, dtype="float32")
+
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / float(len(truth) * k)
+
+
+def time_queries(index, queries, k):
+    """Per-query latencies in milliseconds, one query at a time as the API issues them."""
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        results.append(ids[0])
+    return np.array(latencies), np.array(results)
+
+
+def sweep(kind):
+    if kind in ("ivf_flat", "ivf_pq"):
+        return [("nprobe", value) for value in NPROBE_SWEEP]
+    if kind == "hnsw":
+        return [("efSearch", value) for value in EF_SEARCH_SWEEP]
+    return [(None, None)]
+
+
+def run(args):
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.seed)
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    rows = []
+    truth = None
+    for kind in ["flat"] + [kind for kind in args.kinds if kind != "flat"]:
+        start = time.perf_counter()
+        index = build_index(kind, vectors, train_size=args.train_size, pq_m=args.pq_m)
+        build_seconds = time.perf_counter() - start
+        size = index_size_bytes(index)
+        for param, value in sweep(kind):
+            set_search_params(index, nprobe=value if param == "nprobe" else None,
+                              ef_search=value if param == "efSearch" else None)
+            latencies, found = time_queries(index, queries, args.k)
+            if truth is None:
+                truth = found
+            rows.append({
+                "kind": kind,
+                "param": param,
+                "value": value,
+                "recall_at_k": recall_at_k(found, truth, args.k),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "size_mb": size / 1e6,
+                "build_s": build_seconds,
+            })
+
+    print(f"{'kind':<10}{'param':<14}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'size MB':>10}{'build s':>10}")
+    for row in rows:
+        param = f"{row['param']}={row['value']}" if row["param"] else "-"
+        print(f"{row['kind']:<10}{param:<14}{row['recall_at_k']:>10.3f}{row['p50_ms']:>10.3f}"
+              f"{row['p99_ms']:>10.3f}{row['size_mb']:>10.1f}{row['build_s']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(vectors), "dim": int(vectors.shape[1]), "k": args.k, "results": rows}, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default="vector_index/books.index", help="flat index to take vectors from")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark N synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=384, help="dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--kinds", nargs="+", default=list(INDEX_KINDS), choices=INDEX_KINDS)
+    parser.add_argument("--train-size", type=int, default=50000)
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,161 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests.
+
+Answers ``POST /v1/chat/completions`` like the real API, including SSE streaming
+and tool calls, after a configurable delay and without spending anything:
+
+- requests offering tools get a ``search_book`` call for the last user message,
+  then a text answer once the tool result is in the conversation
+- quiz prompts get a valid 10-question quiz, so the quiz path parses and banks it
+- streams send one chunk per word, ``--token-ms`` apart
+- ``--error-rate`` fails that share of requests with a 500, to exercise retries
+
+Point the app at it with ``OPENAI_BASE_URL=http://127.0.0.1:8100/v1``.
+
+    python benchmarks/fake_openai_server.py --port 8100 --latency-ms 400 --token-ms 15
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from quart import Quart, Response, jsonify, request
+
+ANSWER = (
+    "Here are a few books you might enjoy. Each of them deals with the question you asked, "
+    "and the excerpts above show the tone and style you can expect from the rest of the book."
+)
+
+app = Quart(__name__)
+app.config["FAKE"] = {"latency_ms": 400.0, "jitter_ms": 50.0, "token_ms": 15.0, "tool_rate": 1.0, "error_rate": 0.0}
+
+def _settings():
+    return app.config["FAKE"]
+
+def _quiz():
+    kinds = ["theme", "character", "plot", "moral", "interpretation"]
+    return json.dumps([{
+        "question": f"Question {i + 1} about this excerpt?",
+        "correct_answer": f"Correct answer {i + 1}",
+        "incorrect_answers": [f"Wrong answer {i + 1}.{j}" for j in range(3)],
+        "difficulty": ["easy", "medium"][i % 2],
+        "type": kinds[i % len(kinds)],
+    } for i in range(10)])
+
+def _last_user_message(messages):
+    return next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+
+def _wants_tool(body):
+    if not body.get("tools") or random.random() >= _settings()["tool_rate"]:
+        return False
+    # One round of searching per question, as the real model usually does
+    return not any(m.get("role") == "tool" for m in body.get("messages", []))
+
+def _usage(body, completion):
+    prompt = len(json.dumps(body.get("messages", []))) // 4
+    tokens = len(completion) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": tokens, "total_tokens": prompt + tokens}
+
+def _envelope(body, kind):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": kind,
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+    }
+
+async def _think():
+    settings = _settings()
+    delay = settings["latency_ms"] + random.uniform(-settings["jitter_ms"], settings["jitter_ms"])
+    await asyncio.sleep(max(0.0, delay) / 1000.0)
+
+@app.route("/v1/chat/completions", methods=["POST"])
+async def completions():
+    body = await request.get_json()
+    if random.random() < _settings()["error_rate"]:
+        await _think()
+        return jsonify({"error": {"message": "Injected failure", "type": "server_error"}}), 500
+
+    messages = body.get("messages", [])
+    query = _last_user_message(messages)
+    tool_call = None
+    if _wants_tool(body):
+        tool_call = {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": "search_book", "arguments": json.dumps({"query": query[:200]})},
+        }
+        content = None
+    elif "quiz" in query.lower() and "json" in query.lower():
+        content = _quiz()
+    else:
+        content = ANSWER
+
+    if body.get("stream"):
+        return Response(_stream(body, content, tool_call), mimetype="text/event-stream")
+
+    await _think()
+    message = {"role": "assistant", "content": content}
+    if tool_call is not None:
+        message["tool_calls"] = [tool_call]
+    return jsonify({
+        **_envelope(body, "chat.completion"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+        "usage": _usage(body, content or tool_call["function"]["arguments"]),
+    })
+
+async def _stream(body, content, tool_call):
+    envelope = _envelope(body, "chat.completion.chunk")
+
+    def chunk(delta, finish_reason=None):
+        payload = {**envelope, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(payload)}\n\n"
+
+    await _think()
+    if tool_call is not None:
+        yield chunk({"role": "assistant", "content": None, "tool_calls": [{"index": 0, **tool_call}]})
+        yield chunk({}, "tool_calls")
+    else:
+        yield chunk({"role": "assistant", "content": ""})
+        for word in content.split(" "):
+            await asyncio.sleep(_settings()["token_ms"] / 1000.0)
+            yield chunk({"content": word + " "})
+        yield chunk({}, "stop")
+    yield "data: [DONE]\n\n"
+
+@app.route("/health", methods=["GET"])
+async def health():
+    return jsonify({"status": "ok"})
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="delay before the answer or first token")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="uniform +/- jitter on that delay")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="delay between streamed words")
+    parser.add_argument("--tool-rate", type=float, default=1.0, help="share of tool-enabled requests that call a tool")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail with a 500")
+    return parser.parse_args()
+
+def serve(args):
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    app.config["FAKE"] = {
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "token_ms": args.token_ms,
+        "tool_rate": args.tool_rate,
+        "error_rate": args.error_rate,
+    }
+    config = Config()
+    config.bind = [f"{args.host}:{args.port}"]
+    config.accesslog = None
+    config.backlog = 2048
+    asyncio.run(hypercorn_serve(app, config))
+
+if __name__ == "__main__":
+    serve(parse_args())
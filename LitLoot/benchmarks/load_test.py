@@ -0,0 +1,353 @@
+"""
+Load test for /api/chat, /api/chat/stream and /api/quiz without real OpenAI calls.
+
+Builds a small synthetic index (random vectors, generated text) with the same
+writer as data_prep, starts benchmarks/fake_openai_server.py and the app
+(``wsgi``: app.py on a threaded server, ``asgi``: asgi.py on hypercorn), then
+drives each endpoint with ``--concurrency`` simulated users. Each user keeps its
+own session cookie, so history grows the way it does for real users.
+
+Reports requests per second and p50/p95/p99 latency per endpoint, and per stage
+(embed, faiss, chunk_read, openai, ...) from each response's Server-Timing
+header. ``--json`` writes the results. ``--baseline`` compares them with an
+earlier run and exits non-zero if any p95 regressed by more than ``--max-regression``.
+
+    python benchmarks/load_test.py --server asgi --concurrency 32 --requests 300 --json load.json
+    python benchmarks/load_test.py --fake-encoder --baseline load.json   # offline, no model download
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENDPOINTS = ("chat", "chat_stream", "quiz")
+WORDS = (
+    "love war sea ship whale island war peace family money marriage murder ghost castle "
+    "revolution journey letter secret king queen village city river mountain storm winter "
+    "friendship betrayal madness science monster orphan school prison inheritance duel "
+    "garden forest night fire memory letter soldier captain doctor priest widow heir"
+).split()
+EMBEDDING_DIM = 384
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def build_index(output_dir, books, chunks_per_book, seed):
+    """A synthetic corpus in the data_prep layout. Vectors are random, so only timings are meaningful."""
+    from data_prep.generate_vector_index_from_gutenberg import Book, IndexWriter, content_hash
+
+    rng = random.Random(seed)
+    vectors = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    writer = IndexWriter(output_dir)
+    for i in range(books):
+        chunks = [sentence(rng, 400) for _ in range(chunks_per_book)]
+        book = Book(f"Synthetic Book {i}", f"Author {i % 50}", "\n".join(chunks), "", "")
+        digest = content_hash(book.text)
+        book_id = writer.add_book(book, digest)
+        first_chunk = len(writer)
+        embeddings = vectors.normal(size=(chunks_per_book, EMBEDDING_DIM)).astype("float32")
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        writer.add_batch(chunks, [(book_id, j) for j in range(chunks_per_book)], embeddings)
+        writer.finish_book(digest, book_id, book.title, first_chunk, chunks_per_book)
+    writer.close(remove_missing=False)
+
+def install_fake_encoder():
+    """Stand in for sentence_transformers: deterministic vectors, no torch, no download."""
+    module = types.ModuleType("sentence_transformers")
+
+    class SentenceTransformer:
+        def __init__(self, name, **kwargs):
+            self.name = name
+
+        def encode(self, texts, **kwargs):
+            vectors = np.stack([
+                np.random.default_rng(abs(hash(text)) % 2 ** 32).normal(size=EMBEDDING_DIM) for text in texts
+            ]).astype("float32")
+            return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    module.SentenceTransformer = SentenceTransformer
+    sys.modules["sentence_transformers"] = module
+
+def serve_app(args):
+    """Entry point of the app subprocess: serve app.py or asgi.py from the work directory."""
+    os.chdir(args.workdir)
+    if args.fake_encoder:
+        install_fake_encoder()
+    if args.serve == "asgi":
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+        from asgi import app
+
+        config = Config()
+        config.bind = [f"127.0.0.1:{args.port}"]
+        config.accesslog = None
+        config.backlog = 2048
+        asyncio.run(serve(app, config))
+    else:
+        from werkzeug.serving import make_server
+        from app import app
+
+        make_server("127.0.0.1", args.port, app, threaded=True).serve_forever()
+
+def start(command, env, log_path):
+    log = open(log_path, "w")
+    return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+
+async def wait_until_ready(url, process, timeout):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}; see its log in the work directory")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready after {timeout}s")
+
+def parse_server_timing(header):
+    """``{stage: milliseconds}`` from a Server-Timing header."""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            if param.startswith("dur="):
+                stages[name] = float(param[4:])
+    return stages
+
+def make_request(endpoint, rng, books):
+    if endpoint == "quiz":
+        # Half name a book (title fast path, then the quiz bank), half are topics (semantic search)
+        if rng.random() < 0.5:
+            return {"query": f"Synthetic Book {rng.randrange(books)}"}
+        return {"query": f"a story about {sentence(rng, 3)}"}
+    return {"query": f"Can you recommend a book about {sentence(rng, 4)}?"}
+
+async def one_request(client, endpoint, body):
+    path = {"chat": "/api/chat", "chat_stream": "/api/chat/stream", "quiz": "/api/quiz"}[endpoint]
+    start = time.perf_counter()
+    if endpoint != "chat_stream":
+        response = await client.post(path, json=body)
+        return {
+            "status": response.status_code,
+            "ms": (time.perf_counter() - start) * 1000,
+            "stages": parse_server_timing(response.headers.get("server-timing")),
+        }
+    first_token = None
+    async with client.stream("POST", path, json=body) as response:
+        async for line in response.aiter_lines():
+            if first_token is None and line.startswith("event: token"):
+                first_token = (time.perf_counter() - start) * 1000
+            if line.startswith("event: error"):
+                return {"status": 500, "ms": (time.perf_counter() - start) * 1000, "stages": {}}
+        result = {
+            "status": response.status_code,
+            "ms": (time.perf_counter() - start) * 1000,
+            "stages": parse_server_timing(response.headers.get("server-timing")),
+        }
+    if first_token is not None:
+        result["stages"]["first_token"] = first_token
+    return result
+
+async def run_endpoint(base_url, endpoint, args):
+    """Drive one endpoint with ``concurrency`` users until ``requests`` have completed."""
+    remaining = args.requests + args.warmup
+    samples = []
+    started = None
+
+    async def user(index):
+        nonlocal remaining, started
+        rng = random.Random(args.seed * 1000 + index)
+        # Each user has its own cookie jar, so its session and history persist across requests
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+            while remaining > 0:
+                remaining -= 1
+                warmup = remaining >= args.requests
+                if not warmup and started is None:
+                    started = time.perf_counter()
+                try:
+                    result = await one_request(client, endpoint, make_request(endpoint, rng, args.books))
+                except httpx.HTTPError as e:
+                    result = {"status": 0, "ms": 0.0, "stages": {}, "error": str(e)}
+                if not warmup:
+                    samples.append(result)
+
+    await asyncio.gather(*(user(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - (started or time.perf_counter())
+    return summarize(samples, elapsed)
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+def summarize(samples, elapsed):
+    ok = [sample for sample in samples if 200 <= sample["status"] < 300]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample["status"])] = statuses.get(str(sample["status"]), 0) + 1
+    stage_names = sorted({stage for sample in ok for stage in sample["stages"]})
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "statuses": statuses,
+        "seconds": elapsed,
+        "rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+        "latency": percentiles([sample["ms"] for sample in ok]),
+        # A stage's time summed over the request; requests that skipped it are left out
+        "stages": {
+            stage: percentiles([sample["stages"][stage] for sample in ok if stage in sample["stages"]])
+            for stage in stage_names
+        },
+    }
+
+def print_report(results):
+    print(f"\n{'endpoint':<14}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, result in results.items():
+        latency = result["latency"] or {"p50_ms": 0, "p95_ms": 0, "p99_ms": 0}
+        print(f"{endpoint:<14}{result['requests']:>9}{result['errors']:>8}{result['rps']:>9.1f}"
+              f"{latency['p50_ms']:>10.1f}{latency['p95_ms']:>10.1f}{latency['p99_ms']:>10.1f}")
+        for stage, stats in result["stages"].items():
+            print(f"  {stage:<29}{stats['p50_ms']:>19.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+def compare(results, baseline_path, max_regression, min_ms):
+    """Endpoints and stages whose p95 grew by more than ``max_regression`` and ``min_ms``."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for endpoint, result in results.items():
+        before = baseline.get(endpoint)
+        if not before:
+            continue
+        pairs = [(endpoint, before["latency"], result["latency"])]
+        pairs += [(f"{endpoint}.{stage}", before["stages"].get(stage), stats)
+                  for stage, stats in result["stages"].items()]
+        for name, old, new in pairs:
+            if not old or not new:
+                continue
+            # Sub-millisecond stages swing by large ratios from scheduling noise alone
+            if new["p95_ms"] > old["p95_ms"] * (1 + max_regression) and new["p95_ms"] - old["p95_ms"] > min_ms:
+                regressions.append(f"{name}: p95 {old['p95_ms']:.2f}ms -> {new['p95_ms']:.2f}ms")
+    return regressions
+
+async def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="litloot-load-")
+    print(f"Work directory: {workdir}")
+    if not os.path.exists(os.path.join(workdir, "vector_index", "manifest.json")):
+        print(f"Building a synthetic index of {args.books} books x {args.chunks_per_book} chunks...")
+        build_index(os.path.join(workdir, "vector_index"), args.books, args.chunks_per_book, args.seed)
+
+    openai_port, app_port = free_port(), free_port()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "LITLOOT_TIMING_HEADER": "true",
+        "LITLOOT_LOG_FILE": "",
+        "LITLOOT_LOG_SAMPLE_RATE": "0",
+        **dict(item.split("=", 1) for item in args.env),
+    }
+    fake = start([sys.executable, os.path.join("benchmarks", "fake_openai_server.py"), "--port", str(openai_port),
+                  "--latency-ms", str(args.latency_ms), "--token-ms", str(args.token_ms),
+                  "--error-rate", str(args.error_rate)], env, os.path.join(workdir, "fake_openai.log"))
+    app_command = [sys.executable, os.path.abspath(__file__), "--serve", args.server,
+                   "--port", str(app_port), "--workdir", workdir]
+    if args.fake_encoder:
+        app_command.append("--fake-encoder")
+    app = start(app_command, env, os.path.join(workdir, "app.log"))
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{openai_port}/health", fake, 30)
+        await wait_until_ready(f"http://127.0.0.1:{app_port}/readyz", app, args.startup_timeout)
+        results = {}
+        for endpoint in args.endpoints:
+            print(f"Running {endpoint}: {args.requests} requests at concurrency {args.concurrency}...")
+            results[endpoint] = await run_endpoint(f"http://127.0.0.1:{app_port}", endpoint, args)
+    finally:
+        for process in (app, fake):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if args.json:
+        config = {key: getattr(args, key) for key in (
+            "server", "concurrency", "requests", "books", "chunks_per_book", "latency_ms", "token_ms",
+            "error_rate", "fake_encoder", "env")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression, args.min_regression_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="asgi")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated users per endpoint")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each endpoint")
+    parser.add_argument("--timeout", type=float, default=60.0, help="client timeout per request, in seconds")
+    parser.add_argument("--books", type=int, default=200, help="books in the synthetic index")
+    parser.add_argument("--chunks-per-book", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="fake OpenAI delay per completion")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="fake OpenAI delay between streamed words")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake OpenAI calls that fail")
+    parser.add_argument("--fake-encoder", action="store_true",
+                        help="replace the sentence-transformers encoder (offline runs; embed times are not real)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app, e.g. --env LITLOOT_QUIZ_BANK=false")
+    parser.add_argument("--startup-timeout", type=float, default=300.0, help="seconds to wait for /readyz")
+    parser.add_argument("--workdir", help="reuse this directory (and its index) instead of a temporary one")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary work directory and logs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare p95s against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 growth over the baseline")
+    parser.add_argument("--min-regression-ms", type=float, default=2.0,
+                        help="ignore p95 growth smaller than this many milliseconds")
+    # Internal: run as the app subprocess
+    parser.add_argument("--serve", choices=("wsgi", "asgi"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.serve:
+        serve_app(arguments)
+    else:
+        sys.exit(asyncio.run(run(arguments)))
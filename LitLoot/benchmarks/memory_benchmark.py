@@ -0,0 +1,272 @@
+"""
+Host memory of N app workers: per-worker loading vs. the pre-fork mode.
+
+Forks workers from a master that has imported app.py, as gunicorn does with
+``preload_app``. Each worker then serves ``--requests`` ``/api/search`` calls
+through the Flask test client, so every loaded structure is actually touched.
+With all workers idle, the master, the workers and the embedding server are
+measured from ``/proc/<pid>/smaps_rollup``. Modes:
+
+- ``per-worker``: nothing preloaded; each worker loads its own copy (no ``--preload``)
+- ``prefork``: ``LITLOOT_PREFORK=true``; the master loads everything and workers share it
+- ``prefork+server``: the same, with queries encoded by one ``services.embedding_server``
+
+The key figure is total PSS (proportional set size). It splits each shared page
+among the processes that map it, so it adds up to the RAM the host actually uses.
+RSS counts shared pages once per process and overstates it.
+
+Without sentence-transformers, or with ``--fake-encoder``, a stand-in encoder
+holding an all-MiniLM-L6-v2-sized weight matrix (about 90 MB) is used. Its
+memory behaves like the real model's, but embed times mean nothing.
+
+    python benchmarks/memory_benchmark.py --workers 1 4 16 --json memory.json
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.load_test import EMBEDDING_DIM, WORDS, build_index
+
+MODES = ("per-worker", "prefork", "prefork+server")
+# all-MiniLM-L6-v2 has about 22.7M parameters
+FAKE_ENCODER_PARAMS = 22_700_000
+
+
+def install_fake_encoder():
+    """A sentence_transformers stand-in whose weights take as much memory as the real model's."""
+    module = types.ModuleType("sentence_transformers")
+
+    class SentenceTransformer:
+        def __init__(self, name, **kwargs):
+            rows = FAKE_ENCODER_PARAMS // EMBEDDING_DIM
+            self.weights = np.random.default_rng(0).normal(size=(rows, EMBEDDING_DIM)).astype("float32")
+
+        def encode(self, texts, **kwargs):
+            # Hashed bag of words times every weight row, so encoding reads the whole matrix
+            features = np.zeros((len(texts), len(self.weights)), dtype="float32")
+            for row, text in enumerate(texts):
+                for word in text.lower().split():
+                    features[row, hash(word) % len(self.weights)] += 1.0
+            vectors = features @ self.weights
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+
+    module.SentenceTransformer = SentenceTransformer
+    sys.modules["sentence_transformers"] = module
+
+
+def memory_kb(pid):
+    """``Rss``, ``Pss`` and private (``Private_Clean`` + ``Private_Dirty``) kB of one process."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {"rss": fields["Rss"], "pss": fields["Pss"],
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+def wait_for_embedding_server(address, process, timeout=300):
+    from services.embedding_server import EmbeddingClient
+    from services.rpc import RemoteCallError, parse_address
+
+    client = EmbeddingClient(parse_address(address), os.environ["LITLOOT_RPC_AUTHKEY"].encode())
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Embedding server exited with code {process.returncode}")
+        try:
+            return client.info()
+        except RemoteCallError:
+            time.sleep(0.5)
+    raise RuntimeError(f"Embedding server was not up after {timeout}s")
+
+
+def run_worker(args, done):
+    """Serve this worker's share of searches, report, then idle until killed."""
+    from app import app
+
+    rng = np.random.default_rng(os.getpid())
+    client = app.test_client()
+    for _ in range(args.requests):
+        queries = [" ".join(rng.choice(WORDS, 6)) for _ in range(args.queries_per_request)]
+        response = client.post("/api/search", json={"queries": queries, "k": 5, "per_book": True})
+        if response.status_code != 200:
+            os.write(done, b"E")
+            break
+    else:
+        os.write(done, b"K")
+    while True:
+        signal.pause()
+
+
+def measure(args):
+    """One mode at one worker count; prints a JSON result line. Runs in the work directory."""
+    os.chdir(args.workdir)
+    if args.fake_encoder:
+        install_fake_encoder()
+    server = None
+    if args.measure == "prefork+server":
+        command = [sys.executable, os.path.abspath(__file__), "--serve-embeddings", os.environ["LITLOOT_EMBEDDING_SERVER"]]
+        if args.fake_encoder:
+            command.append("--fake-encoder")
+        server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_embedding_server(os.environ["LITLOOT_EMBEDDING_SERVER"], server)
+
+    start = time.perf_counter()
+    import app  # noqa: F401 - the master's import, which preloads in the pre-fork modes
+    master_load = time.perf_counter() - start
+
+    read_end, write_end = os.pipe()
+    workers = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            try:
+                run_worker(args, write_end)
+            finally:
+                os._exit(0)
+        workers.append(pid)
+    os.close(write_end)
+    statuses = b""
+    while len(statuses) < args.workers:
+        chunk = os.read(read_end, args.workers)
+        if not chunk:
+            break
+        statuses += chunk
+
+    try:
+        master = memory_kb(os.getpid())
+        per_worker = [memory_kb(pid) for pid in workers]
+        sidecar = memory_kb(server.pid) if server else {"rss": 0, "pss": 0, "private": 0}
+    finally:
+        for pid in workers:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        if server:
+            server.terminate()
+            server.wait(30)
+
+    total_pss = master["pss"] + sidecar["pss"] + sum(w["pss"] for w in per_worker)
+    total_rss = master["rss"] + sidecar["rss"] + sum(w["rss"] for w in per_worker)
+    print(json.dumps({
+        "mode": args.measure,
+        "workers": args.workers,
+        "failed_workers": statuses.count(b"E") + args.workers - len(statuses),
+        "total_pss_mb": total_pss / 1024,
+        "total_rss_mb": total_rss / 1024,
+        "master_pss_mb": master["pss"] / 1024,
+        "embedding_server_pss_mb": sidecar["pss"] / 1024,
+        "worker_private_mb": float(np.mean([w["private"] for w in per_worker])) / 1024,
+        "master_load_s": master_load,
+    }))
+
+
+def serve_embeddings(args):
+    if args.fake_encoder:
+        install_fake_encoder()
+    from services.embedding_server import ENCODER_CALLS, Encoder
+    from services.rpc import parse_address, serve
+
+    serve(parse_address(args.serve_embeddings), os.environ["LITLOOT_RPC_AUTHKEY"].encode(),
+          Encoder(), ENCODER_CALLS, "encoder")
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="litloot-memory-")
+    try:
+        if not os.path.exists(os.path.join(workdir, "vector_index", "manifest.json")):
+            print(f"Building a synthetic index of {args.books} books x {args.chunks_per_book} chunks...")
+            build_index(os.path.join(workdir, "vector_index"), args.books, args.chunks_per_book, args.seed)
+        results = []
+        for workers in args.workers:
+            for mode in args.modes:
+                env = {
+                    **os.environ,
+                    "OPENAI_API_KEY": "sk-memory-benchmark",
+                    "LITLOOT_PREFORK": "false" if mode == "per-worker" else "true",
+                    "LITLOOT_WARM_UP": "false",
+                    "LITLOOT_LOG_FILE": "",
+                    "LITLOOT_LOG_SAMPLE_RATE": "0",
+                    "LITLOOT_CACHE_BACKEND": "memory",
+                    "LITLOOT_HISTORY_BACKEND": "memory",
+                    "LITLOOT_INDEX_MMAP": "true" if args.mmap else "false",
+                }
+                if mode == "prefork+server":
+                    env["LITLOOT_EMBEDDING_SERVER"] = os.path.join(workdir, "embedding.sock")
+                    env["LITLOOT_RPC_AUTHKEY"] = secrets.token_hex(16)
+                command = [sys.executable, os.path.abspath(__file__), "--measure", mode, "--workers", str(workers),
+                           "--workdir", workdir, "--requests", str(args.requests),
+                           "--queries-per-request", str(args.queries_per_request)]
+                if args.fake_encoder:
+                    command.append("--fake-encoder")
+                print(f"Measuring {mode} with {workers} workers...")
+                output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+                if output.returncode:
+                    raise RuntimeError(f"{mode} x {workers} failed:\n{output.stderr[-3000:]}")
+                results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'mode':<16}{'workers':>8}{'total PSS MB':>14}{'total RSS MB':>14}{'per worker MB':>15}"
+          f"{'master MB':>11}{'embed srv MB':>14}")
+    for row in results:
+        print(f"{row['mode']:<16}{row['workers']:>8}{row['total_pss_mb']:>14.0f}{row['total_rss_mb']:>14.0f}"
+              f"{row['worker_private_mb']:>15.1f}{row['master_pss_mb']:>11.0f}{row['embedding_server_pss_mb']:>14.0f}")
+    print("\n'per worker' is each worker's private memory: what one more worker adds.")
+    if any(row["failed_workers"] for row in results):
+        print("WARNING: some workers failed their searches; see the failed_workers field")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"books": args.books, "chunks_per_book": args.chunks_per_book, "fake_encoder": args.fake_encoder,
+                       "mmap": args.mmap, "results": results}, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--books", type=int, default=500, help="books in the synthetic index")
+    parser.add_argument("--chunks-per-book", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=20, help="searches per worker before measuring")
+    parser.add_argument("--queries-per-request", type=int, default=4)
+    parser.add_argument("--mmap", action="store_true", help="also set LITLOOT_INDEX_MMAP=true")
+    parser.add_argument("--fake-encoder", action="store_true",
+                        help="use the weighted stand-in encoder even if sentence-transformers is installed")
+    parser.add_argument("--workdir", help="reuse this directory (and its index) instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write results to this file")
+    # Internal: one measurement, or the embedding server, as a subprocess
+    parser.add_argument("--measure", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--serve-embeddings", metavar="ADDRESS", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        args.fake_encoder = True
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.serve_embeddings:
+        serve_embeddings(arguments)
+    elif arguments.measure:
+        arguments.workers = arguments.workers[0]
+        measure(arguments)
+    else:
+        run(arguments)
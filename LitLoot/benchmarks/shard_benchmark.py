@@ -0,0 +1,153 @@
+"""
+In-process index vs. the same index split into shards searched by scatter-gather.
+
+Builds a random corpus in the data_prep layout (``books.index`` with chunk-row
+ids, plus ``chunk_meta.npy``), then for each shard count splits it with
+``write_shards``, starts ``python -m services.shards serve`` and searches it
+through ``ShardedIndex``, as ``vector_store`` does with ``LITLOOT_SEARCH_SHARDS``.
+
+Reported per setup: single-query p50/p99 latency, throughput with
+``--concurrency`` client threads, and top-k overlap with the in-process index
+(1.0 for exact index kinds; the merge itself loses nothing).
+
+    python benchmarks/shard_benchmark.py --vectors 500000 --shards 1 2 4 --json shards.json
+"""
+import argparse
+import json
+import logging
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from services.index_factory import INDEX_KINDS, create_index, set_search_params, train_index
+from services.shards import ShardedIndex, write_shards
+
+AUTHKEY = secrets.token_hex(16).encode()
+
+
+def build_corpus(index_dir, args):
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.normal(size=(args.vectors, args.dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexIDMap2(create_index(args.index_type, args.dim, len(vectors), nlist=args.nlist))
+    train_index(index, vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64"))
+    os.makedirs(index_dir, exist_ok=True)
+    faiss.write_index(index, os.path.join(index_dir, "books.index"))
+    book_ids = np.arange(len(vectors)) // args.chunks_per_book
+    chunk_index = np.arange(len(vectors)) % args.chunks_per_book
+    np.save(os.path.join(index_dir, "chunk_meta.npy"), np.stack([book_ids, chunk_index], axis=1).astype("int32"))
+    set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    return index
+
+
+def measure(name, search, queries, k, concurrency, reference=None):
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, indices = search(query[None], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(indices[0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda query: search(query[None], k), queries))
+    qps = len(queries) / (time.perf_counter() - start)
+    overlap = 1.0 if reference is None else float(np.mean([
+        len(set(a.tolist()) & set(b.tolist())) / float(k) for a, b in zip(found, reference)
+    ]))
+    return {
+        "setup": name,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "qps": qps,
+        "overlap": overlap,
+    }, found
+
+
+def wait_for_shards(sharded, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Shard servers exited with code {server.returncode}")
+        if all(info is not None for info in sharded.info()):
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"Shard servers were not up after {timeout}s")
+
+
+def run(args):
+    # Shards still starting are expected to refuse connections
+    logging.getLogger().setLevel(logging.ERROR)
+    workdir = tempfile.mkdtemp(prefix="litloot-shards-")
+    try:
+        index_dir = os.path.join(workdir, "vector_index")
+        print(f"Building a {args.index_type} index of {args.vectors} vectors, dim {args.dim}...")
+        index = build_corpus(index_dir, args)
+        queries = np.random.default_rng(args.seed + 1).normal(size=(args.queries, args.dim)).astype("float32")
+        faiss.normalize_L2(queries)
+
+        row, reference = measure("in-process", index.search, queries, args.k, args.concurrency)
+        results = [row]
+        for count in args.shards:
+            write_shards(index_dir, count)
+            env = {**os.environ, "LITLOOT_RPC_AUTHKEY": AUTHKEY.decode()}
+            server = subprocess.Popen(
+                [sys.executable, "-m", "services.shards", "serve", os.path.join(index_dir, "shards"),
+                 "--base-port", str(args.base_port), "--nprobe", str(args.nprobe),
+                 "--ef-search", str(args.ef_search), "--threads", str(args.threads)],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                sharded = ShardedIndex([f"127.0.0.1:{args.base_port + i}" for i in range(count)], AUTHKEY,
+                                       timeout=30, concurrency=args.concurrency)
+                wait_for_shards(sharded, server)
+                row, _ = measure(f"{count} shards", sharded.search, queries, args.k, args.concurrency, reference)
+                results.append(row)
+            finally:
+                server.terminate()
+                server.wait(30)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'setup':<14}{'p50 ms':>9}{'p99 ms':>9}{'qps':>9}{'overlap':>9}")
+    for row in results:
+        print(f"{row['setup']:<14}{row['p50_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['qps']:>9.0f}{row['overlap']:>9.3f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"vectors": args.vectors, "index_type": args.index_type, "k": args.k,
+                       "concurrency": args.concurrency, "cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--chunks-per-book", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--index-type", choices=INDEX_KINDS, default="flat")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads per shard server")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads for the throughput run")
+    parser.add_argument("--base-port", type=int, default=9150)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
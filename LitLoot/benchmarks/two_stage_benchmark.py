@@ -0,0 +1,170 @@
+"""
+Chunk search vs. two-stage (book centroid, then chunks of those books) search.
+
+Generates a synthetic corpus of books whose chunks scatter around a per-book
+topic vector, and measures, for the top ``k`` distinct books per query:
+
+- ``chunks``: plain top-k chunk search, as ``LITLOOT_SEARCH_MODE=chunks`` runs it
+- ``chunks+dedupe``: top ``k * overfetch`` chunks kept to one per book (``/api/search``
+  with ``per_book``)
+- ``two_stage N``: the N nearest books on the centroid index, then only their chunks
+
+Ground truth is each book's best chunk over the whole corpus, ranked exactly.
+Reported per method: distinct books per query, book recall@k against that truth,
+vectors scanned per query and single-query p50/p99 latency.
+
+    python benchmarks/two_stage_benchmark.py --books 5000 --chunks-per-book 200 --k 5 --json two_stage.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.index_factory import INDEX_KINDS, create_index, filtered_search_params, set_search_params, train_index
+
+CANDIDATE_SWEEP = (10, 20, 50)
+
+
+def make_corpus(args):
+    """Chunk vectors (unit length, row = chunk id), each chunk's book, and normalized book centroids."""
+    rng = np.random.default_rng(args.seed)
+    topics = rng.normal(size=(args.books, args.dim)).astype("float32")
+    vectors = np.repeat(topics, args.chunks_per_book, axis=0)
+    vectors += args.spread * rng.normal(size=vectors.shape).astype("float32")
+    faiss.normalize_L2(vectors)
+    book_of = np.repeat(np.arange(args.books), args.chunks_per_book)
+    centroids = vectors.reshape(args.books, args.chunks_per_book, args.dim).mean(axis=1)
+    faiss.normalize_L2(centroids)
+    return vectors, book_of, np.ascontiguousarray(centroids, dtype="float32")
+
+
+def make_queries(vectors, n_queries, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.choice(len(vectors), n_queries, replace=False)].copy()
+    queries += 0.5 * rng.normal(size=queries.shape).astype("float32") / np.sqrt(queries.shape[1])
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def first_per_book(indices, book_of, k):
+    books = []
+    for i in indices:
+        if i < 0:
+            break
+        if book_of[i] not in books:
+            books.append(int(book_of[i]))
+            if len(books) == k:
+                break
+    return books
+
+
+def true_books(vectors, book_of, queries, k):
+    """Top-k books by their best chunk, from exact distances to every chunk."""
+    truth = []
+    for query in queries:
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        best = np.full(book_of.max() + 1, np.inf)
+        np.minimum.at(best, book_of, distances)
+        truth.append([int(b) for b in np.argsort(best)[:k]])
+    return truth
+
+
+def measure(name, queries, truth, k, search_one):
+    latencies, recalls, distinct, scanned = [], [], [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        books, scanned_vectors = search_one(query[None])
+        latencies.append((time.perf_counter() - start) * 1000)
+        distinct.append(len(books))
+        recalls.append(len(set(books) & set(expected)) / float(k))
+        scanned.append(scanned_vectors)
+    return {
+        "method": name,
+        "distinct_books": float(np.mean(distinct)),
+        "book_recall": float(np.mean(recalls)),
+        "scanned": float(np.mean(scanned)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def run(args):
+    vectors, book_of, centroids = make_corpus(args)
+    print(f"{args.books} books x {args.chunks_per_book} chunks = {len(vectors)} vectors, dim {args.dim}")
+    # Wrapped like the built index, so the selector goes through the same id translation
+    index = faiss.IndexIDMap2(create_index(args.index_type, args.dim, len(vectors), nlist=args.nlist))
+    train_index(index, vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64"))
+    set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    book_index = faiss.IndexFlatL2(args.dim)
+    book_index.add(centroids)
+
+    queries = make_queries(vectors, args.queries, args.seed)
+    truth = true_books(vectors, book_of, queries, args.k)
+    n_chunks = len(vectors)
+
+    def chunks(query):
+        _, indices = index.search(query, args.k)
+        return first_per_book(indices[0], book_of, args.k), n_chunks
+
+    def chunks_dedupe(query):
+        _, indices = index.search(query, args.k * args.overfetch)
+        return first_per_book(indices[0], book_of, args.k), n_chunks
+
+    def two_stage(candidates):
+        def search_one(query):
+            _, books = book_index.search(query, candidates)
+            rows = np.concatenate([
+                np.arange(b * args.chunks_per_book, (b + 1) * args.chunks_per_book, dtype="int64") for b in books[0]
+            ])
+            params = filtered_search_params(index, faiss.IDSelectorBatch(rows), exhaustive=True)
+            _, indices = index.search(query, len(rows), params=params)
+            return first_per_book(indices[0], book_of, args.k), args.books + len(rows)
+        return search_one
+
+    results = [
+        measure("chunks", queries, truth, args.k, chunks),
+        measure("chunks+dedupe", queries, truth, args.k, chunks_dedupe),
+    ]
+    results += [
+        measure(f"two_stage {n}", queries, truth, args.k, two_stage(n))
+        for n in CANDIDATE_SWEEP if n >= args.k and n <= args.books
+    ]
+
+    print(f"\n{'method':<16}{'books/query':>12}{'recall':>9}{'scanned':>11}{'p50 ms':>9}{'p99 ms':>9}")
+    for row in results:
+        print(f"{row['method']:<16}{row['distinct_books']:>12.2f}{row['book_recall']:>9.3f}"
+              f"{row['scanned']:>11.0f}{row['p50_ms']:>9.3f}{row['p99_ms']:>9.3f}")
+    print("\n'scanned' counts vectors compared per query; an IVF chunk index compares fewer than all of them.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"vectors": n_chunks, "books": args.books, "k": args.k, "index_type": args.index_type,
+                       "results": results}, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--chunks-per-book", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--spread", type=float, default=0.5, help="chunk noise around each book's topic")
+    parser.add_argument("--index-type", choices=INDEX_KINDS, default="flat")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--overfetch", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -12,8 +12,163 @@ if not OPENAI_API_KEY:
 
 # Vector Index Paths
 VECTOR_INDEX_PATH: Final[str] = "vector_index/books.index"
-METADATA_PATH: Final[str] = "vector_index/metadata.json"
+METADATA_PATH: Final[str] = "vector_index/metadata.json"  # legacy, see data_prep/convert_metadata.py
+BOOKS_PATH: Final[str] = "vector_index/books.json"
+CHUNK_META_PATH: Final[str] = "vector_index/chunk_meta.npy"
+CHUNK_DATA_PATH: Final[str] = "vector_index/chunks.bin"
+CHUNK_OFFSETS_PATH: Final[str] = "vector_index/chunk_offsets.npy"
+BOOK_INDEX_PATH: Final[str] = "vector_index/book_centroids.index"
+
+# Memory-map the FAISS index instead of reading it into RAM, so workers share the page cache
+INDEX_MMAP: Final[bool] = os.getenv("LITLOOT_INDEX_MMAP", "false").lower() == "true"
+# Load the encoder, index and metadata in the background at startup instead of on first search
+WARM_UP_ON_START: Final[bool] = os.getenv("LITLOOT_WARM_UP", "true").lower() == "true"
+# Pre-fork deployment (gunicorn --preload, see gunicorn.conf.py): load the index, metadata,
+# chunk store and encoder once in the master, before workers are forked, so they share it
+PREFORK: Final[bool] = os.getenv("LITLOOT_PREFORK", "false").lower() == "true"
+
+# Add a Server-Timing header with each response's per-stage breakdown (embed, faiss,
+# chunk_read, openai, ...). Off by default, since it shows clients where time goes.
+TIMING_HEADER: Final[bool] = os.getenv("LITLOOT_TIMING_HEADER", "false").lower() == "true"
+
+# Chat tool loop: model round-trips that may request tools, and threads running them
+CHAT_MAX_TOOL_ROUNDS: Final[int] = int(os.getenv("LITLOOT_CHAT_MAX_TOOL_ROUNDS", "3"))
+CHAT_TOOL_WORKERS: Final[int] = int(os.getenv("LITLOOT_CHAT_TOOL_WORKERS", "4"))
+
+# Signs the session cookie. Every worker has to use the same key, or a session started on
+# one worker is unreadable on the others. If unset, each process picks a random key and
+# warns, so sessions last only as long as the process that started them.
+SECRET_KEY: Final[str] = os.getenv("LITLOOT_SECRET_KEY", "")
+
+# Conversation history, kept server-side and keyed by a session id in the cookie:
+# "memory" (per process, LRU over sessions) or "sqlite" (shared by all workers on the host).
+# Each session keeps its last HISTORY_MAX_TURNS turns; idle sqlite sessions expire after the TTL.
+HISTORY_BACKEND: Final[str] = os.getenv("LITLOOT_HISTORY_BACKEND", "sqlite")
+HISTORY_MAX_SESSIONS: Final[int] = int(os.getenv("LITLOOT_HISTORY_MAX_SESSIONS", "10000"))
+HISTORY_MAX_TURNS: Final[int] = int(os.getenv("LITLOOT_HISTORY_MAX_TURNS", "100"))
+HISTORY_TTL_SECONDS: Final[float] = float(os.getenv("LITLOOT_HISTORY_TTL_SECONDS", str(7 * 24 * 3600)))
+HISTORY_SQLITE_PATH: Final[str] = os.getenv("LITLOOT_HISTORY_SQLITE_PATH", "cache/litloot_history.sqlite3")
+# Prompt tokens of history sent with each chat request; older turns are summarized away
+CHAT_HISTORY_TOKEN_BUDGET: Final[int] = int(os.getenv("LITLOOT_CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+
+# Semantic cache for first-turn /api/chat answers, per process and off by default: a query
+# at least THRESHOLD cosine-similar to a cached one gets its answer and books. Requests
+# can skip it with {"cache": false}. A TTL of 0 keeps entries until evicted.
+SEMANTIC_CACHE_ENABLED: Final[bool] = os.getenv("LITLOOT_SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD: Final[float] = float(os.getenv("LITLOOT_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES: Final[int] = int(os.getenv("LITLOOT_SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_TTL_SECONDS: Final[float] = float(os.getenv("LITLOOT_SEMANTIC_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# OpenAI connection pool, shared by every request in a process
+OPENAI_MAX_CONNECTIONS: Final[int] = int(os.getenv("LITLOOT_OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS: Final[int] = int(os.getenv("LITLOOT_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+OPENAI_KEEPALIVE_EXPIRY: Final[float] = float(os.getenv("LITLOOT_OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Retries for OpenAI calls: transient errors only, with jittered exponential backoff
+# (or Retry-After), all within a per-call deadline. After BREAKER_FAILURES consecutive
+# transient failures calls fail fast for BREAKER_RESET_SECONDS, then one is tried again.
+OPENAI_RETRY_ATTEMPTS: Final[int] = int(os.getenv("LITLOOT_OPENAI_RETRY_ATTEMPTS", "3"))
+OPENAI_RETRY_BASE_DELAY: Final[float] = float(os.getenv("LITLOOT_OPENAI_RETRY_BASE_DELAY", "0.5"))
+OPENAI_RETRY_MAX_DELAY: Final[float] = float(os.getenv("LITLOOT_OPENAI_RETRY_MAX_DELAY", "8"))
+OPENAI_DEADLINE_SECONDS: Final[float] = float(os.getenv("LITLOOT_OPENAI_DEADLINE_SECONDS", "30"))
+OPENAI_BREAKER_FAILURES: Final[int] = int(os.getenv("LITLOOT_OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_RESET_SECONDS: Final[float] = float(os.getenv("LITLOOT_OPENAI_BREAKER_RESET_SECONDS", "30"))
+
+# Client-side quota for OpenAI calls in this process: requests and tokens per minute
+# (0 = unlimited), with up to BURST_SECONDS of quota spent at once. Calls that cannot go
+# yet queue by priority (chat, then quizzes, then background jobs); past QUEUE_SIZE
+# waiting, or QUEUE_TIMEOUT_SECONDS of expected wait, they are refused with a 503.
+# With several workers, give each its share of the account's limits.
+OPENAI_RPM: Final[float] = float(os.getenv("LITLOOT_OPENAI_RPM", "0"))
+OPENAI_TPM: Final[float] = float(os.getenv("LITLOOT_OPENAI_TPM", "0"))
+OPENAI_RATE_BURST_SECONDS: Final[float] = float(os.getenv("LITLOOT_OPENAI_RATE_BURST_SECONDS", "10"))
+OPENAI_QUEUE_SIZE: Final[int] = int(os.getenv("LITLOOT_OPENAI_QUEUE_SIZE", "256"))
+OPENAI_QUEUE_TIMEOUT_SECONDS: Final[float] = float(os.getenv("LITLOOT_OPENAI_QUEUE_TIMEOUT_SECONDS", "10"))
+
+# Threads for embedding and FAISS work handed off by the async (ASGI) routes
+SEARCH_WORKERS: Final[int] = int(os.getenv("LITLOOT_SEARCH_WORKERS", "4"))
+
+# Query-time recall/latency knobs for IVF (nprobe) and HNSW (efSearch) indexes
+SEARCH_NPROBE: Final[int] = int(os.getenv("LITLOOT_SEARCH_NPROBE", "16"))
+SEARCH_EF_SEARCH: Final[int] = int(os.getenv("LITLOOT_SEARCH_EF_SEARCH", "64"))
+
+# "chunks" searches the whole chunk index. "books" is two-stage: pick the
+# SEARCH_BOOK_CANDIDATES nearest books on the book centroid index, then rank only their
+# chunks, returning at most one chunk per book. Needs an index built with centroids.
+SEARCH_MODE: Final[str] = os.getenv("LITLOOT_SEARCH_MODE", "chunks")
+SEARCH_BOOK_CANDIDATES: Final[int] = int(os.getenv("LITLOOT_SEARCH_BOOK_CANDIDATES", "20"))
+
+# Sharded search: shard servers ("host:port,...") started with `python -m services.shards serve`,
+# each holding the chunk vectors of a slice of the books. Every search goes to all of them
+# at once; a shard that has not answered within the timeout is left out of the results.
+# Empty searches the local index.
+SEARCH_SHARDS: Final[tuple] = tuple(
+    address.strip() for address in os.getenv("LITLOOT_SEARCH_SHARDS", "").split(",") if address.strip()
+)
+SHARD_TIMEOUT_SECONDS: Final[float] = float(os.getenv("LITLOOT_SHARD_TIMEOUT_SECONDS", "5"))
+
+# Query encoding in a shared embedding server (`python -m services.embedding_server`,
+# a Unix socket path such as "cache/embedding.sock", or "host:port") instead of a model
+# in every worker. Empty encodes in-process.
+EMBEDDING_SERVER: Final[str] = os.getenv("LITLOOT_EMBEDDING_SERVER", "")
+EMBEDDING_TIMEOUT_SECONDS: Final[float] = float(os.getenv("LITLOOT_EMBEDDING_TIMEOUT_SECONDS", "10"))
+# Shared secret of shard servers, the embedding server and the app. There is no default;
+# the servers refuse to start without it, and so does the app when it uses them.
+RPC_AUTHKEY: Final[str] = os.getenv("LITLOOT_RPC_AUTHKEY", "")
+if SEARCH_SHARDS and not RPC_AUTHKEY:
+    raise ValueError("LITLOOT_SEARCH_SHARDS is set but LITLOOT_RPC_AUTHKEY is not")
+if EMBEDDING_SERVER and not RPC_AUTHKEY:
+    raise ValueError("LITLOOT_EMBEDDING_SERVER is set but LITLOOT_RPC_AUTHKEY is not")
+
+# Query embeddings kept in memory, and optional micro-batching of concurrent searches:
+# requests arriving within the window are encoded and searched together (0 disables)
+EMBEDDING_CACHE_SIZE: Final[int] = int(os.getenv("LITLOOT_EMBEDDING_CACHE_SIZE", "4096"))
+SEARCH_BATCH_WINDOW_MS: Final[float] = float(os.getenv("LITLOOT_SEARCH_BATCH_WINDOW_MS", "0"))
+SEARCH_MAX_BATCH: Final[int] = int(os.getenv("LITLOOT_SEARCH_MAX_BATCH", "64"))
+
+# Batch search API (/api/search): most queries per request and results per query, and how
+# many chunks per wanted book to fetch when results are limited to one chunk per book
+SEARCH_API_MAX_QUERIES: Final[int] = int(os.getenv("LITLOOT_SEARCH_API_MAX_QUERIES", "512"))
+SEARCH_API_MAX_K: Final[int] = int(os.getenv("LITLOOT_SEARCH_API_MAX_K", "50"))
+SEARCH_DEDUPE_OVERFETCH: Final[int] = int(os.getenv("LITLOOT_SEARCH_DEDUPE_OVERFETCH", "4"))
+
+# Queries naming a known book (title, optionally with author) skip the encoder and
+# return that book's chunks; the threshold is the minimum trigram similarity for a fuzzy match
+TITLE_FAST_PATH: Final[bool] = os.getenv("LITLOOT_TITLE_FAST_PATH", "true").lower() == "true"
+TITLE_MATCH_THRESHOLD: Final[float] = float(os.getenv("LITLOOT_TITLE_MATCH_THRESHOLD", "0.75"))
+
+# Result cache: "memory" (per process), "sqlite" (shared by all workers on the host)
+# or "tiered" (memory in front of sqlite). A TTL of 0 keeps entries until evicted.
+CACHE_BACKEND: Final[str] = os.getenv("LITLOOT_CACHE_BACKEND", "tiered")
+CACHE_MAX_ENTRIES: Final[int] = int(os.getenv("LITLOOT_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS: Final[float] = float(os.getenv("LITLOOT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_SQLITE_PATH: Final[str] = os.getenv("LITLOOT_CACHE_SQLITE_PATH", "cache/litloot_cache.sqlite3")
+# Single-flight: how long one worker may hold a key's compute lock, and how long
+# other workers wait on it before computing themselves
+CACHE_LOCK_TTL_SECONDS: Final[float] = float(os.getenv("LITLOOT_CACHE_LOCK_TTL_SECONDS", "60"))
+CACHE_LOCK_WAIT_SECONDS: Final[float] = float(os.getenv("LITLOOT_CACHE_LOCK_WAIT_SECONDS", "60"))
+
+# Persistent quiz bank: finished quizzes served without a model call, filled by live
+# misses and by data_prep/pregenerate_quizzes.py, which runs this many generations at once
+QUIZ_BANK_ENABLED: Final[bool] = os.getenv("LITLOOT_QUIZ_BANK", "true").lower() == "true"
+QUIZ_BANK_PATH: Final[str] = os.getenv("LITLOOT_QUIZ_BANK_PATH", "cache/quiz_bank.sqlite3")
+QUIZ_PREGEN_WORKERS: Final[int] = int(os.getenv("LITLOOT_QUIZ_PREGEN_WORKERS", "4"))
 
 # Debug Mode
 DEBUG: Final[bool] = os.getenv("LITLOOT_DEBUG", "false").lower() == "true"
 print(f"Debug mode is {'enabled' if DEBUG else 'disabled'}")
+
+# Logging goes through a background thread. Of successful requests, LOG_SAMPLE_RATE get a
+# summary line (failures always do); payloads are logged only at DEBUG, with these fields
+# redacted and long values cut to LOG_MAX_PAYLOAD_CHARS. LOG_FILE="" logs to stdout only.
+LOG_FILE: Final[str] = os.getenv("LITLOOT_LOG_FILE", "litloot_debug.log")
+LOG_QUEUE_SIZE: Final[int] = int(os.getenv("LITLOOT_LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE: Final[float] = float(os.getenv("LITLOOT_LOG_SAMPLE_RATE", "1.0"))
+LOG_MAX_PAYLOAD_CHARS: Final[int] = int(os.getenv("LITLOOT_LOG_MAX_PAYLOAD_CHARS", "500"))
+LOG_REDACT_FIELDS: Final[frozenset] = frozenset(
+    field.strip().lower()
+    for field in os.getenv(
+        "LITLOOT_LOG_REDACT_FIELDS", "authorization,cookie,api_key,password,token,secret,session,sid"
+    ).split(",")
+    if field.strip()
+)
@@ -0,0 +1,24 @@
+"""
+Convert a legacy vector_index/metadata.json to the columnar metadata format
+(books.json + chunk_meta.npy) that services/vector_store loads.
+
+    python data_prep/convert_metadata.py [--input vector_index/metadata.json] [--output-dir vector_index]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.metadata_store import MetadataStore, convert_metadata_json
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert metadata.json to the columnar metadata format")
+    parser.add_argument("--input", default=os.path.join("vector_index", "metadata.json"))
+    parser.add_argument("--output-dir", default="vector_index")
+    args = parser.parse_args()
+
+    books_path = os.path.join(args.output_dir, "books.json")
+    chunks_path = os.path.join(args.output_dir, "chunk_meta.npy")
+    count = convert_metadata_json(args.input, books_path, chunks_path)
+    store = MetadataStore(books_path, chunks_path)
+    print(f"✅ Converted {count} chunks from {len(store.books)} books to {books_path} and {chunks_path}")
@@ -1,11 +1,54 @@
-import os
+"""
+Build the vector index, chunk store and metadata from Project Gutenberg's top
+books, or from a local directory of .txt files.
+
+Ingestion is pipelined: a bounded pool downloads books in the background while
+the main thread chunks them and embeds fixed-size batches, appending each batch
+to the index, chunk store and metadata as soon as it is encoded. Peak memory is
+set by the batch size and download prefetch, not by the corpus.
+
+Builds are incremental. Books are keyed by a sha256 of their text, and
+``manifest.json`` in the output directory records which hashes are indexed and
+which chunk ids they own (vector ids are chunk store rows). Re-running against
+an existing output skips books already indexed and appends new ones. With
+``--remove-missing`` it also removes books no longer in the source; that needs a
+complete source (``--books-dir`` with ``--num-books 0``), and books whose file
+or download failed in this run are kept. Progress is checkpointed every
+CHECKPOINT_CHUNKS chunks, with the manifest written last, so an interrupted
+build resumes from its last checkpoint. ``--rebuild`` starts from scratch,
+which also compacts the chunks of removed books away.
+
+Alongside the chunk index, ``book_centroids.index`` holds one vector per book
+(the normalized mean of its chunks, id = book id) for two-stage search, which
+picks books on that small index before ranking their chunks.
+
+``--shards N`` then splits the finished index by book into N shards for
+sharded search (services/shards.py); shards are rewritten after every build.
+
+    python data_prep/generate_vector_index_from_gutenberg.py                     # top Gutenberg books
+    python data_prep/generate_vector_index_from_gutenberg.py --books-dir ./txt   # local .txt files, offline
+    python data_prep/generate_vector_index_from_gutenberg.py --shards 4          # and split into 4 shards
+"""
+import argparse
+import hashlib
 import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import faiss
 import requests
 import numpy as np
 from tqdm import tqdm
 from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
+
+# Make the LitLoot package importable when run as data_prep/<script>.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.chunk_store import ChunkStoreWriter
+from services.metadata_store import MetadataStoreWriter
+from services.index_factory import create_index, requires_training, train_index
+from services.shards import write_shards
 
 # --- Config ---
 OUTPUT_DIR = "vector_index"
@@ -13,13 +56,32 @@ BOOKS_DIR = os.path.join(OUTPUT_DIR, "books")
 NUM_BOOKS = 2
 CHUNK_SIZE = 500
 OVERLAP = 100
+MIN_WORDS = 1000
+
+# Index kind: flat, ivf_flat, ivf_pq or hnsw (see services/index_factory.py)
+INDEX_TYPE = os.getenv("LITLOOT_INDEX_TYPE", "flat")
+INDEX_PARAMS = {
+    "nlist": int(os.getenv("LITLOOT_INDEX_NLIST", "0")),  # 0 picks ~4 * sqrt(chunks)
+    "pq_m": int(os.getenv("LITLOOT_INDEX_PQ_M", "16")),
+    "pq_nbits": int(os.getenv("LITLOOT_INDEX_PQ_NBITS", "8")),
+    "hnsw_m": int(os.getenv("LITLOOT_INDEX_HNSW_M", "32")),
+}
+# IVF indexes are trained on the first this-many chunks, which are buffered until then
+TRAIN_SIZE = int(os.getenv("LITLOOT_INDEX_TRAIN_SIZE", "50000"))
+
+# Pipeline: concurrent downloads, and chunks embedded (and appended) per batch
+DOWNLOAD_WORKERS = int(os.getenv("LITLOOT_DOWNLOAD_WORKERS", "8"))
+EMBED_BATCH_SIZE = int(os.getenv("LITLOOT_EMBED_BATCH_SIZE", "256"))
+# Commit index, chunks, metadata and manifest after at least this many new chunks
+CHECKPOINT_CHUNKS = int(os.getenv("LITLOOT_CHECKPOINT_CHUNKS", "50000"))
+MANIFEST_VERSION = 1
 
-# --- Setup ---
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(BOOKS_DIR, exist_ok=True)
-model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
 BASE_URL = "https://www.gutenberg.org"
 
+# ``source`` is what the book was read from: a Gutenberg page URL or a local path
+Book = namedtuple("Book", "title author text source_file url source", defaults=("",))
+
 def sanitize_filename(name):
     return "".join(c for c in name if c.isalnum() or c in " .-_").rstrip()
 
@@ -31,9 +93,9 @@ def get_top_book_urls(limit=NUM_BOOKS):
     links = top_ebooks.find_next("ol").find_all("a", limit=limit)
     return [BASE_URL + link["href"] for link in links]
 
-def get_plaintext_link(book_page_url):
-    resp = requests.get(book_page_url)
-    soup = BeautifulSoup(resp.text, "html.parser")
+def get_plaintext_link(book_page_url, soup=None):
+    if soup is None:
+        soup = BeautifulSoup(requests.get(book_page_url).text, "html.parser")
     for link in soup.select("a[href]"):
         href = link["href"]
         if "txt" in href and "zip" not in href:
@@ -49,76 +111,413 @@ def download_book(book_url):
         pass
     return None
 
+def fetch_gutenberg_book(url):
+    """Download one book page and its text; runs on the download pool. None if unusable."""
+    page = requests.get(url)
+    soup = BeautifulSoup(page.text, "html.parser")
+
+    title = soup.find("h1").text.strip()
+    author_tag = soup.find("a", rel="marcrel:aut")
+    author = author_tag.text.strip() if author_tag else "Unknown"
+
+    txt_url = get_plaintext_link(url, soup)
+    if not txt_url:
+        return None
+
+    text = download_book(txt_url)
+    if not text:
+        return None
+
+    local_path = os.path.join(BOOKS_DIR, sanitize_filename(title) + ".txt")
+    with open(local_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return Book(title, author, text, local_path, txt_url, url)
+
+def read_local_book(path):
+    """A book from a local .txt file, titled after the file name."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    title = os.path.splitext(os.path.basename(path))[0]
+    return Book(title, "Unknown", text, path, "", path)
+
+def prefetch(pool, func, items, max_pending):
+    """
+    Map ``func`` over ``items`` on ``pool``, yielding ``(item, result)`` as they finish with
+    at most ``max_pending`` in flight. The result is None if ``func`` raised.
+    """
+    items = iter(items)
+    pending = set()
+    futures = {}
+    while True:
+        for item in items:
+            future = pool.submit(func, item)
+            futures[future] = item
+            pending.add(future)
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                print(f"✘ Download failed: {e}")
+                yield futures[future], None
+            del futures[future]
+
+def iter_books(books_dir=None, limit=NUM_BOOKS, failed=None):
+    """
+    Books from ``books_dir`` if given, else the top Gutenberg books, downloaded concurrently.
+    The source of each book that could not be read is added to the ``failed`` set.
+    """
+    if books_dir:
+        paths = sorted(
+            os.path.join(books_dir, name) for name in os.listdir(books_dir) if name.endswith(".txt")
+        )
+        func, items = read_local_book, paths[:limit] if limit else paths
+    else:
+        os.makedirs(BOOKS_DIR, exist_ok=True)
+        func, items = fetch_gutenberg_book, get_top_book_urls(limit)
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        # Twice the workers keeps the pool busy while bounding how many texts sit in memory
+        for item, book in prefetch(pool, func, items, 2 * DOWNLOAD_WORKERS):
+            if book is not None:
+                yield book
+            elif failed is not None:
+                failed.add(item)
+
 def chunk_text(text):
+    """Yield overlapping CHUNK_SIZE-word chunks; chunk i starts at word i * (CHUNK_SIZE - OVERLAP)."""
     words = text.split()
-    chunks = []
     for i in range(0, len(words), CHUNK_SIZE - OVERLAP):
         chunk = " ".join(words[i:i + CHUNK_SIZE])
         if chunk:
-            chunks.append(chunk)
-    return chunks
+            yield chunk
 
-def process_books():
-    all_chunks = []
-    all_meta = []
-    urls = get_top_book_urls()
-    book_count = 0
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    for url in tqdm(urls):
-        if book_count >= NUM_BOOKS:
-            break
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-        book_id = url.split("/")[-1]
-        page = requests.get(url)
-        soup = BeautifulSoup(page.text, "html.parser")
+class IndexWriter:
+    """
+    Appends embedded batches to the FAISS index, chunk store and metadata tables.
 
-        title = soup.find("h1").text.strip()
-        author_tag = soup.find("a", rel="marcrel:aut")
-        author = author_tag.text.strip() if author_tag else "Unknown"
+    With ``resume`` and a manifest in ``output_dir``, the committed state is
+    reopened and appended to; anything written after the last checkpoint is dropped.
+    """
 
-        txt_url = get_plaintext_link(url)
-        if not txt_url:
-            continue
+    def __init__(self, output_dir, resume=False, index_type=INDEX_TYPE, index_params=INDEX_PARAMS,
+                 train_size=TRAIN_SIZE):
+        self.output_dir = output_dir
+        self.index_type = index_type
+        self.index_params = index_params
+        self.train_size = train_size
+        self.index = None
+        # (embeddings, ids) held back until an IVF index has enough of them to train on
+        self._untrained = []
+        self._untrained_count = 0
+        self._uncommitted = 0
+        # content hash -> {book_id, title, first_chunk, chunk_count}
+        self.books = {}
+        self.seen = set()
+        self.resumed = False
+        # Book centroids: an index of committed books, plus running sums for books added since
+        self.centroids = None
+        self._centroid_sums = {}
+        self._centroids_disabled = False
 
-        text = download_book(txt_url)
-        if not text or len(text.split()) < 1000:
-            continue
+        chunk_paths = (os.path.join(output_dir, "chunks.bin"), os.path.join(output_dir, "chunk_offsets.npy"))
+        manifest = load_manifest(output_dir) if resume else None
+        if manifest is None:
+            self.chunks = ChunkStoreWriter(*chunk_paths)
+            self.metadata = MetadataStoreWriter()
+            return
 
-        filename = sanitize_filename(title) + ".txt"
-        local_path = os.path.join(BOOKS_DIR, filename)
+        if manifest["version"] != MANIFEST_VERSION or manifest["index_type"] != index_type:
+            raise RuntimeError(
+                f"{output_dir} holds a {manifest['index_type']} index (manifest v{manifest['version']}); "
+                f"rerun with --rebuild to build a {index_type} index"
+            )
+        self.resumed = True
+        self.books = manifest["books"]
+        committed = manifest["chunk_count"]
+        self.index = faiss.read_index(self._path("books.index"))
+        if self.index.ntotal != manifest["vector_count"]:
+            # Saved after the manifest's checkpoint: drop the vectors it does not know about
+            if index_type == "hnsw":
+                raise RuntimeError(
+                    f"{self._path('books.index')} holds vectors saved after the last checkpoint, and HNSW "
+                    "indexes cannot delete vectors; rerun with --rebuild"
+                )
+            self.index.remove_ids(faiss.IDSelectorRange(committed, np.iinfo("int64").max))
+        if self.index.ntotal != manifest["vector_count"]:
+            raise RuntimeError(f"{self._path('books.index')} does not match the manifest; rerun with --rebuild")
+        self.chunks = ChunkStoreWriter(*chunk_paths, resume_rows=committed)
+        self.metadata = MetadataStoreWriter.load(
+            self._path("books.json"), self._path("chunk_meta.npy"), manifest["book_count"], committed
+        )
+        if os.path.exists(self._path("book_centroids.index")):
+            self.centroids = faiss.read_index(self._path("book_centroids.index"))
+            # Drop books saved after the manifest's checkpoint, as for the chunk index
+            self.centroids.remove_ids(faiss.IDSelectorRange(manifest["book_count"], np.iinfo("int64").max))
+        else:
+            self._backfill_centroids()
+        if not manifest["complete"]:
+            print(f"Resuming interrupted build: {len(self.books)} books, {committed} chunks committed")
 
-        with open(local_path, "w", encoding="utf-8") as f:
-            f.write(text)
+    def _path(self, name):
+        return os.path.join(self.output_dir, name)
 
-        chunks = chunk_text(text)
-        for i, chunk in enumerate(chunks):
-            all_chunks.append(chunk)
-            all_meta.append({
-                "title": title,
-                "author": author,
-                "book_index": i,
-                "source_file": local_path,
-                "gutenberg_url": txt_url
-            })
+    def _backfill_centroids(self):
+        """Centroids for books committed by a build that predates them, from their stored vectors."""
+        try:
+            for book in self.books.values():
+                ids = np.arange(book["first_chunk"], book["first_chunk"] + book["chunk_count"], dtype="int64")
+                self._centroid_sums[book["book_id"]] = (
+                    self.index.reconstruct_batch(ids).sum(axis=0, dtype="float64"), len(ids)
+                )
+        except RuntimeError as e:
+            print(f"⚠ Cannot rebuild book centroids from this {self.index_type} index ({e}); "
+                  f"rerun with --rebuild for two-stage search")
+            self._centroid_sums.clear()
+            self._centroids_disabled = True
 
-        book_count += 1
-        print(f"✔ {title} by {author} - {len(chunks)} chunks")
+    def _add_centroids(self, embeddings, book_ids):
+        if self._centroids_disabled:
+            return
+        for book_id in np.unique(book_ids):
+            vectors = embeddings[book_ids == book_id]
+            total, count = self._centroid_sums.get(int(book_id), (0.0, 0))
+            self._centroid_sums[int(book_id)] = (total + vectors.sum(axis=0, dtype="float64"), count + len(vectors))
+
+    def _commit_centroids(self):
+        """Move the books summed so far into the centroid index; they are all complete at a checkpoint."""
+        if not self._centroid_sums:
+            return
+        ids = np.fromiter(self._centroid_sums, dtype="int64", count=len(self._centroid_sums))
+        vectors = np.vstack([total / count for total, count in self._centroid_sums.values()]).astype("float32")
+        # Unit length, so books rank by cosine similarity to the query, as chunks do
+        faiss.normalize_L2(vectors)
+        if self.centroids is None:
+            self.centroids = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+        self.centroids.add_with_ids(vectors, ids)
+        self._centroid_sums.clear()
+
+    def is_indexed(self, digest):
+        """True if a book with this content hash is already committed; also marks it as still present."""
+        self.seen.add(digest)
+        return digest in self.books
+
+    def add_book(self, book, digest):
+        # Keyed by content, so a changed text gets a new id rather than mixing chunks
+        return self.metadata.add_book({
+            "title": book.title,
+            "author": book.author,
+            "source_file": book.source_file,
+            "gutenberg_url": book.url,
+        }, key=digest)
+
+    def finish_book(self, digest, book_id, title, first_chunk, chunk_count, source=""):
+        self.books[digest] = {
+            "book_id": book_id,
+            "title": title,
+            "first_chunk": first_chunk,
+            "chunk_count": chunk_count,
+            "source": source,
+        }
+
+    def keep_sources(self, sources):
+        """Count books read from ``sources`` as seen, so a failed read does not remove them."""
+        for digest, book in self.books.items():
+            if book.get("source") in sources:
+                self.seen.add(digest)
+
+    def add_batch(self, texts, rows, embeddings):
+        """Append one batch; ``rows`` holds each chunk's ``(book_id, chunk_index)``."""
+        ids = np.empty(len(texts), dtype="int64")
+        for i, (text, (book_id, chunk_index)) in enumerate(zip(texts, rows)):
+            ids[i] = self.chunks.append(text)
+            self.metadata.add_chunk(book_id, chunk_index)
+        self._uncommitted += len(texts)
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        self._add_centroids(embeddings, np.fromiter((book_id for book_id, _ in rows), dtype="int64", count=len(rows)))
+        self._add_vectors(embeddings, ids)
+
+    def _add_vectors(self, embeddings, ids):
+        if self.index is None and not requires_training(self.index_type):
+            self.index = self._create(embeddings.shape[1], 0)
+        if self.index is not None:
+            self.index.add_with_ids(embeddings, ids)
+            return
+        self._untrained.append((embeddings, ids))
+        self._untrained_count += len(embeddings)
+        if self._untrained_count >= self.train_size:
+            self._train()
+
+    def _create(self, dim, n_vectors):
+        # Vector ids are chunk store rows, so rows survive books being removed
+        return faiss.IndexIDMap2(create_index(self.index_type, dim, n_vectors, **self.index_params))
 
-    return all_chunks, all_meta
+    def _train(self):
+        sample = np.vstack([embeddings for embeddings, _ in self._untrained])
+        ids = np.concatenate([ids for _, ids in self._untrained])
+        self._untrained, self._untrained_count = [], 0
+        print(f"Training {self.index_type} index on {len(sample)} chunks...")
+        self.index = self._create(sample.shape[1], len(sample))
+        train_index(self.index, sample, self.train_size)
+        self.index.add_with_ids(sample, ids)
 
-def build_vector_index(chunks, metadata):
-    print("Generating embeddings...")
-    embeddings = model.encode(chunks, convert_to_numpy=True)
+    def __len__(self):
+        return len(self.metadata)
 
-    print("Saving vector DB...")
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
+    def should_checkpoint(self):
+        # Chunks still buffered for IVF training are not in an index that can be saved yet
+        return self._uncommitted >= CHECKPOINT_CHUNKS and not self._untrained
 
-    faiss.write_index(index, os.path.join(OUTPUT_DIR, "books.index"))
-    with open(os.path.join(OUTPUT_DIR, "metadata.json"), "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    def remove_missing(self):
+        """Remove books committed earlier whose text was not seen in this run. Returns how many."""
+        if not self.seen:
+            print("⚠ No books were read in this run; not removing any")
+            return 0
+        missing = [digest for digest in self.books if digest not in self.seen]
+        if missing and self.index_type == "hnsw":
+            print(f"⚠ HNSW indexes cannot delete vectors; rerun with --rebuild to drop {len(missing)} books")
+            return 0
+        for digest in missing:
+            book = self.books.pop(digest)
+            first = book["first_chunk"]
+            self.index.remove_ids(faiss.IDSelectorRange(first, first + book["chunk_count"]))
+            if self.centroids is not None:
+                self.centroids.remove_ids(faiss.IDSelectorRange(book["book_id"], book["book_id"] + 1))
+            self._centroid_sums.pop(book["book_id"], None)
+            self.metadata.mark_removed(book["book_id"])
+            print(f"✘ Removed {book['title']} - {book['chunk_count']} chunks")
+        return len(missing)
+
+    def checkpoint(self, complete=False):
+        """Commit everything added so far. The manifest is written last, so it only names durable state."""
+        self.chunks.flush()
+        self.metadata.write(self._path("books.json"), self._path("chunk_meta.npy"))
+        faiss.write_index(self.index, self._path("books.index.tmp"))
+        os.replace(self._path("books.index.tmp"), self._path("books.index"))
+        self._commit_centroids()
+        if self.centroids is not None:
+            faiss.write_index(self.centroids, self._path("book_centroids.index.tmp"))
+            os.replace(self._path("book_centroids.index.tmp"), self._path("book_centroids.index"))
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "index_type": self.index_type,
+            "model": MODEL_NAME,
+            "complete": complete,
+            "book_count": len(self.metadata.books),
+            "chunk_count": len(self.chunks),
+            "vector_count": int(self.index.ntotal),
+            "books": self.books,
+        }
+        with open(self._path("manifest.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(self._path("manifest.json.tmp"), self._path("manifest.json"))
+        self._uncommitted = 0
+
+    def close(self, remove_missing=False):
+        if self._untrained:
+            self._train()
+        if self.index is None:
+            raise RuntimeError("No chunks were indexed")
+        if remove_missing:
+            self.remove_missing()
+        print("Saving vector DB...")
+        self.checkpoint(complete=True)
+        self.chunks.close()
+
+def build_vector_index(books, output_dir=OUTPUT_DIR, batch_size=EMBED_BATCH_SIZE, rebuild=False,
+                       remove_missing=False, failed_sources=()):
+    """
+    Chunk, embed and index ``books`` in fixed-size batches, skipping books already
+    in ``output_dir`` unless ``rebuild``. Returns (chunks, books) indexed in this run.
+    ``remove_missing`` drops indexed books that ``books`` did not yield, except those
+    read from ``failed_sources``; only pass it when ``books`` is the complete source.
+    """
+    # Imported here so --help does not wait for torch
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(MODEL_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+    writer = IndexWriter(output_dir, resume=not rebuild)
+    start_rows = len(writer)
+
+    texts, rows = [], []
+    def flush():
+        writer.add_batch(texts, rows, model.encode(texts, convert_to_numpy=True))
+        texts.clear()
+        rows.clear()
+
+    book_count = 0
+    progress = tqdm(unit="chunk")
+    for book in books:
+        if len(book.text.split()) < MIN_WORDS:
+            continue
+        digest = content_hash(book.text)
+        if writer.is_indexed(digest):
+            print(f"• {book.title} already indexed")
+            continue
+        book_id = writer.add_book(book, digest)
+        first_chunk = len(writer) + len(texts)
+        chunk_count = 0
+        for i, chunk in enumerate(chunk_text(book.text)):
+            texts.append(chunk)
+            rows.append((book_id, i))
+            chunk_count += 1
+            if len(texts) >= batch_size:
+                flush()
+                progress.update(batch_size)
+        writer.finish_book(digest, book_id, book.title, first_chunk, chunk_count, book.source)
+        book_count += 1
+        print(f"✔ {book.title} by {book.author} - {chunk_count} chunks")
+        if writer.should_checkpoint():
+            if texts:
+                progress.update(len(texts))
+                flush()
+            writer.checkpoint()
+    if texts:
+        progress.update(len(texts))
+        flush()
+    progress.close()
+
+    # Read lazily, so only complete once ``books`` is exhausted
+    writer.keep_sources(failed_sources)
+    writer.close(remove_missing=remove_missing)
+    return len(writer) - start_rows, book_count
 
 if __name__ == "__main__":
-    chunks, meta = process_books()
-    build_vector_index(chunks, meta)
-    print(f"✅ Done! Embedded {len(chunks)} chunks from {len(set(m['title'] for m in meta))} books.")
+    parser = argparse.ArgumentParser(description="Build the LitLoot vector index")
+    parser.add_argument("--books-dir", help="index the .txt files in this directory instead of downloading")
+    parser.add_argument("--num-books", type=int, default=NUM_BOOKS,
+                        help="number of books to index (0 for every file in --books-dir)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="ignore any existing index in --output-dir and build from scratch")
+    parser.add_argument("--remove-missing", action="store_true",
+                        help="remove indexed books that are no longer in --books-dir (needs --num-books 0)")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="also split the index into this many shards for sharded search")
+    args = parser.parse_args()
+    # A download failure, a shifting top-100 list or a --num-books limit would look like removals
+    if args.remove_missing and (not args.books_dir or args.num_books):
+        parser.error("--remove-missing needs a complete source: --books-dir with --num-books 0")
+
+    failed = set()
+    chunk_count, book_count = build_vector_index(
+        iter_books(args.books_dir, args.num_books, failed), args.output_dir,
+        rebuild=args.rebuild, remove_missing=args.remove_missing, failed_sources=failed,
+    )
+    print(f"✅ Done! Embedded {chunk_count} chunks from {book_count} books.")
+    if args.shards:
+        sizes = write_shards(args.output_dir, args.shards)
+        print(f"✅ Split into {len(sizes)} shards: {', '.join(str(n) for n in sizes)} vectors")
@@ -0,0 +1,93 @@
+"""
+Pre-generate quizzes into the quiz bank (services/quiz_bank.py), so /api/quiz
+can serve them without a model call.
+
+Books are visited most-requested first, by the request counts the quiz routes
+log to the bank, then the rest of the indexed books. For each book the job
+generates the chunk every logged query for it resolves to, plus the chunk its
+bare title resolves to. Banked chunks are skipped, so the job can run on a
+schedule and only pays for what is new. Its model calls run at background
+priority, behind any chat or live quiz calls sharing the process's quota.
+
+    python data_prep/pregenerate_quizzes.py [--max-books 100] [--workers 4]
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import QUIZ_PREGEN_WORKERS
+from services.chunk_store import get_chunk
+from services.quiz_bank import get_quiz_bank
+from services.quiz_generator import bank_key, generate_quiz
+from services.vector_store import get_metadata, search
+from utils.rate_limiter import PRIORITY_BACKGROUND, request_priority
+
+def indexed_titles():
+    metadata = get_metadata()
+    books = getattr(metadata, "books", None)
+    if books is None:
+        # Legacy metadata.json: one dict per chunk
+        books = list({meta["title"]: meta for meta in metadata}.values())
+    return [book["title"] for book in books if not book.get("removed")]
+
+def plan(bank, max_books=0):
+    """``(title, queries)`` to generate quizzes for, most-requested books first."""
+    books = [(title, queries + [title]) for title, _, queries in bank.requested_books()]
+    requested = {title for title, _ in books}
+    books += [(title, [title]) for title in dict.fromkeys(indexed_titles()) if title not in requested]
+    return books[:max_books] if max_books else books
+
+def generate_in_background(title, chunk):
+    # Pool threads do not inherit the caller's context, so set the priority in each task
+    with request_priority(PRIORITY_BACKGROUND):
+        return generate_quiz(title, chunk)
+
+def pregenerate(max_books=0, workers=QUIZ_PREGEN_WORKERS):
+    """Generate and bank quizzes for every planned chunk not banked yet. Returns (generated, failed)."""
+    bank = get_quiz_bank()
+    if bank is None:
+        raise SystemExit("The quiz bank is disabled (LITLOOT_QUIZ_BANK=false)")
+
+    jobs = {}
+    for title, queries in plan(bank, max_books):
+        for query in dict.fromkeys(queries):
+            results = search(query, k=1)
+            if not results:
+                continue
+            meta, idx = results[0]
+            chunk = get_chunk(idx, meta)
+            key = bank_key(meta["title"], chunk)
+            if key not in jobs and key not in bank:
+                jobs[key] = (meta["title"], chunk)
+    print(f"{len(jobs)} quizzes to generate, {len(bank)} already banked")
+
+    generated = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate_in_background, title, chunk): (key, title) for key, (title, chunk) in jobs.items()}
+        for future in as_completed(futures):
+            key, title = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"✘ {title}: {e}")
+                failed += 1
+                continue
+            # Fallback quizzes are returned but never banked
+            if key in bank:
+                print(f"✔ {title}")
+                generated += 1
+            else:
+                print(f"✘ {title}: no usable quiz")
+                failed += 1
+    return generated, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate quizzes into the quiz bank")
+    parser.add_argument("--max-books", type=int, default=0, help="stop after this many books (0 for all)")
+    parser.add_argument("--workers", type=int, default=QUIZ_PREGEN_WORKERS, help="quizzes generated at once")
+    args = parser.parse_args()
+
+    generated, failed = pregenerate(args.max_books, args.workers)
+    print(f"✅ Done! Banked {generated} quizzes ({failed} failed).")
@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for the pre-fork deployment mode:
+
+    gunicorn -c gunicorn.conf.py app:app
+    gunicorn -c gunicorn.conf.py -w 16 app:app
+
+The app is imported once, in the master (``preload_app``). With ``LITLOOT_PREFORK``
+that import loads the index, metadata, chunk store and encoder, and every forked
+worker shares them instead of loading its own. To keep torch out of the workers
+altogether, also run ``python -m services.embedding_server`` and set
+``LITLOOT_EMBEDDING_SERVER=cache/embedding.sock`` (and ``LITLOOT_RPC_AUTHKEY`` for both). Command-line flags override the values here.
+"""
+import os
+
+# Read by config.py when the master imports the app, which happens after this file
+os.environ.setdefault("LITLOOT_PREFORK", "true")
+
+bind = "127.0.0.1:5001"
+workers = 4
+# Requests mostly wait on OpenAI, so each worker serves several at once
+threads = 8
+preload_app = True
+timeout = 120
+
+
+def post_fork(server, worker):
+    # The master preloaded without searching; each worker runs its own warm-up search so
+    # /readyz reflects its encoder (or its embedding server connection)
+    from config import WARM_UP_ON_START
+    from services.vector_store import start_warm_up
+
+    if WARM_UP_ON_START:
+        start_warm_up()
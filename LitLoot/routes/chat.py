@@ -1,31 +1,28 @@
-from typing import Dict, Any, List
-from flask import Blueprint, request, jsonify, Response, session
+from typing import Dict, Any, Iterator, List, Optional
+from flask import Blueprint, request, jsonify, Response, session, stream_with_context
 from utils.openai_client import get_client
 from utils.logging import log_response
-from services.book_search import search_book
+from utils.history import (
+    add_to_history,
+    clear_history,
+    completed_turns,
+    get_conversation_history,
+    interrupted_turns,
+    record_turns,
+    session_id,
+)
+from services.semantic_cache import is_cacheable, lookup_answer, store_answer
+from services.chat import build_messages, run_tool_loop, stream_tool_loop
+from utils.decorators import ServiceUnavailableError
+from utils.metrics import timed
 import logging
 import json
 
 chat_bp: Blueprint = Blueprint("chat", __name__)
 
-def get_conversation_history() -> List[Dict[str, str]]:
-    """Get the conversation history from the session"""
-    if "conversation_history" not in session:
-        session["conversation_history"] = []
-    return session["conversation_history"]
-
-def add_to_history(role: str, content: str, books: List[Dict[str, Any]] = None) -> None:
-    """Add a message to the conversation history"""
-    history = get_conversation_history()
-    message = {"role": role, "content": content}
-    if books:
-        message["books"] = books
-    history.append(message)
-    session["conversation_history"] = history
-
-def clear_history() -> None:
-    """Clear the conversation history"""
-    session["conversation_history"] = []
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @chat_bp.route("/api/chat", methods=["POST"])
 @log_response
@@ -40,122 +37,107 @@ def chat() -> Response:
         query: str = request.json["query"]
         logging.info(f"Received chat query: {query}")
         
-        # Add user message to history
-        add_to_history("user", query)
-        
-        # Get conversation history
-        history = get_conversation_history()
-        logging.debug(f"Current conversation history: {json.dumps(history)}")
-        
-        # Prepare system message with tools
-        system_message = """You are a helpful assistant that provides information about books and literature.
-        You have access to a book search tool that can find books based on queries.
-        When recommending books, use the search_book tool to find relevant books and include their content in your response.
-        """
-        
-        # Prepare messages for OpenAI
-        messages = [
-            {"role": "system", "content": system_message},
-            *history
-        ]
-        
-        # Get OpenAI client
-        client = get_client()
-        
-        # Define available tools
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_book",
-                    "description": "Search for books in the database",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The search query to find relevant books"
-                            },
-                            "k": {
-                                "type": "integer",
-                                "description": "Number of results to return",
-                                "default": 1
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            }
-        ]
-        
-        # Get response from OpenAI
-        logging.info("Sending request to OpenAI")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        # Process the response
-        message = response.choices[0].message
-        logging.debug(f"OpenAI response: {message}")
+        # Add user message to history and build the prompt from it
+        with timed("history"):
+            add_to_history(session, "user", query)
+            history = get_conversation_history(session)
+            logging.debug(f"Current conversation history: {len(history)} turns")
+            messages = build_messages(history)
         
-        found_books = None
+        # A first question close enough to an earlier one reuses its answer
+        cacheable = is_cacheable(history, request.json.get("cache", True) is not False)
+        cached = lookup_answer(query) if cacheable else None
+        if cached is not None:
+            content, found_books = cached["response"], cached["books"]
+        else:
+            # Run the model and any book searches it asks for
+            content, found_books = run_tool_loop(get_client(), messages)
+            if cacheable:
+                store_answer(query, content, found_books)
         
-        # If the model wants to use a tool
-        if message.tool_calls:
-            tool_call = message.tool_calls[0]
-            if tool_call.function.name == "search_book":
-                try:
-                    # Parse arguments
-                    args = json.loads(tool_call.function.arguments)
-                    logging.info(f"Searching books with args: {args}")
-                    
-                    # Search for books
-                    found_books = search_book(args["query"], args.get("k", 1))
-                    logging.info(f"Found {len(found_books)} books")
-                    
-                    # Add tool response to history
-                    add_to_history("assistant", f"I found these books: {json.dumps(found_books)}", found_books)
-                    
-                    # Get final response
-                    response = client.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=messages + [
-                            {"role": "assistant", "content": f"I found these books: {json.dumps(found_books)}"}
-                        ],
-                        temperature=0.7,
-                        max_tokens=500
-                    )
-                    message = response.choices[0].message
-                except Exception as e:
-                    logging.error(f"Error in book search: {str(e)}")
-                    return jsonify({
-                        "error": f"Failed to search books: {str(e)}"
-                    }), 500
+        # Add search results and assistant response to history
+        with timed("history"):
+            record_turns(session_id(session), completed_turns(content, found_books))
         
-        # Add assistant response to history
-        add_to_history("assistant", message.content, found_books)
+        payload = {
+            "response": content,
+            "books": found_books or None
+        }
+        if cached is not None:
+            payload["cached"] = {"similarity": round(cached["similarity"], 4)}
+        return jsonify(payload)
         
+    except ServiceUnavailableError as e:
+        logging.warning(f"Chat unavailable: {str(e)}")
         return jsonify({
-            "response": message.content,
-            "books": found_books
-        })
-        
+            "error": "The assistant is temporarily unavailable, please try again shortly"
+        }), 503
+
     except Exception as e:
         logging.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
         return jsonify({
             "error": f"Failed to get response from OpenAI: {str(e)}"
         }), 500
 
+@chat_bp.route("/api/chat/stream", methods=["POST"])
+@log_response
+def chat_stream() -> Response:
+    """
+    Streaming variant of /api/chat over Server-Sent Events.
+
+    Emits a ``books`` event as soon as each round of tool calls returns, a ``token``
+    event per model delta, and a final ``done`` (or ``error``) event.
+    """
+    if not request.json or "query" not in request.json:
+        return jsonify({
+            "error": "Missing 'query' in request body"
+        }), 400
+
+    query: str = request.json["query"]
+    logging.info(f"Received streaming chat query: {query}")
+
+    with timed("history"):
+        add_to_history(session, "user", query)
+        messages = build_messages(get_conversation_history(session))
+    sid = session_id(session)
+    client = get_client()
+
+    def generate() -> Iterator[str]:
+        parts: List[str] = []
+        books: List[Dict[str, Any]] = []
+        turns: Optional[List[Dict[str, Any]]] = None
+        try:
+            logging.info("Sending streaming request to OpenAI")
+            for event, data in stream_tool_loop(client, messages):
+                if event == "token":
+                    parts.append(data["content"])
+                elif event == "books":
+                    books.extend(data["books"])
+                elif event == "done":
+                    turns = completed_turns(data["response"], data["books"])
+                    data = {**data, "books": data["books"] or None}
+                yield sse_event(event, data)
+        except Exception as e:
+            logging.error(f"Error in chat stream: {str(e)}", exc_info=True)
+            yield sse_event("error", {"error": f"Failed to get response from OpenAI: {str(e)}"})
+        finally:
+            # Also runs when the server closes the generator because the client disconnected.
+            # Without "done", what was streamed so far is recorded as an interrupted answer.
+            if turns is None:
+                turns = interrupted_turns("".join(parts), books)
+            record_turns(sid, turns)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @chat_bp.route("/api/chat/clear", methods=["POST"])
 def clear_chat() -> Response:
     """Clear the conversation history"""
     try:
-        clear_history()
+        clear_history(session)
         return jsonify({"status": "success"})
     except Exception as e:
         logging.error(f"Error clearing chat history: {str(e)}")
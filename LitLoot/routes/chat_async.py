@@ -0,0 +1,145 @@
+"""
+ASGI (Quart) versions of the chat routes.
+
+Same API as routes/chat.py, but each request awaits the shared AsyncOpenAI client
+instead of holding a worker thread for the whole LLM round-trip. History store
+calls, which may hit SQLite, run on the search thread pool.
+"""
+import asyncio
+from typing import Dict, Any, AsyncIterator, List, Optional
+from quart import Blueprint, request, jsonify, Response, session
+from utils.openai_client import get_async_client
+from utils.history import (
+    add_to_history,
+    clear_history,
+    completed_turns,
+    get_conversation_history,
+    interrupted_turns,
+    record_turns,
+    session_id,
+)
+from services.semantic_cache import is_cacheable, lookup_answer, store_answer
+from services.vector_store import run_in_search_pool
+from services.chat import build_messages, run_tool_loop_async, stream_tool_loop_async
+from routes.chat import sse_event
+from utils.decorators import ServiceUnavailableError
+from utils.metrics import timed
+import logging
+
+chat_async_bp: Blueprint = Blueprint("chat_async", __name__)
+
+def _start_turn(session: Any, query: str) -> List[Dict[str, Any]]:
+    """Add the user's query to the history and return the history; blocks on the store."""
+    add_to_history(session, "user", query)
+    return get_conversation_history(session)
+
+@chat_async_bp.route("/api/chat", methods=["POST"])
+async def chat() -> Response:
+    try:
+        body = await request.get_json(silent=True)
+        if not body or "query" not in body:
+            return jsonify({
+                "error": "Missing 'query' in request body"
+            }), 400
+
+        query: str = body["query"]
+        logging.info(f"Received chat query: {query}")
+
+        with timed("history"):
+            history = await run_in_search_pool(_start_turn, session, query)
+            logging.debug(f"Current conversation history: {len(history)} turns")
+            messages = build_messages(history)
+
+        # A first question close enough to an earlier one reuses its answer
+        cacheable = is_cacheable(history, body.get("cache", True) is not False)
+        cached = await run_in_search_pool(lookup_answer, query) if cacheable else None
+        if cached is not None:
+            content, found_books = cached["response"], cached["books"]
+        else:
+            content, found_books = await run_tool_loop_async(get_async_client(), messages)
+            if cacheable:
+                await run_in_search_pool(store_answer, query, content, found_books)
+
+        with timed("history"):
+            await run_in_search_pool(record_turns, session_id(session), completed_turns(content, found_books))
+
+        payload = {
+            "response": content,
+            "books": found_books or None
+        }
+        if cached is not None:
+            payload["cached"] = {"similarity": round(cached["similarity"], 4)}
+        return jsonify(payload)
+
+    except ServiceUnavailableError as e:
+        logging.warning(f"Chat unavailable: {str(e)}")
+        return jsonify({
+            "error": "The assistant is temporarily unavailable, please try again shortly"
+        }), 503
+
+    except Exception as e:
+        logging.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
+        return jsonify({
+            "error": f"Failed to get response from OpenAI: {str(e)}"
+        }), 500
+
+@chat_async_bp.route("/api/chat/stream", methods=["POST"])
+async def chat_stream() -> Response:
+    """Server-Sent Events variant of /api/chat; see routes.chat.chat_stream for the events."""
+    body = await request.get_json(silent=True)
+    if not body or "query" not in body:
+        return jsonify({
+            "error": "Missing 'query' in request body"
+        }), 400
+
+    query: str = body["query"]
+    logging.info(f"Received streaming chat query: {query}")
+
+    with timed("history"):
+        messages = build_messages(await run_in_search_pool(_start_turn, session, query))
+    sid = session_id(session)
+    client = get_async_client()
+
+    async def generate() -> AsyncIterator[str]:
+        parts: List[str] = []
+        books: List[Dict[str, Any]] = []
+        turns: Optional[List[Dict[str, Any]]] = None
+        try:
+            logging.info("Sending streaming request to OpenAI")
+            async for event, data in stream_tool_loop_async(client, messages):
+                if event == "token":
+                    parts.append(data["content"])
+                elif event == "books":
+                    books.extend(data["books"])
+                elif event == "done":
+                    turns = completed_turns(data["response"], data["books"])
+                    data = {**data, "books": data["books"] or None}
+                yield sse_event(event, data)
+        except Exception as e:
+            logging.error(f"Error in chat stream: {str(e)}", exc_info=True)
+            yield sse_event("error", {"error": f"Failed to get response from OpenAI: {str(e)}"})
+        finally:
+            # Also runs when the client disconnects and the generator is cancelled. Without
+            # "done", what was streamed so far is recorded as an interrupted answer.
+            if turns is None:
+                turns = interrupted_turns("".join(parts), books)
+            # Shielded, so a repeated cancellation cannot drop the write
+            await asyncio.shield(run_in_search_pool(record_turns, sid, turns))
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@chat_async_bp.route("/api/chat/clear", methods=["POST"])
+async def clear_chat() -> Response:
+    """Clear the conversation history"""
+    try:
+        await run_in_search_pool(clear_history, session)
+        return jsonify({"status": "success"})
+    except Exception as e:
+        logging.error(f"Error clearing chat history: {str(e)}")
+        return jsonify({
+            "error": f"Failed to clear chat history: {str(e)}"
+        }), 500
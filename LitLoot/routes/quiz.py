@@ -1,10 +1,12 @@
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 import random
-import json
 from flask import Blueprint, request, jsonify, Response
 from services.vector_store import search
+from services.chunk_store import get_chunk
+from services.quiz_bank import record_quiz_request
 from services.quiz_generator import generate_quiz
 from utils.logging import log_response
+from utils.decorators import ServiceUnavailableError
 import logging
 
 quiz_bp: Blueprint = Blueprint("quiz", __name__)
@@ -23,6 +25,16 @@ def shuffle_answers(question: Dict[str, Any]) -> Dict[str, Any]:
         "type": question["type"]
     }
 
+def find_quiz_source(query: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    """Find the best matching chunk for a quiz query, with its metadata."""
+    results: List[Tuple[Dict[str, Any], int]] = search(query, k=1)
+    if not results:
+        return None
+    result: Dict[str, Any]
+    idx: int
+    result, idx = results[0]
+    return result, get_chunk(idx, result)
+
 @quiz_bp.route("/api/quiz", methods=["POST"])
 @log_response
 def quiz() -> Response:
@@ -30,8 +42,8 @@ def quiz() -> Response:
     
     # Search for the book in the vector index
     try:
-        results: List[Tuple[Dict[str, Any], int]] = search(query, k=1)
-        if not results:
+        source = find_quiz_source(query)
+        if source is None:
             return jsonify({
                 "error": f"No books found matching '{query}'",
                 "book": query,
@@ -39,15 +51,10 @@ def quiz() -> Response:
             }), 404
             
         result: Dict[str, Any]
-        idx: int
-        result, idx = results[0]
-        
-        # Get the book content
-        with open(result["source_file"], "r", encoding="utf-8") as f:
-            words: List[str] = f.read().split()
-            start: int = result["book_index"] * 400
-            chunk: str = " ".join(words[start:start+500])
-            
+        chunk: str
+        result, chunk = source
+        record_quiz_request(query, result["title"])
+
         # Generate quiz questions
         quiz_data: List[Dict[str, Any]] = generate_quiz(result["title"], chunk)
         shuffled_questions = [shuffle_answers(q) for q in quiz_data]
@@ -58,11 +65,16 @@ def quiz() -> Response:
             "error": None
         }
         
-        # Log the response data
-        logging.info(f"Response data: {json.dumps(response_data, indent=2)}")
-        
         return jsonify(response_data)
         
+    except ServiceUnavailableError as e:
+        logging.warning(f"Quiz generation unavailable: {str(e)}")
+        return jsonify({
+            "error": "Quiz generation is temporarily unavailable, please try again shortly",
+            "book": query,
+            "questions": []
+        }), 503
+
     except Exception as e:
         logging.error(f"Error generating quiz: {str(e)}")
         return jsonify({
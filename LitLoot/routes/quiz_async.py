@@ -0,0 +1,58 @@
+"""
+ASGI (Quart) version of the quiz route.
+
+The vector search, chunk read and quiz bank calls run on the search thread pool
+and the model calls await the shared AsyncOpenAI client, so the event loop is
+never blocked.
+"""
+from typing import Dict, Any, List
+from quart import Blueprint, request, jsonify, Response
+from services.vector_store import run_in_search_pool
+from services.quiz_bank import record_quiz_request
+from services.quiz_generator import generate_quiz_async
+from routes.quiz import find_quiz_source, shuffle_answers
+from utils.decorators import ServiceUnavailableError
+import logging
+
+quiz_async_bp: Blueprint = Blueprint("quiz_async", __name__)
+
+@quiz_async_bp.route("/api/quiz", methods=["POST"])
+async def quiz() -> Response:
+    query: str = (await request.get_json())["query"]
+
+    try:
+        source = await run_in_search_pool(find_quiz_source, query)
+        if source is None:
+            return jsonify({
+                "error": f"No books found matching '{query}'",
+                "book": query,
+                "questions": []
+            }), 404
+
+        result, chunk = source
+        await run_in_search_pool(record_quiz_request, query, result["title"])
+
+        quiz_data: List[Dict[str, Any]] = await generate_quiz_async(result["title"], chunk)
+        shuffled_questions = [shuffle_answers(q) for q in quiz_data]
+
+        return jsonify({
+            "book": result["title"],
+            "questions": shuffled_questions,
+            "error": None
+        })
+
+    except ServiceUnavailableError as e:
+        logging.warning(f"Quiz generation unavailable: {str(e)}")
+        return jsonify({
+            "error": "Quiz generation is temporarily unavailable, please try again shortly",
+            "book": query,
+            "questions": []
+        }), 503
+
+    except Exception as e:
+        logging.error(f"Error generating quiz: {str(e)}")
+        return jsonify({
+            "error": f"Failed to generate quiz: {str(e)}",
+            "book": query,
+            "questions": []
+        }), 500
@@ -0,0 +1,59 @@
+"""
+Batch search API for other services (recommendation emails, reading-list builders).
+
+``POST /api/search`` takes many queries and answers them with one batched encode
+and one FAISS search, without any model calls.
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from flask import Blueprint, request, jsonify, Response
+from services.book_search import search_books
+from utils.logging import log_response
+from config import SEARCH_API_MAX_QUERIES, SEARCH_API_MAX_K
+import logging
+
+search_bp: Blueprint = Blueprint("search", __name__)
+
+def parse_search_request(body: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Validate a search request body: ``queries`` (a list of strings), and optionally
+    ``k`` (default 5), ``per_book`` (default false) and ``content`` (default true).
+
+    Returns the ``search_books`` arguments, or an error message.
+    """
+    if not isinstance(body, dict) or not isinstance(body.get("queries"), list):
+        return None, "Missing 'queries' list in request body"
+    queries = body["queries"]
+    if not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return None, "'queries' must be a non-empty list of non-empty strings"
+    if len(queries) > SEARCH_API_MAX_QUERIES:
+        return None, f"At most {SEARCH_API_MAX_QUERIES} queries per request"
+    k = body.get("k", 5)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= SEARCH_API_MAX_K:
+        return None, f"'k' must be an integer from 1 to {SEARCH_API_MAX_K}"
+    return {
+        "queries": queries,
+        "k": k,
+        "per_book": bool(body.get("per_book", False)),
+        "content": bool(body.get("content", True)),
+    }, None
+
+def search_response(queries: List[str], results: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    return {"results": [{"query": query, "hits": hits} for query, hits in zip(queries, results)]}
+
+@search_bp.route("/api/search", methods=["POST"])
+@log_response
+def search() -> Response:
+    params, error = parse_search_request(request.get_json(silent=True))
+    if error is not None:
+        return jsonify({"error": error}), 400
+
+    try:
+        logging.info(f"Batch search for {len(params['queries'])} queries, k={params['k']}")
+        results = search_books(**params)
+        return jsonify(search_response(params["queries"], results))
+
+    except Exception as e:
+        logging.error(f"Error in search endpoint: {str(e)}", exc_info=True)
+        return jsonify({
+            "error": f"Search failed: {str(e)}"
+        }), 500
@@ -0,0 +1,29 @@
+"""
+ASGI (Quart) version of the batch search route.
+
+Encoding, FAISS and chunk reads run on the search thread pool, so the event loop
+is never blocked.
+"""
+from quart import Blueprint, request, jsonify, Response
+from services.book_search import search_books_async
+from routes.search import parse_search_request, search_response
+import logging
+
+search_async_bp: Blueprint = Blueprint("search_async", __name__)
+
+@search_async_bp.route("/api/search", methods=["POST"])
+async def search() -> Response:
+    params, error = parse_search_request(await request.get_json(silent=True))
+    if error is not None:
+        return jsonify({"error": error}), 400
+
+    try:
+        logging.info(f"Batch search for {len(params['queries'])} queries, k={params['k']}")
+        results = await search_books_async(**params)
+        return jsonify(search_response(params["queries"], results))
+
+    except Exception as e:
+        logging.error(f"Error in search endpoint: {str(e)}", exc_info=True)
+        return jsonify({
+            "error": f"Search failed: {str(e)}"
+        }), 500
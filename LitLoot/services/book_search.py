@@ -1,5 +1,7 @@
-from typing import Dict, Any, List, Tuple
-from services.vector_store import search
+from typing import Dict, Any, List, Sequence, Tuple
+from services.vector_store import search, search_many, run_in_search_pool
+from services.chunk_store import get_chunk, get_chunks
+from utils.metrics import timed
 
 def search_book(query: str, k: int = 1) -> List[Dict[str, Any]]:
     """
@@ -12,20 +14,57 @@ def search_book(query: str, k: int = 1) -> List[Dict[str, Any]]:
     Returns:
         List of book dictionaries with title, author, and content
     """
-    results = search(query, k=k)
-    books = []
-    
-    for result, idx in results:
-        # Get the book content
-        with open(result["source_file"], "r", encoding="utf-8") as f:
-            words = f.read().split()
-            start = result["book_index"] * 400
-            chunk = " ".join(words[start:start+500])
-            
-        books.append({
-            "title": result["title"],
-            "author": result["author"],
-            "content": chunk
-        })
-    
-    return books 
\ No newline at end of file
+    with timed("book_search"):
+        results = search(query, k=k)
+        books = []
+
+        for result, idx in results:
+            books.append({
+                "title": result["title"],
+                "author": result["author"],
+                "content": get_chunk(idx, result)
+            })
+
+    return books
+
+async def search_book_async(query: str, k: int = 1) -> List[Dict[str, Any]]:
+    """search_book for coroutines; the encoder, FAISS and chunk reads run on the search pool."""
+    return await run_in_search_pool(search_book, query, k)
+
+def search_books(queries: Sequence[str], k: int = 5, per_book: bool = False,
+                 content: bool = True) -> List[List[Dict[str, Any]]]:
+    """
+    Search for many queries in one batch and return detailed hits for each.
+
+    Args:
+        queries: The search queries
+        k: Number of results per query
+        per_book: Keep only the best chunk of each book
+        content: Include each chunk's text, read for all queries at once
+
+    Returns:
+        Per query, a list of hit dictionaries with title, author, chunk row,
+        distance (smaller is closer) and, with ``content``, the chunk text
+    """
+    with timed("book_search"):
+        results = search_many(queries, k=k, per_book=per_book)
+        hits = [[{
+            "title": meta["title"],
+            "author": meta["author"],
+            "chunk": idx,
+            "distance": distance,
+        } for meta, idx, distance in rows] for rows in results]
+
+        if content:
+            flat = [(meta, idx) for rows in results for meta, idx, _ in rows]
+            texts = iter(get_chunks([idx for _, idx in flat], [meta for meta, _ in flat]))
+            for row in hits:
+                for hit in row:
+                    hit["content"] = next(texts)
+
+    return hits
+
+async def search_books_async(queries: Sequence[str], k: int = 5, per_book: bool = False,
+                             content: bool = True) -> List[List[Dict[str, Any]]]:
+    """search_books for coroutines, run on the search pool."""
+    return await run_in_search_pool(search_books, queries, k, per_book, content)
@@ -0,0 +1,330 @@
+"""
+Chat completion logic shared by the Flask and ASGI chat routes.
+
+Holds the system prompt and the search tool, and runs the tool-calling loop in
+three forms: blocking, coroutine, and streaming. The streaming loops yield
+``(event, data)`` pairs (``token``, ``books`` and a final ``done``) so each
+route only has to frame them.
+
+``build_messages`` fits the stored history into ``CHAT_HISTORY_TOKEN_BUDGET``
+prompt tokens, so a long conversation costs no more per request than a short one.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Sequence, Tuple, Union
+
+from config import CHAT_HISTORY_TOKEN_BUDGET, CHAT_MAX_TOOL_ROUNDS, CHAT_TOOL_WORKERS
+from services.book_search import search_book, search_book_async
+from utils.openai_client import create_completion, create_completion_async
+from utils.rate_limiter import estimate_tokens
+
+MODEL = "gpt-3.5-turbo"
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
+
+SYSTEM_MESSAGE = """You are a helpful assistant that provides information about books and literature.
+        You have access to a book search tool that can find books based on queries.
+        When recommending books, use the search_book tool to find relevant books and include their content in your response.
+        """
+
+TOOLS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_book",
+            "description": "Search for books in the database",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The search query to find relevant books"
+                    },
+                    "k": {
+                        "type": "integer",
+                        "description": "Number of results to return",
+                        "default": 1
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    }
+]
+
+ToolCall = Dict[str, str]
+ChatEvent = Tuple[str, Dict[str, Any]]
+
+# Shared across requests so concurrent chats cannot spawn unbounded search threads
+_tool_executor = ThreadPoolExecutor(max_workers=CHAT_TOOL_WORKERS, thread_name_prefix="chat-tool")
+
+# Earlier queries quoted in the summary of turns that no longer fit
+SUMMARY_MAX_QUERIES = 10
+SUMMARY_QUERY_CHARS = 100
+
+def _books_content(books: List[Dict[str, Any]], with_content: bool) -> str:
+    if with_content:
+        return f"I found these books: {json.dumps(books)}"
+    # Older search results keep only what they were, not the chunks the model already answered from
+    titles = "; ".join(f"{book['title']} by {book['author']}" for book in books)
+    return f"I found these books: {titles}"
+
+def _summary(turns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    queries = [turn["content"][:SUMMARY_QUERY_CHARS] for turn in turns if turn["role"] == "user"]
+    return {
+        "role": "system",
+        "content": "Earlier in this conversation the user asked about: "
+                   + "; ".join(queries[-SUMMARY_MAX_QUERIES:]),
+    }
+
+def build_messages(history: List[Dict[str, Any]],
+                   budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """
+    Prepend the system prompt to as much recent history as fits in ``budget`` tokens.
+
+    Only the newest search results keep their book text; older ones are reduced to
+    titles. Turns that do not fit are dropped, oldest first, and replaced by a
+    one-line summary of the queries they held. The newest turn is always kept.
+    """
+    latest_books = max((i for i, turn in enumerate(history) if turn.get("books")), default=-1)
+    kept: List[Dict[str, Any]] = []
+    used = 0
+    for i in range(len(history) - 1, -1, -1):
+        turn = history[i]
+        if turn.get("books") and not turn["content"]:
+            # Search results: book text for the newest if it fits, otherwise titles
+            options = [_books_content(turn["books"], True)] if i == latest_books else []
+            options.append(_books_content(turn["books"], False))
+        else:
+            options = [turn["content"]]
+        content = next((option for option in options if not kept or used + estimate_tokens(option) <= budget), None)
+        if content is None:
+            break
+        kept.append({"role": turn["role"], "content": content})
+        used += estimate_tokens(content)
+    kept.reverse()
+
+    dropped = history[:len(history) - len(kept)]
+    summary = [_summary(dropped)] if any(turn["role"] == "user" for turn in dropped) else []
+    return [{"role": "system", "content": SYSTEM_MESSAGE}, *summary, *kept]
+
+def _completion_kwargs(messages: List[Dict[str, Any]], with_tools: bool, stream: bool = False) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {
+        "model": MODEL,
+        "messages": messages,
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+    if with_tools:
+        kwargs.update(tools=TOOLS, tool_choice="auto")
+    if stream:
+        kwargs["stream"] = True
+    return kwargs
+
+def _parse_search_args(name: str, arguments: str) -> Dict[str, Any]:
+    if name != "search_book":
+        raise ValueError(f"Unknown tool: {name}")
+    args = json.loads(arguments)
+    logging.info(f"Searching books with args: {args}")
+    return args
+
+def _run_tool(name: str, arguments: str) -> List[Dict[str, Any]]:
+    args = _parse_search_args(name, arguments)
+    return search_book(args["query"], args.get("k", 1))
+
+async def _run_tool_async(name: str, arguments: str) -> List[Dict[str, Any]]:
+    args = _parse_search_args(name, arguments)
+    return await search_book_async(args["query"], args.get("k", 1))
+
+def _collect_tool_results(tool_calls: Sequence[ToolCall],
+                          results: Sequence[Union[List[Dict[str, Any]], BaseException]]
+                          ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    tool_messages: List[Dict[str, Any]] = []
+    found_books: List[Dict[str, Any]] = []
+    for call, result in zip(tool_calls, results):
+        if isinstance(result, BaseException):
+            # Let the model answer from the other calls rather than failing the request
+            logging.error(f"Error in book search: {str(result)}")
+            content = json.dumps({"error": f"Failed to search books: {str(result)}"})
+        else:
+            found_books.extend(result)
+            content = json.dumps(result)
+        tool_messages.append({"role": "tool", "tool_call_id": call["id"], "content": content})
+    logging.info(f"Ran {len(tool_calls)} tool calls, found {len(found_books)} books")
+    return tool_messages, found_books
+
+def execute_tool_calls(tool_calls: Sequence[ToolCall]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Run every tool call of one model turn concurrently.
+
+    Args:
+        tool_calls: Calls as ``{"id", "name", "arguments"}`` dicts
+
+    Returns:
+        The ``tool`` messages to send back to the model, in call order, and all books found
+    """
+    # Each call runs in a copy of this context, so its stages count towards this request
+    futures = [
+        _tool_executor.submit(contextvars.copy_context().run, _run_tool, call["name"], call["arguments"])
+        for call in tool_calls
+    ]
+    results: List[Union[List[Dict[str, Any]], BaseException]] = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return _collect_tool_results(tool_calls, results)
+
+async def execute_tool_calls_async(tool_calls: Sequence[ToolCall]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Coroutine version of execute_tool_calls; searches run on the vector search pool."""
+    results = await asyncio.gather(
+        *(_run_tool_async(call["name"], call["arguments"]) for call in tool_calls),
+        return_exceptions=True
+    )
+    return _collect_tool_results(tool_calls, results)
+
+def assistant_tool_message(tool_calls: Sequence[ToolCall]) -> Dict[str, Any]:
+    """The assistant turn that requested ``tool_calls``, as the API expects it echoed back"""
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": call["id"],
+                "type": "function",
+                "function": {"name": call["name"], "arguments": call["arguments"]}
+            }
+            for call in tool_calls
+        ]
+    }
+
+def _message_tool_calls(message: Any) -> List[ToolCall]:
+    return [
+        {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+        for call in message.tool_calls or []
+    ]
+
+def run_tool_loop(client: Any, messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Let the model call tools until it answers or the round cap is hit.
+
+    Returns:
+        The final answer and every book found along the way
+    """
+    found_books: List[Dict[str, Any]] = []
+    for _ in range(CHAT_MAX_TOOL_ROUNDS):
+        logging.info("Sending request to OpenAI")
+        response = create_completion(client, **_completion_kwargs(messages, with_tools=True))
+        message = response.choices[0].message
+        logging.debug(f"OpenAI response: {message}")
+        tool_calls = _message_tool_calls(message)
+        if not tool_calls:
+            return message.content, found_books
+        tool_messages, books = execute_tool_calls(tool_calls)
+        found_books.extend(books)
+        messages = messages + [assistant_tool_message(tool_calls), *tool_messages]
+
+    # Out of tool rounds, answer from what has been found so far
+    logging.info("Tool round limit reached, requesting final answer")
+    response = create_completion(client, **_completion_kwargs(messages, with_tools=False))
+    return response.choices[0].message.content, found_books
+
+async def run_tool_loop_async(client: Any, messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Coroutine version of run_tool_loop for an ``AsyncOpenAI`` client."""
+    found_books: List[Dict[str, Any]] = []
+    for _ in range(CHAT_MAX_TOOL_ROUNDS):
+        logging.info("Sending request to OpenAI")
+        response = await create_completion_async(client, **_completion_kwargs(messages, with_tools=True))
+        message = response.choices[0].message
+        logging.debug(f"OpenAI response: {message}")
+        tool_calls = _message_tool_calls(message)
+        if not tool_calls:
+            return message.content, found_books
+        tool_messages, books = await execute_tool_calls_async(tool_calls)
+        found_books.extend(books)
+        messages = messages + [assistant_tool_message(tool_calls), *tool_messages]
+
+    logging.info("Tool round limit reached, requesting final answer")
+    response = await create_completion_async(client, **_completion_kwargs(messages, with_tools=False))
+    return response.choices[0].message.content, found_books
+
+class _StreamedTurn:
+    """Accumulates one streamed completion: text deltas and fragmented tool calls."""
+
+    def __init__(self) -> None:
+        self.parts: List[str] = []
+        # Tool call ids, names and arguments arrive in fragments, keyed by the call's index
+        self._tool_calls: Dict[int, ToolCall] = {}
+
+    def feed(self, chunk: Any) -> str:
+        """Consume one stream chunk and return its text delta, if any."""
+        if not chunk.choices:
+            return ""
+        delta = chunk.choices[0].delta
+        for call in delta.tool_calls or []:
+            entry = self._tool_calls.setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+            if call.id:
+                entry["id"] = call.id
+            if call.function and call.function.name:
+                entry["name"] += call.function.name
+            if call.function and call.function.arguments:
+                entry["arguments"] += call.function.arguments
+        if delta.content:
+            self.parts.append(delta.content)
+            return delta.content
+        return ""
+
+    @property
+    def tool_calls(self) -> List[ToolCall]:
+        return [self._tool_calls[i] for i in sorted(self._tool_calls)]
+
+def stream_tool_loop(client: Any, messages: List[Dict[str, Any]]) -> Iterator[ChatEvent]:
+    """
+    Streaming run_tool_loop.
+
+    Yields ``("token", {"content"})`` per text delta, ``("books", {"books"})`` after each
+    round of tool calls, and finally ``("done", {"response", "books"})``.
+    """
+    found_books: List[Dict[str, Any]] = []
+    parts: List[str] = []
+    for round_number in range(CHAT_MAX_TOOL_ROUNDS + 1):
+        # The last round withholds the tools so the model has to answer
+        with_tools = round_number < CHAT_MAX_TOOL_ROUNDS
+        turn = _StreamedTurn()
+        for chunk in create_completion(client, **_completion_kwargs(messages, with_tools, stream=True)):
+            content = turn.feed(chunk)
+            if content:
+                yield "token", {"content": content}
+        parts.extend(turn.parts)
+        if not turn.tool_calls:
+            break
+        tool_messages, books = execute_tool_calls(turn.tool_calls)
+        found_books.extend(books)
+        yield "books", {"books": books}
+        messages = messages + [assistant_tool_message(turn.tool_calls), *tool_messages]
+    yield "done", {"response": "".join(parts), "books": found_books}
+
+async def stream_tool_loop_async(client: Any, messages: List[Dict[str, Any]]) -> AsyncIterator[ChatEvent]:
+    """Async-generator version of stream_tool_loop for an ``AsyncOpenAI`` client."""
+    found_books: List[Dict[str, Any]] = []
+    parts: List[str] = []
+    for round_number in range(CHAT_MAX_TOOL_ROUNDS + 1):
+        with_tools = round_number < CHAT_MAX_TOOL_ROUNDS
+        turn = _StreamedTurn()
+        stream = await create_completion_async(client, **_completion_kwargs(messages, with_tools, stream=True))
+        async for chunk in stream:
+            content = turn.feed(chunk)
+            if content:
+                yield "token", {"content": content}
+        parts.extend(turn.parts)
+        if not turn.tool_calls:
+            break
+        tool_messages, books = await execute_tool_calls_async(turn.tool_calls)
+        found_books.extend(books)
+        yield "books", {"books": books}
+        messages = messages + [assistant_tool_message(turn.tool_calls), *tool_messages]
+    yield "done", {"response": "".join(parts), "books": found_books}
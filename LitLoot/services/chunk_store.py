@@ -0,0 +1,170 @@
+"""
+Memory-mapped chunk store.
+
+All chunk text lives in one contiguous UTF-8 blob plus a ``uint64`` offsets
+array of length ``n + 1``, so chunk ``i`` is ``blob[offsets[i]:offsets[i + 1]]``.
+Row ``i`` of the store lines up with row ``i`` of the FAISS index and the
+metadata, which lets a search hit be resolved without touching the source book.
+"""
+import logging
+import mmap
+import os
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from utils.metrics import timed
+
+OFFSETS_DTYPE = np.uint64
+
+
+class ChunkStore:
+    """Read-only view over a chunk blob and its offsets array."""
+
+    def __init__(self, data_path: str, offsets_path: str) -> None:
+        self.offsets: np.ndarray = np.load(offsets_path, mmap_mode="r")
+        self._file = open(data_path, "rb")
+        # mmap refuses zero-length files, so an empty store keeps a plain bytes object
+        if os.fstat(self._file.fileno()).st_size:
+            self._data: Any = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, idx: int) -> str:
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"chunk {idx} out of range for store of {len(self)} chunks")
+        start = int(self.offsets[idx])
+        end = int(self.offsets[idx + 1])
+        return self._data[start:end].decode("utf-8")
+
+    def get_many(self, indices: Sequence[int]) -> List[str]:
+        """Text of several chunks, in the order given, read in file order."""
+        rows = np.asarray(indices, dtype=np.int64)
+        if len(rows) and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError(f"chunk rows out of range for store of {len(self)} chunks")
+        starts = self.offsets[rows].astype(np.int64)
+        ends = self.offsets[rows + 1].astype(np.int64)
+        texts: List[str] = [""] * len(rows)
+        for i in np.argsort(starts, kind="stable"):
+            texts[i] = self._data[starts[i]:ends[i]].decode("utf-8")
+        return texts
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class ChunkStoreWriter:
+    """
+    Appends chunks to a blob file one at a time; the offsets are written by
+    ``flush`` and ``close``.
+
+    With ``resume_rows`` the writer reopens an existing store, drops anything
+    after the first ``resume_rows`` chunks, and appends from there.
+    """
+
+    def __init__(self, data_path: str, offsets_path: str, resume_rows: Optional[int] = None) -> None:
+        self.offsets_path = offsets_path
+        if resume_rows is None:
+            self._file = open(data_path, "wb")
+            # A typed array keeps this at 8 bytes per chunk however large the corpus
+            self._offsets = array("Q", [0])
+        else:
+            self._offsets = array("Q", np.load(offsets_path)[:resume_rows + 1].astype(OFFSETS_DTYPE).tobytes())
+            self._file = open(data_path, "r+b")
+            self._file.truncate(self._offsets[-1])
+            self._file.seek(self._offsets[-1])
+
+    def append(self, chunk: str) -> int:
+        """Write one chunk and return its row."""
+        encoded = chunk.encode("utf-8")
+        self._file.write(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+        return len(self._offsets) - 2
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def flush(self) -> None:
+        """Make everything appended so far durable."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        with open(self.offsets_path + ".tmp", "wb") as f:
+            np.save(f, np.frombuffer(self._offsets, dtype=OFFSETS_DTYPE))
+        os.replace(self.offsets_path + ".tmp", self.offsets_path)
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+def write_chunk_store(chunks: Iterable[str], data_path: str, offsets_path: str) -> int:
+    """Write chunks as one blob plus offsets. Returns the number of chunks written."""
+    writer = ChunkStoreWriter(data_path, offsets_path)
+    for chunk in chunks:
+        writer.append(chunk)
+    writer.close()
+    return len(writer)
+
+
+def read_chunk_from_source(meta: Dict[str, Any]) -> str:
+    """Legacy path: re-read the whole source book and slice out one chunk."""
+    with open(meta["source_file"], "r", encoding="utf-8") as f:
+        words = f.read().split()
+    start = meta["book_index"] * 400
+    return " ".join(words[start:start + 500])
+
+
+_store: Optional[ChunkStore] = None
+_store_missing = False
+_store_lock = threading.Lock()
+
+
+def get_chunk_store() -> Optional[ChunkStore]:
+    """Open the configured chunk store once per process, or None if it was never built."""
+    global _store, _store_missing
+    if _store is None and not _store_missing:
+        with _store_lock:
+            if _store is None and not _store_missing:
+                # Imported here so the data-prep script can use the writer without an API key
+                from config import CHUNK_DATA_PATH, CHUNK_OFFSETS_PATH
+                if os.path.exists(CHUNK_DATA_PATH) and os.path.exists(CHUNK_OFFSETS_PATH):
+                    _store = ChunkStore(CHUNK_DATA_PATH, CHUNK_OFFSETS_PATH)
+                    logging.info(f"Loaded chunk store with {len(_store)} chunks")
+                else:
+                    _store_missing = True
+                    logging.warning("Chunk store not found, falling back to reading source files")
+    return _store
+
+
+def get_chunk(idx: int, meta: Dict[str, Any]) -> str:
+    """
+    Return the text of chunk ``idx``.
+
+    Args:
+        idx: Row of the chunk in the vector index
+        meta: Metadata for that row, used only when no chunk store has been built
+
+    Returns:
+        The chunk text
+    """
+    store = get_chunk_store()
+    with timed("chunk_read"):
+        if store is not None:
+            return store.get(idx)
+        return read_chunk_from_source(meta)
+
+
+def get_chunks(indices: Sequence[int], metas: Sequence[Dict[str, Any]]) -> List[str]:
+    """``get_chunk`` for many rows at once, with one offsets lookup and reads in file order."""
+    store = get_chunk_store()
+    with timed("chunk_read"):
+        if store is not None:
+            return store.get_many(indices)
+        return [read_chunk_from_source(meta) for meta in metas]
@@ -0,0 +1,82 @@
+"""
+Query encoder in its own process, shared by every worker on the host.
+
+The sentence-transformers model (and torch under it) is the largest thing a
+worker loads, and torch's thread pools do not survive fork. With
+``LITLOOT_EMBEDDING_SERVER`` set, workers hold an ``EmbeddingClient`` instead of
+a model. It encodes over services/rpc.py, so one copy of the model serves the
+whole host however many workers there are.
+
+It listens on an owner-only Unix socket by default, and like the shard servers
+refuses to start without ``LITLOOT_RPC_AUTHKEY``. Like ``index_factory``, this
+module must not import ``config``.
+
+    python -m services.embedding_server                          # cache/embedding.sock
+    python -m services.embedding_server --address 10.0.0.5:9200  # TCP, for other hosts
+"""
+import argparse
+import logging
+import os
+import sys
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from services.rpc import Address, RpcClient, authkey_from_env, parse_address, serve
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_ADDRESS = os.path.join("cache", "embedding.sock")
+
+
+class Encoder:
+    """The calls the embedding server answers."""
+
+    def __init__(self, model_name: str = MODEL_NAME) -> None:
+        # Importing sentence_transformers pulls in torch, which alone takes seconds
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts), dtype="float32")
+
+    def info(self) -> Dict[str, Any]:
+        return {"model": self.model_name, "pid": os.getpid()}
+
+
+ENCODER_CALLS = ("encode", "info")
+
+
+class EmbeddingClient:
+    """Stands in for ``SentenceTransformer`` in a worker: ``encode`` runs on the embedding server."""
+
+    def __init__(self, address: Address, authkey: bytes, timeout: float = 10.0) -> None:
+        self._client = RpcClient(address, authkey, timeout, "Embedding server")
+
+    def encode(self, texts: Sequence[str], **kwargs: Any) -> np.ndarray:
+        return self._client.call("encode", list(texts))
+
+    def info(self) -> Dict[str, Any]:
+        return self._client.call("info")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="a Unix socket path, or host:port")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 for the default)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    try:
+        authkey = authkey_from_env()
+    except ValueError as e:
+        sys.exit(str(e))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if arguments.threads:
+        import torch
+        torch.set_num_threads(arguments.threads)
+    encoder = Encoder(arguments.model)
+    serve(parse_address(arguments.address), authkey, encoder, ENCODER_CALLS, f"encoder {arguments.model}")
@@ -0,0 +1,148 @@
+"""
+FAISS index construction and query-time tuning.
+
+Shared by the data-prep builder, the benchmark and ``vector_store``, so it must
+not import ``config``. Supported kinds:
+
+- ``flat``: exact brute-force L2 search
+- ``ivf_flat``: inverted lists over k-means cells, exact distances within probed cells
+- ``ivf_pq``: inverted lists with product-quantized vectors (smallest memory)
+- ``hnsw``: hierarchical navigable small-world graph (no training needed)
+"""
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# FAISS wants roughly this many training points per IVF cell
+MIN_POINTS_PER_CELL = 39
+
+
+def requires_training(kind: str) -> bool:
+    """IVF kinds must be trained on sample vectors before anything can be added."""
+    return kind in ("ivf_flat", "ivf_pq")
+
+
+def default_nlist(n_vectors: int) -> int:
+    """About 4 * sqrt(n) cells, capped so each cell gets enough training points."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // MIN_POINTS_PER_CELL))
+
+
+def create_index(kind: str, dim: int, n_vectors: int, nlist: int = 0,
+                 pq_m: int = 16, pq_nbits: int = 8, hnsw_m: int = 32,
+                 ef_construction: int = 200) -> faiss.Index:
+    """
+    Create an empty index of the given kind.
+
+    Args:
+        kind: One of ``INDEX_KINDS``
+        dim: Embedding dimension
+        n_vectors: Expected corpus size, used to pick ``nlist`` when it is 0
+        nlist: IVF cells
+        pq_m: PQ sub-quantizers; must divide ``dim``
+        pq_nbits: Bits per PQ code
+        hnsw_m: HNSW neighbours per node
+        ef_construction: HNSW build-time beam width
+    """
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+    if kind in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % pq_m:
+                raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        return index
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    raise ValueError(f"Unknown index kind '{kind}', expected one of {', '.join(INDEX_KINDS)}")
+
+
+def train_index(index: faiss.Index, embeddings: np.ndarray, train_size: int = 50000,
+                seed: int = 0) -> None:
+    """Train ``index`` on a random sample of at most ``train_size`` embeddings, if it needs training."""
+    if index.is_trained:
+        return
+    sample = embeddings
+    if len(embeddings) > train_size:
+        rng = np.random.default_rng(seed)
+        sample = embeddings[rng.choice(len(embeddings), train_size, replace=False)]
+    index.train(np.ascontiguousarray(sample, dtype="float32"))
+
+
+def build_index(kind: str, embeddings: np.ndarray, train_size: int = 50000, **params) -> faiss.Index:
+    """Create, train and fill an index from an in-memory embedding matrix."""
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    index = create_index(kind, embeddings.shape[1], len(embeddings), **params)
+    train_index(index, embeddings, train_size)
+    index.add(embeddings)
+    return index
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    # Look through ID maps and other wrappers to the index that holds the parameters
+    index = faiss.downcast_index(index)
+    while hasattr(index, "index") and isinstance(index.index, faiss.Index):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None) -> None:
+    """Apply query-time recall/latency knobs; ignored by kinds they do not apply to."""
+    base = _base_index(index)
+    if nprobe and isinstance(base, faiss.IndexIVF):
+        base.nprobe = nprobe
+    if ef_search and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+
+
+def filtered_search_params(index: faiss.Index, selector: faiss.IDSelector,
+                           exhaustive: bool = False) -> faiss.SearchParameters:
+    """
+    Search parameters that only return ids accepted by ``selector``.
+
+    Passing parameters replaces the index's own query-time knobs, so its current
+    ``nprobe`` or ``efSearch`` are carried over. With ``exhaustive``, IVF indexes
+    probe every cell, for selected ids that need not lie near the query; distances
+    are still only computed for the selected ids.
+    """
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nlist if exhaustive else base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    """
+    Load an index from disk.
+
+    With ``mmap`` the vectors stay in the file and are paged in on demand, so
+    every worker on the host shares one copy in the page cache.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    # MMAP_IFC maps flat codes without copying but only exists in newer FAISS builds,
+    # and it cannot be combined with MMAP for the inverted lists of IVF indexes
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if ifc:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | ifc)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+
+
+def index_size_bytes(index: faiss.Index) -> int:
+    """Serialized size of the index, a close proxy for its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)
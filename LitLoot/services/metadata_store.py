@@ -0,0 +1,112 @@
+"""
+Columnar chunk metadata.
+
+Instead of one JSON object per chunk repeating the book's title, author, file
+and URL, metadata is split into:
+
+- a books table (``books.json``): one entry per book
+- a chunk table (``chunk_meta.npy``): an ``int32`` array of ``(book_id, chunk_index)``
+  rows, one per vector in the index, memory-mapped at load time
+
+``MetadataStore[i]`` rebuilds the dict that ``metadata.json`` held for chunk ``i``,
+so callers see the same shape either way. Incremental builds mark books that left
+the corpus with ``"removed": true``; their chunks are no longer in the index.
+"""
+import json
+import os
+from array import array
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+BOOK_FIELDS = ("title", "author", "source_file", "gutenberg_url")
+CHUNK_DTYPE = np.int32
+
+
+class MetadataStore:
+    """Read-only, list-like view over the books and chunk tables."""
+
+    def __init__(self, books_path: str, chunks_path: str) -> None:
+        with open(books_path, "r", encoding="utf-8") as f:
+            self.books: List[Dict[str, Any]] = json.load(f)
+        self.chunks: np.ndarray = np.load(chunks_path, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        book_id, chunk_index = self.chunks[idx]
+        book = self.books[int(book_id)]
+        return {**{field: book[field] for field in BOOK_FIELDS}, "book_index": int(chunk_index)}
+
+    def book_id(self, idx: int) -> int:
+        return int(self.chunks[idx][0])
+
+
+class MetadataStoreWriter:
+    """Builds the two tables incrementally, so chunk metadata never has to sit in dicts."""
+
+    def __init__(self) -> None:
+        self.books: List[Dict[str, Any]] = []
+        self._book_ids: Dict[Any, int] = {}
+        # (book_id, chunk_index) pairs, flattened
+        self._chunks = array("i")
+
+    @classmethod
+    def load(cls, books_path: str, chunks_path: str, book_count: int, chunk_count: int) -> "MetadataStoreWriter":
+        """Reopen written tables to append more, keeping only the first ``book_count`` books and ``chunk_count`` chunks."""
+        writer = cls()
+        with open(books_path, "r", encoding="utf-8") as f:
+            writer.books = json.load(f)[:book_count]
+        writer._chunks = array("i", np.load(chunks_path)[:chunk_count].astype(CHUNK_DTYPE).ravel().tobytes())
+        return writer
+
+    def add_book(self, book: Dict[str, Any], key: Any = None) -> int:
+        """
+        Register a book (or find it again) and return its id.
+
+        Books are matched on ``key``, which defaults to all of their fields.
+        """
+        if key is None:
+            key = tuple(book.get(field) for field in BOOK_FIELDS)
+        if key not in self._book_ids:
+            self._book_ids[key] = len(self.books)
+            self.books.append({field: book.get(field) for field in BOOK_FIELDS})
+        return self._book_ids[key]
+
+    def mark_removed(self, book_id: int) -> None:
+        self.books[book_id]["removed"] = True
+
+    def add_chunk(self, book_id: int, chunk_index: int) -> None:
+        self._chunks.extend((book_id, chunk_index))
+
+    def __len__(self) -> int:
+        return len(self._chunks) // 2
+
+    def write(self, books_path: str, chunks_path: str) -> None:
+        """Write both tables, each replaced atomically."""
+        with open(books_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.books, f, ensure_ascii=False)
+        os.replace(books_path + ".tmp", books_path)
+        chunks = np.frombuffer(self._chunks, dtype=CHUNK_DTYPE).reshape(-1, 2) if self._chunks else \
+            np.zeros((0, 2), dtype=CHUNK_DTYPE)
+        # np.save appends .npy to names without it, so write through a file object
+        with open(chunks_path + ".tmp", "wb") as f:
+            np.save(f, chunks.astype(CHUNK_DTYPE, copy=False))
+        os.replace(chunks_path + ".tmp", chunks_path)
+
+
+def write_metadata_store(metadata: Iterable[Dict[str, Any]], books_path: str, chunks_path: str) -> int:
+    """Normalize legacy per-chunk dicts into the two tables. Returns the number of chunks."""
+    writer = MetadataStoreWriter()
+    for meta in metadata:
+        writer.add_chunk(writer.add_book(meta), meta["book_index"])
+    writer.write(books_path, chunks_path)
+    return len(writer)
+
+
+def convert_metadata_json(json_path: str, books_path: str, chunks_path: str) -> int:
+    """Convert an existing ``metadata.json`` to the columnar format."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    return write_metadata_store(metadata, books_path, chunks_path)
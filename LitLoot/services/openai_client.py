@@ -1,18 +1,25 @@
-from openai import OpenAI
 import logging
-from config import OPENAI_API_KEY
-from utils.decorators import with_retry
+from utils.openai_client import create_completion, create_completion_async, get_client, get_async_client
+from utils.rate_limiter import PRIORITY_QUIZ, current_priority
 
-# Initialize the client with the API key
-client = OpenAI()
-
-@with_retry()
-def ask_openai(prompt, temperature=0.7, model="gpt-3.5-turbo", max_tokens=800):
-    logging.info(f"Querying OpenAI with prompt of length {len(prompt)}")
-    response = client.chat.completions.create(
+def _completion_kwargs(prompt, temperature, model, max_tokens):
+    return dict(
         model=model,
         messages=[{"role": "user", "content": prompt}],
         temperature=temperature,
         max_tokens=max_tokens,
+        # Quizzes yield to chat; background jobs ask for an even lower priority
+        priority=max(PRIORITY_QUIZ, current_priority()),
+    )
+
+def ask_openai(prompt, temperature=0.7, model="gpt-3.5-turbo", max_tokens=800):
+    logging.info(f"Querying OpenAI with prompt of length {len(prompt)}")
+    response = create_completion(get_client(), **_completion_kwargs(prompt, temperature, model, max_tokens))
+    return response.choices[0].message.content.strip()
+
+async def ask_openai_async(prompt, temperature=0.7, model="gpt-3.5-turbo", max_tokens=800):
+    logging.info(f"Querying OpenAI (async) with prompt of length {len(prompt)}")
+    response = await create_completion_async(
+        get_async_client(), **_completion_kwargs(prompt, temperature, model, max_tokens)
     )
     return response.choices[0].message.content.strip()
@@ -0,0 +1,144 @@
+"""
+Persistent quiz bank.
+
+Finished quizzes (after any difficulty regeneration) are stored under a hash of
+their title and chunk, with no TTL or eviction, so ``/api/quiz`` answers a banked
+chunk with one primary-key lookup instead of a model call. Live generation adds
+to the bank on a miss, and ``data_prep/pregenerate_quizzes.py`` fills it ahead
+of time, most-requested books first.
+
+The bank also keeps the request log that ordering comes from: a count per
+normalized quiz query, with the title it resolved to.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from config import QUIZ_BANK_ENABLED, QUIZ_BANK_PATH
+from services.vector_store import normalize_query
+from utils.metrics import register_collector
+
+class QuizBank:
+    """Quizzes and quiz request counts in an SQLite file shared by every process on the host."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quizzes ("
+                " key TEXT PRIMARY KEY,"
+                " title TEXT NOT NULL,"
+                " quiz TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quiz_requests ("
+                " query TEXT PRIMARY KEY,"
+                " title TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " last_requested REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork so children never share one
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        row = self._connect().execute("SELECT quiz FROM quizzes WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def __contains__(self, key: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM quizzes WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, title: str, quiz: List[Dict[str, Any]]) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO quizzes (key, title, quiz, created_at) VALUES (?, ?, ?, ?)",
+            (key, title, json.dumps(quiz), time.time()),
+        )
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM quizzes").fetchone()[0]
+
+    def record_request(self, query: str, title: str) -> None:
+        self._connect().execute(
+            "INSERT INTO quiz_requests (query, title, count, last_requested) VALUES (?, ?, 1, ?)"
+            " ON CONFLICT (query) DO UPDATE SET"
+            " title = excluded.title, count = count + 1, last_requested = excluded.last_requested",
+            (query, title, time.time()),
+        )
+
+    def requested_books(self) -> List[Tuple[str, int, List[str]]]:
+        """``(title, requests, queries)`` for every requested book, most requested first."""
+        books: Dict[str, Tuple[int, List[str]]] = {}
+        rows = self._connect().execute(
+            "SELECT title, query, count FROM quiz_requests ORDER BY count DESC"
+        ).fetchall()
+        for title, query, count in rows:
+            total, queries = books.get(title, (0, []))
+            queries.append(query)
+            books[title] = (total + count, queries)
+        return sorted(
+            ((title, total, queries) for title, (total, queries) in books.items()),
+            key=lambda book: book[1],
+            reverse=True,
+        )
+
+_bank: Optional[QuizBank] = None
+_bank_lock = threading.Lock()
+
+def get_quiz_bank() -> Optional[QuizBank]:
+    """The configured bank, opened once per process, or None when disabled."""
+    global _bank
+    if _bank is None and QUIZ_BANK_ENABLED:
+        with _bank_lock:
+            if _bank is None:
+                _bank = QuizBank(QUIZ_BANK_PATH)
+    return _bank
+
+def _bank_metrics() -> Any:
+    # Only report a bank something has already opened; a scrape should not create one
+    if _bank is not None:
+        yield ("litloot_quiz_bank_quizzes", "gauge", "Quizzes in the quiz bank", [({}, len(_bank))])
+
+register_collector(_bank_metrics)
+
+# A broken bank must not take quizzes down with it, so these only log failures
+
+def lookup_quiz(key: str) -> Optional[List[Dict[str, Any]]]:
+    try:
+        bank = get_quiz_bank()
+        return bank.get(key) if bank is not None else None
+    except Exception as e:
+        logging.warning(f"Quiz bank read failed for {key}: {e}")
+        return None
+
+def store_quiz(key: str, title: str, quiz: List[Dict[str, Any]]) -> None:
+    try:
+        bank = get_quiz_bank()
+        if bank is not None:
+            bank.put(key, title, quiz)
+    except Exception as e:
+        logging.warning(f"Quiz bank write failed for {key}: {e}")
+
+def record_quiz_request(query: str, title: str) -> None:
+    """Count a quiz request for ``title``; the counts order pre-generation."""
+    try:
+        bank = get_quiz_bank()
+        if bank is not None:
+            bank.record_request(normalize_query(query), title)
+    except Exception as e:
+        logging.warning(f"Quiz bank request log failed: {e}")
@@ -2,13 +2,16 @@ import json
 import logging
 from collections import Counter
 
-from .openai_client import ask_openai
-from utils.cache import get_or_set
+from .openai_client import ask_openai, ask_openai_async
+from utils.cache import get_or_set, get_or_set_async, make_key
+from services.quiz_bank import lookup_quiz, store_quiz
+from services.vector_store import run_in_search_pool
+from utils import metrics
 
 PROMPT_VERSION = "quiz-v2-multiple-choice"
 
-def _generate_quiz_internal(title, text_chunk):
-    prompt = f"""
+def _quiz_prompt(title, text_chunk):
+    return f"""
 You are a literary quiz generator. Create a structured quiz based on the excerpt from the book titled "{title}". Your questions should focus on **themes**, **character arcs**, **moral questions**, and **reader interpretation**.
 
 Each quiz item must be a JSON object with:
@@ -31,37 +34,52 @@ Excerpt:
 {text_chunk}
 \"\"\"
 """
+
+def _is_generated(quiz_items):
+    """False for the placeholder quiz, which should not be cached"""
+    return not any(item.get("type") == "error" for item in quiz_items)
+
+def _parse_quiz(response):
+    try:
+        parsed = json.loads(response)
+        if isinstance(parsed, list) and all("question" in q and "correct_answer" in q and "incorrect_answers" in q for q in parsed):
+            return parsed
+    except Exception:
+        pass
+    return [{
+        "question": "Could not generate a structured quiz.",
+        "correct_answer": "N/A",
+        "incorrect_answers": ["N/A", "N/A", "N/A"],
+        "difficulty": "medium",
+        "type": "error"
+    }] * 10
+
+def _generate_quiz_internal(title, text_chunk):
+    prompt = _quiz_prompt(title, text_chunk)
+
     def task():
-        response = ask_openai(prompt)
-        try:
-            parsed = json.loads(response)
-            if isinstance(parsed, list) and all("question" in q and "correct_answer" in q and "incorrect_answers" in q for q in parsed):
-                return parsed
-        except Exception:
-            pass
-        return [{
-            "question": "Could not generate a structured quiz.",
-            "correct_answer": "N/A",
-            "incorrect_answers": ["N/A", "N/A", "N/A"],
-            "difficulty": "medium",
-            "type": "error"
-        }] * 10
-
-    return get_or_set(f"{title}-quiz-{text_chunk[:80]}", task)
+        return _parse_quiz(ask_openai(prompt))
+
+    return get_or_set(make_key("quiz", PROMPT_VERSION, title, text_chunk), task, _is_generated)
+
+async def _generate_quiz_internal_async(title, text_chunk):
+    prompt = _quiz_prompt(title, text_chunk)
+
+    async def task():
+        return _parse_quiz(await ask_openai_async(prompt))
+
+    return await get_or_set_async(make_key("quiz", PROMPT_VERSION, title, text_chunk), task, _is_generated)
 
 def is_too_difficult(quiz_items):
     difficulties = Counter(item["difficulty"] for item in quiz_items)
     return difficulties.get("hard", 0) >= 6
 
-def regenerate_quiz_if_needed(title, chunk, original_quiz):
-    if not is_too_difficult(original_quiz):
-        return original_quiz
-
+def _regen_prompt(chunk, original_quiz):
     previous_context = "\n".join(
         f"Q: {q['question']}\nA: {q['correct_answer']}" for q in original_quiz
     )
 
-    prompt = f"""
+    return f"""
 The following quiz was too difficult. Please regenerate simpler questions using this context:
 
 \"\"\"
@@ -76,27 +94,89 @@ Excerpt:
 Return JSON list with fields: question, correct_answer, incorrect_answers (list of 3), difficulty, type.
 """
 
+def _parse_regenerated(response, original_quiz):
+    try:
+        return json.loads(response)
+    except Exception:
+        return original_quiz
+
+def regenerate_quiz_if_needed(title, chunk, original_quiz):
+    if not is_too_difficult(original_quiz):
+        return original_quiz
+
+    prompt = _regen_prompt(chunk, original_quiz)
+
     def regen_task():
-        response = ask_openai(prompt)
-        try:
-            return json.loads(response)
-        except Exception:
-            return original_quiz
+        return _parse_regenerated(ask_openai(prompt), original_quiz)
+
+    return get_or_set(make_key("quiz-regen", PROMPT_VERSION, title, chunk), regen_task)
+
+async def regenerate_quiz_if_needed_async(title, chunk, original_quiz):
+    if not is_too_difficult(original_quiz):
+        return original_quiz
 
-    return get_or_set(f"{title}-regen-{chunk[:80]}", regen_task)
+    prompt = _regen_prompt(chunk, original_quiz)
+
+    async def regen_task():
+        return _parse_regenerated(await ask_openai_async(prompt), original_quiz)
+
+    return await get_or_set_async(make_key("quiz-regen", PROMPT_VERSION, title, chunk), regen_task)
 
 def log_quiz_metrics(title, quiz_items):
     difficulties = Counter(item["difficulty"] for item in quiz_items)
     types = Counter(item["type"] for item in quiz_items)
     logging.info(f"Quiz for '{title}': {dict(difficulties)} types: {dict(types)}")
 
-def generate_quiz(title, chunk):
-    quiz = _generate_quiz_internal(title, chunk)
-    log_quiz_metrics(title, quiz)
-
-    if is_too_difficult(quiz):
-        logging.info(f"Regenerating quiz for '{title}' due to high difficulty...")
-        quiz = regenerate_quiz_if_needed(title, chunk, quiz)
-        log_quiz_metrics(f"{title} (regenerated)", quiz)
+QUIZZES = metrics.Counter("litloot_quizzes_total", "Quizzes served, by where they came from", ["source"])
+QUIZ_REGENERATIONS = metrics.Counter("litloot_quiz_regenerations_total", "Quizzes regenerated for being too hard")
 
+def _finish(key, title, quiz):
+    generated = _is_generated(quiz)
+    QUIZZES.inc(source="generated" if generated else "fallback")
+    if generated:
+        store_quiz(key, title, quiz)
     return quiz
+
+def bank_key(title, chunk):
+    return make_key("quiz-bank", PROMPT_VERSION, title, chunk)
+
+def generate_quiz(title, chunk):
+    key = bank_key(title, chunk)
+    with metrics.timed("quiz_bank"):
+        banked = lookup_quiz(key)
+    if banked is not None:
+        QUIZZES.inc(source="bank")
+        return banked
+
+    with metrics.timed("quiz_generate"):
+        quiz = _generate_quiz_internal(title, chunk)
+        log_quiz_metrics(title, quiz)
+
+        if is_too_difficult(quiz):
+            logging.info(f"Regenerating quiz for '{title}' due to high difficulty...")
+            QUIZ_REGENERATIONS.inc()
+            quiz = regenerate_quiz_if_needed(title, chunk, quiz)
+            log_quiz_metrics(f"{title} (regenerated)", quiz)
+
+    return _finish(key, title, quiz)
+
+async def generate_quiz_async(title, chunk):
+    key = bank_key(title, chunk)
+    # The quiz bank is SQLite, so its calls run off the event loop
+    with metrics.timed("quiz_bank"):
+        banked = await run_in_search_pool(lookup_quiz, key)
+    if banked is not None:
+        QUIZZES.inc(source="bank")
+        return banked
+
+    with metrics.timed("quiz_generate"):
+        quiz = await _generate_quiz_internal_async(title, chunk)
+        log_quiz_metrics(title, quiz)
+
+        if is_too_difficult(quiz):
+            logging.info(f"Regenerating quiz for '{title}' due to high difficulty...")
+            QUIZ_REGENERATIONS.inc()
+            quiz = await regenerate_quiz_if_needed_async(title, chunk, quiz)
+            log_quiz_metrics(f"{title} (regenerated)", quiz)
+
+    return await run_in_search_pool(_finish, key, title, quiz)
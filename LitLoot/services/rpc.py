@@ -0,0 +1,200 @@
+"""
+Minimal request/reply RPC between LitLoot processes.
+
+Built on ``multiprocessing.connection``: messages are pickled, and both sides
+prove they hold the same authkey with an HMAC handshake before anything is
+unpickled. A server exposes a fixed set of methods of one object and answers
+each client connection, handshake included, on its own thread. Used by index shard servers
+(services/shards.py) and the embedding server (services/embedding_server.py).
+
+Like ``index_factory``, this module must not import ``config``.
+"""
+import logging
+import os
+import socket
+import stat
+import struct
+import threading
+from multiprocessing.connection import AuthenticationError, Connection, Listener, answer_challenge, deliver_challenge
+from typing import Any, Sequence, Tuple, Union
+
+Address = Union[str, Tuple[str, int]]
+AUTHKEY_ENV = "LITLOOT_RPC_AUTHKEY"
+# How long a server waits for a new client to complete the authkey challenge
+HANDSHAKE_TIMEOUT_SECONDS = 10.0
+
+
+class RemoteCallError(RuntimeError):
+    """The server could not be reached, did not answer in time, or raised."""
+
+
+def parse_address(address: str) -> Address:
+    """``host:port`` for TCP; anything without a port is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def authkey_from_env() -> bytes:
+    """
+    The shared authkey from ``LITLOOT_RPC_AUTHKEY``. There is deliberately no default:
+    whoever holds the key can make a server unpickle anything.
+    """
+    authkey = os.getenv(AUTHKEY_ENV, "")
+    if not authkey:
+        raise ValueError(f"{AUTHKEY_ENV} is not set; generate one with "
+                         "python -c 'import secrets; print(secrets.token_hex(32))'")
+    return authkey.encode()
+
+
+def _set_io_timeout(conn: Connection, seconds: float) -> None:
+    """Make blocking reads and writes on ``conn`` fail after ``seconds`` (0 waits forever)."""
+    sock = socket.socket(fileno=conn.fileno())
+    try:
+        timeval = struct.pack("ll", int(seconds), int(seconds % 1 * 1_000_000))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+    finally:
+        # The fd stays owned by ``conn``
+        sock.detach()
+
+
+def _connect(address: Address, authkey: bytes, timeout: float) -> Connection:
+    """``multiprocessing.connection.Client``, but with connect and handshake bounded by ``timeout``."""
+    if isinstance(address, tuple):
+        sock = socket.create_connection(address, timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+        except BaseException:
+            sock.close()
+            raise
+    # Back to a blocking socket, which Connection expects; SO_RCVTIMEO bounds the handshake
+    sock.settimeout(None)
+    conn = Connection(sock.detach())
+    try:
+        _set_io_timeout(conn, timeout)
+        answer_challenge(conn, authkey)
+        deliver_challenge(conn, authkey)
+        # Replies are waited for with poll(timeout) instead
+        _set_io_timeout(conn, 0)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def _serve_connection(conn: Connection, authkey: bytes, target: Any, calls: Sequence[str], name: str) -> None:
+    with conn:
+        # On this connection's thread, so a client that stalls the handshake holds up only itself
+        try:
+            _set_io_timeout(conn, HANDSHAKE_TIMEOUT_SECONDS)
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+            _set_io_timeout(conn, 0)
+        except (AuthenticationError, EOFError, OSError) as e:
+            logging.warning(f"Rejected {name} client: {e}")
+            return
+        while True:
+            try:
+                call, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if call not in calls:
+                    raise ValueError(f"Unknown call '{call}'")
+                reply = ("ok", getattr(target, call)(*args))
+            except Exception as e:
+                reply = ("error", f"{type(e).__name__}: {e}")
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def _listen(address: Address) -> Listener:
+    # No authkey: Listener would run the challenge inside accept(), on the accept loop
+    if isinstance(address, tuple):
+        return Listener(address, backlog=128)
+    directory = os.path.dirname(address)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+        # Left behind by a server that was killed
+        os.unlink(address)
+    # Created owner-only (0600), so only this user's processes can connect
+    umask = os.umask(0o177)
+    try:
+        return Listener(address, backlog=128)
+    finally:
+        os.umask(umask)
+
+
+def serve(address: Address, authkey: bytes, target: Any, calls: Sequence[str], name: str) -> None:
+    """Answer ``calls`` on ``target`` until killed, one thread per client connection."""
+    with _listen(address) as listener:
+        logging.info(f"Serving {name} on {listener.address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError as e:
+                logging.warning(f"Failed to accept a {name} client: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, authkey, target, calls, name),
+                             daemon=True).start()
+
+
+class RpcClient:
+    """Calls one server, over one connection per calling thread."""
+
+    def __init__(self, address: Address, authkey: bytes, timeout: float, name: str = "RPC server") -> None:
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.name = name
+        self._local = threading.local()
+
+    def _connection(self) -> Tuple[Any, bool]:
+        conn = getattr(self._local, "conn", None)
+        # Connections do not survive fork, so a child opens its own
+        if conn is not None and self._local.pid == os.getpid():
+            return conn, False
+        self._local.conn = _connect(self.address, self.authkey, self.timeout)
+        self._local.pid = os.getpid()
+        return self._local.conn, True
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, call: str, *args: Any) -> Any:
+        while True:
+            fresh = True
+            try:
+                conn, fresh = self._connection()
+                conn.send((call, args))
+                # A late reply would answer the next call, so a timed-out connection is dropped
+                if not conn.poll(self.timeout):
+                    self._drop()
+                    raise RemoteCallError(f"{self.name} {self.address} did not answer within {self.timeout}s")
+                status, result = conn.recv()
+            except AuthenticationError as e:
+                self._drop()
+                raise RemoteCallError(f"{self.name} {self.address} refused the authkey") from e
+            except (EOFError, OSError) as e:
+                self._drop()
+                # A kept connection may have been closed by a server restart since: retry once, fresh
+                if not fresh:
+                    continue
+                raise RemoteCallError(f"{self.name} {self.address} is unreachable: {e}") from e
+            if status != "ok":
+                raise RemoteCallError(f"{self.name} {self.address} failed: {result}")
+            return result
@@ -0,0 +1,188 @@
+"""
+Semantic cache for first-turn chat answers.
+
+Near-duplicate questions ("books like Pride and Prejudice", "recommend something
+like Pride & Prejudice") would each pay a full tool loop. Instead, the query is
+embedded with the search encoder and looked up in a small FAISS index of earlier
+queries. If one is at least ``SEMANTIC_CACHE_THRESHOLD`` similar (cosine), its
+answer and books are reused.
+
+Only a conversation's first query is cached, because later answers depend on
+the history. Entries expire after ``SEMANTIC_CACHE_TTL_SECONDS``. Past
+``SEMANTIC_CACHE_MAX_ENTRIES``, the least recently used entry is evicted. The
+cache is per process and off by default.
+
+``litloot_semantic_cache_similarity`` records the best similarity of every
+lookup, hits and misses. It shows how the hit rate would change with the
+threshold.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+from config import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_TTL_SECONDS,
+)
+from services.vector_store import embed_queries
+from utils.metrics import Counter, Histogram, register_collector, timed
+
+LOOKUPS = Counter("litloot_semantic_cache_total", "Semantic chat cache lookups", ["result"])
+EVICTIONS = Counter("litloot_semantic_cache_evictions_total", "Semantic chat cache entries dropped", ["reason"])
+SIMILARITY = Histogram(
+    "litloot_semantic_cache_similarity", "Best cached-query similarity per lookup",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1.0),
+)
+
+class CachedAnswer(NamedTuple):
+    query: str
+    response: str
+    books: List[Dict[str, Any]]
+    expires_at: float
+
+class SemanticCache:
+    """Answers keyed by query embedding: an inner-product FAISS index over unit vectors, plus an LRU."""
+
+    # Neighbours checked per lookup, so an expired best match does not hide a live one
+    CANDIDATES = 4
+    # Expired entries are only found by lookups, so sweep for them every this many puts
+    SWEEP_EVERY = 100
+
+    def __init__(self, threshold: float, max_entries: int, ttl: Optional[float] = None) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index: Optional[faiss.Index] = None
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._puts = 0
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.array(vector, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, ids: List[int], reason: str) -> None:
+        for entry_id in ids:
+            del self._entries[entry_id]
+        self._index.remove_ids(np.asarray(ids, dtype="int64"))
+        EVICTIONS.inc(len(ids), reason=reason)
+
+    def get(self, vector: np.ndarray) -> Tuple[Optional[CachedAnswer], Optional[float]]:
+        """
+        The closest live entry if it is within the threshold, and that entry's similarity
+        (reported on a miss too, for tuning the threshold). None when no entry is live.
+        """
+        with self._lock:
+            if self._index is None or not self._entries:
+                return None, None
+            similarities, ids = self._index.search(self._unit(vector), min(self.CANDIDATES, len(self._entries)))
+            now = time.time()
+            expired = []
+            found, best = None, None
+            for similarity, entry_id in zip(similarities[0], ids[0]):
+                entry = self._entries.get(int(entry_id))
+                if entry is None:
+                    continue
+                if self.ttl and entry.expires_at <= now:
+                    expired.append(int(entry_id))
+                    continue
+                best = float(similarity)
+                if similarity >= self.threshold:
+                    self._entries.move_to_end(int(entry_id))
+                    found = entry
+                break
+            if expired:
+                self._remove(expired, "ttl")
+            return found, best
+
+    def put(self, vector: np.ndarray, query: str, response: str, books: List[Dict[str, Any]]) -> None:
+        if self.max_entries <= 0:
+            return
+        vector = self._unit(vector)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            expires_at = time.time() + self.ttl if self.ttl else float("inf")
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype="int64"))
+            self._entries[entry_id] = CachedAnswer(query, response, books, expires_at)
+            self._puts += 1
+            if self.ttl and self._puts % self.SWEEP_EVERY == 0:
+                now = time.time()
+                expired = [i for i, entry in self._entries.items() if entry.expires_at <= now]
+                if expired:
+                    self._remove(expired, "ttl")
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._remove(list(self._entries)[:overflow], "size")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+
+_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL_SECONDS or None)
+
+def get_semantic_cache() -> SemanticCache:
+    return _cache
+
+def _semantic_cache_metrics() -> Any:
+    if SEMANTIC_CACHE_ENABLED:
+        yield ("litloot_semantic_cache_entries", "gauge", "Answers in the semantic chat cache", [({}, len(_cache))])
+
+register_collector(_semantic_cache_metrics)
+
+def is_cacheable(history: List[Dict[str, Any]], requested: bool = True) -> bool:
+    """
+    True when this chat turn may be answered from, and stored in, the cache.
+
+    ``history`` includes the new query, so a first turn has exactly one entry.
+    ``requested`` is the request's bypass flag. A bypassed first turn is counted,
+    so the hit rate can be compared with and without the cache.
+    """
+    if not SEMANTIC_CACHE_ENABLED or len(history) != 1:
+        return False
+    if not requested:
+        LOOKUPS.inc(result="bypass")
+        return False
+    return True
+
+# A broken cache must not take chat down with it, so these only log failures
+
+def lookup_answer(query: str) -> Optional[Dict[str, Any]]:
+    """A cached ``{"response", "books", "similarity"}`` for a query like this one, or None."""
+    try:
+        with timed("semantic_cache"):
+            entry, similarity = _cache.get(embed_queries([query])[0])
+    except Exception as e:
+        logging.warning(f"Semantic cache lookup failed: {e}")
+        return None
+    if similarity is not None:
+        SIMILARITY.observe(similarity)
+    if entry is None:
+        LOOKUPS.inc(result="miss")
+        return None
+    LOOKUPS.inc(result="hit")
+    logging.info(f"Semantic cache hit ({similarity:.3f}) for {query!r}: answered as {entry.query!r}")
+    return {"response": entry.response, "books": entry.books, "similarity": similarity}
+
+def store_answer(query: str, response: str, books: List[Dict[str, Any]]) -> None:
+    try:
+        # The lookup just embedded this query, so this is an embedding cache hit
+        _cache.put(embed_queries([query])[0], query, response, books)
+    except Exception as e:
+        logging.warning(f"Semantic cache write failed: {e}")
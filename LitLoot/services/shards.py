@@ -0,0 +1,318 @@
+"""
+Sharded chunk index: split by book, searched by scatter-gather across processes.
+
+One in-process index caps the corpus at one machine's RAM and runs each search
+on one core. ``write_shards`` splits a built index into N shards under
+``<index>/shards/``. Each shard holds its books' chunk vectors plus its slice of
+the chunk metadata:
+
+- ``shard_<i>/books.index``: the vectors, keeping their global ids (chunk store rows)
+- ``shard_<i>/chunk_ids.npy``: those ids, sorted
+- ``shard_<i>/chunk_meta.npy``: their ``(book_id, chunk_index)`` rows
+- ``shards.json``: shard count and sizes, written last
+
+Books are assigned by ``book_id % N``, so a book never spans shards and each
+shard can keep one hit per book on its own. Each shard is served by its own
+process (``python -m services.shards serve``), answering over services/rpc.py.
+``ShardedIndex`` sends every query batch to all shards at once and merges their
+top-k by distance. It can stand in for the FAISS index in ``vector_store``.
+
+Like ``index_factory``, this module must not import ``config``.
+
+    python -m services.shards split vector_index --shards 4
+    python -m services.shards serve vector_index/shards --base-port 9100
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from services.index_factory import read_index, set_search_params
+from services.rpc import Address, RemoteCallError, RpcClient, authkey_from_env, parse_address, serve
+from utils.metrics import Counter
+
+SHARDS_DIR = "shards"
+SHARD_ERRORS = Counter("litloot_shard_errors_total", "Shard searches that failed or timed out", ["shard"])
+
+
+def shard_dir(shards_dir: str, shard: int) -> str:
+    return os.path.join(shards_dir, f"shard_{shard}")
+
+
+def _index_ids(index: faiss.Index) -> Tuple[faiss.Index, np.ndarray]:
+    """The index to reconstruct vectors from, and the id of every vector in it."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return index, faiss.vector_to_array(index.id_map).astype("int64")
+    # Indexes from before the ID map use positions as ids
+    return index, np.arange(index.ntotal, dtype="int64")
+
+
+def _empty_copy(index: faiss.Index) -> faiss.Index:
+    """An empty index of the same kind, keeping IVF training and HNSW build settings."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    empty = faiss.clone_index(base)
+    empty.reset()
+    if isinstance(empty, faiss.IndexIVF):
+        empty.make_direct_map(False)
+    return empty
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def write_shards(index_dir: str, n_shards: int, batch_size: int = 65536) -> List[int]:
+    """
+    Split the index in ``index_dir`` into ``n_shards`` shards under ``index_dir/shards``.
+
+    Vectors are reconstructed from the built index and added to an empty copy of
+    it, so IVF shards share the trained coarse quantizer. IVF-PQ vectors are
+    decoded and re-encoded, which can move a few codes. Shards are derived data
+    and are rewritten in full. Returns the vector count of each shard.
+    """
+    if n_shards < 1:
+        raise ValueError(f"Need at least one shard, got {n_shards}")
+    meta_path = os.path.join(index_dir, "chunk_meta.npy")
+    if not os.path.exists(meta_path):
+        raise RuntimeError(f"No {meta_path}; run data_prep/convert_metadata.py before sharding")
+    chunk_meta = np.load(meta_path, mmap_mode="r")
+    # Downcast views do not own the index, so the loaded one must stay referenced
+    loaded = faiss.read_index(os.path.join(index_dir, "books.index"))
+    index, ids = _index_ids(loaded)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        # IVF vectors can only be reconstructed by id through a direct map
+        inner.make_direct_map()
+    owner = chunk_meta[ids, 0] % n_shards
+
+    shards_dir = os.path.join(index_dir, SHARDS_DIR)
+    sizes = []
+    for shard in range(n_shards):
+        path = shard_dir(shards_dir, shard)
+        os.makedirs(path, exist_ok=True)
+        shard_ids = np.sort(ids[owner == shard])
+        shard_index = faiss.IndexIDMap2(_empty_copy(index))
+        for start in range(0, len(shard_ids), batch_size):
+            batch = shard_ids[start:start + batch_size]
+            shard_index.add_with_ids(index.reconstruct_batch(batch), batch)
+        faiss.write_index(shard_index, os.path.join(path, "books.index.tmp"))
+        os.replace(os.path.join(path, "books.index.tmp"), os.path.join(path, "books.index"))
+        _save_array(os.path.join(path, "chunk_ids.npy"), shard_ids)
+        _save_array(os.path.join(path, "chunk_meta.npy"), np.ascontiguousarray(chunk_meta[shard_ids]))
+        sizes.append(len(shard_ids))
+
+    # Shards left over from an earlier split into more pieces would serve stale vectors
+    stale = n_shards
+    while os.path.isdir(shard_dir(shards_dir, stale)):
+        shutil.rmtree(shard_dir(shards_dir, stale))
+        stale += 1
+    with open(os.path.join(shards_dir, "shards.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump({"shards": n_shards, "vector_count": int(len(ids)), "sizes": sizes}, f)
+    os.replace(os.path.join(shards_dir, "shards.json.tmp"), os.path.join(shards_dir, "shards.json"))
+    return sizes
+
+
+class Shard:
+    """One shard's vectors and chunk metadata slice, searched in this process."""
+
+    def __init__(self, path: str, mmap: bool = False) -> None:
+        self.path = path
+        self.index = read_index(os.path.join(path, "books.index"), mmap=mmap)
+        self.chunk_ids: np.ndarray = np.load(os.path.join(path, "chunk_ids.npy"), mmap_mode="r")
+        self.book_ids: np.ndarray = np.load(os.path.join(path, "chunk_meta.npy"), mmap_mode="r")[:, 0]
+
+    def _books(self, indices: np.ndarray) -> np.ndarray:
+        rows = np.searchsorted(self.chunk_ids, np.maximum(indices, 0))
+        return self.book_ids[np.minimum(rows, len(self.book_ids) - 1)]
+
+    def search(self, vectors: np.ndarray, k: int, per_book: bool = False,
+               overfetch: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """FAISS-style ``(distances, ids)``; with ``per_book``, each row's best hit per book."""
+        if not per_book or not len(self.chunk_ids):
+            return self.index.search(vectors, k)
+        distances, indices = self.index.search(vectors, k * overfetch)
+        best_distances = np.full((len(indices), k), np.inf, dtype="float32")
+        best_indices = np.full((len(indices), k), -1, dtype="int64")
+        for row, (row_distances, row_indices) in enumerate(zip(distances, indices)):
+            seen = set()
+            for distance, i, book in zip(row_distances, row_indices, self._books(row_indices).tolist()):
+                if i < 0 or len(seen) == k:
+                    break
+                if book not in seen:
+                    best_distances[row, len(seen)] = distance
+                    best_indices[row, len(seen)] = i
+                    seen.add(book)
+        return best_distances, best_indices
+
+    def info(self) -> Dict[str, Any]:
+        return {"path": self.path, "vectors": int(self.index.ntotal), "pid": os.getpid()}
+
+
+# Calls a shard server answers; anything else is refused
+SHARD_CALLS = ("search", "info")
+
+
+def serve_shard(path: str, address: Address, authkey: bytes, mmap: bool = False,
+                nprobe: Optional[int] = None, ef_search: Optional[int] = None, threads: int = 0) -> None:
+    """Serve one shard until killed."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if threads:
+        faiss.omp_set_num_threads(threads)
+    shard = Shard(path, mmap=mmap)
+    set_search_params(shard.index, nprobe=nprobe, ef_search=ef_search)
+    serve(address, authkey, shard, SHARD_CALLS, f"shard {path} ({shard.index.ntotal} vectors)")
+
+
+def merge_results(results: Sequence[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Each row's ``k`` smallest distances over all shards' results, FAISS-style."""
+    distances = np.hstack([d for d, _ in results])
+    indices = np.hstack([i for _, i in results])
+    # FAISS pads missing hits with -1 ids and the largest float distance, so they sort last
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class ShardedIndex:
+    """
+    Searches every shard in parallel and merges their top-k by distance.
+
+    A shard that fails or times out is logged, counted in
+    ``litloot_shard_errors_total`` and left out, so results degrade to the
+    remaining shards' books. When no shard answers, the search fails.
+    """
+
+    def __init__(self, addresses: Sequence[str], authkey: bytes, timeout: float = 5.0,
+                 concurrency: int = 4) -> None:
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        self.clients = [RpcClient(parse_address(a), authkey, timeout, "Shard") for a in self.addresses]
+        self._max_workers = len(self.clients) * max(1, concurrency)
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive fork, so each process starts its own pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="shard-search")
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _scatter(self, call: str, *args: Any) -> List[Any]:
+        """Each shard's result, or None where it failed."""
+        futures = [self._executor().submit(client.call, call, *args) for client in self.clients]
+        # One deadline for the whole scatter: a stalled shard must not hold up the others' results
+        wait(futures, timeout=self.timeout)
+        results = []
+        for address, future in zip(self.addresses, futures):
+            if not future.done():
+                # Still connecting or waiting; its client gives up on its own timeout
+                future.cancel()
+                SHARD_ERRORS.inc(shard=address)
+                logging.warning(f"Shard {address} did not answer within {self.timeout}s")
+                results.append(None)
+                continue
+            try:
+                results.append(future.result())
+            except RemoteCallError as e:
+                SHARD_ERRORS.inc(shard=address)
+                logging.warning(str(e))
+                results.append(None)
+        return results
+
+    def search(self, vectors: np.ndarray, k: int, per_book: bool = False,
+               overfetch: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        FAISS-style ``(distances, ids)`` over all shards.
+
+        With ``per_book`` each shard keeps its best hit per book out of
+        ``k * overfetch``. No book spans shards, so the merge needs no second pass.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        results = [r for r in self._scatter("search", vectors, k, per_book, overfetch) if r is not None]
+        if not results:
+            raise RemoteCallError(f"None of the {len(self.clients)} index shards answered")
+        return merge_results(results, k)
+
+    def info(self) -> List[Optional[Dict[str, Any]]]:
+        """Each shard's ``Shard.info()``, or None for shards that are down."""
+        return self._scatter("info")
+
+
+def _serve_all(args: argparse.Namespace) -> None:
+    try:
+        authkey = authkey_from_env()
+    except ValueError as e:
+        sys.exit(str(e))
+    with open(os.path.join(args.shards_dir, "shards.json"), "r", encoding="utf-8") as f:
+        count = json.load(f)["shards"]
+    shards = [args.shard] if args.shard is not None else list(range(count))
+    # Spawned, so no child inherits FAISS or OpenMP state from this process
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for shard in shards:
+        address = (args.host, args.base_port + shard)
+        processes.append(context.Process(
+            target=serve_shard, name=f"shard-{shard}",
+            args=(shard_dir(args.shards_dir, shard), address, authkey, args.mmap, args.nprobe,
+                  args.ef_search, args.threads),
+        ))
+    for process in processes:
+        process.start()
+    print("LITLOOT_SEARCH_SHARDS=" + ",".join(f"{args.host}:{args.base_port + shard}" for shard in shards))
+
+    def stop(signum: int, frame: Any) -> None:
+        raise KeyboardInterrupt
+    # Children outlive a killed parent, so a supervisor's SIGTERM is passed on to them
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    split = commands.add_parser("split", help="split a built index into shards")
+    split.add_argument("index_dir", nargs="?", default="vector_index")
+    split.add_argument("--shards", type=int, required=True)
+    serve = commands.add_parser("serve", help="serve shards, one process each")
+    serve.add_argument("shards_dir", nargs="?", default=os.path.join("vector_index", SHARDS_DIR))
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--base-port", type=int, default=9100, help="shard i listens on this port + i")
+    serve.add_argument("--shard", type=int, help="serve only this shard")
+    serve.add_argument("--mmap", action="store_true", help="memory-map each shard's index")
+    serve.add_argument("--nprobe", type=int, default=int(os.getenv("LITLOOT_SEARCH_NPROBE", "16")))
+    serve.add_argument("--ef-search", type=int, default=int(os.getenv("LITLOOT_SEARCH_EF_SEARCH", "64")))
+    serve.add_argument("--threads", type=int, default=0, help="FAISS threads per shard (0 for the default)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.command == "split":
+        vector_counts = write_shards(arguments.index_dir, arguments.shards)
+        print(f"✅ Wrote {len(vector_counts)} shards to {os.path.join(arguments.index_dir, SHARDS_DIR)}: "
+              f"{', '.join(str(n) for n in vector_counts)} vectors")
+    else:
+        _serve_all(arguments)
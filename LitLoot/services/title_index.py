@@ -0,0 +1,161 @@
+"""
+Lexical index over book titles and authors.
+
+Most quiz queries are just a book's title. ``TitleIndex.search`` resolves those
+without the encoder or a vector scan: first through an exact map of normalized
+title (and title + author) strings, then through a trigram index scored with the
+Dice coefficient, which absorbs typos and missing words. Both also hold each
+title's short form, cut before a subtitle ("Moby Dick; Or, The Whale" is also
+"Moby Dick"). Queries that match no
+single book return None, and the caller falls back to semantic search.
+"""
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+_LEADING_ARTICLE = re.compile(r"^(the|a|an) ")
+# Where a subtitle starts: "Frankenstein; Or, The Modern Prometheus", "Walden: Life in the Woods"
+_SUBTITLE = re.compile(r"\s*(?:[;:]|,\s*or\b)", re.IGNORECASE)
+
+def normalize_title(text: str) -> str:
+    """Lowercase, punctuation-free, single-spaced, without a leading article."""
+    words = _NON_WORD.sub(" ", text.lower()).strip()
+    return _LEADING_ARTICLE.sub("", words)
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleIndex:
+    """Maps title-like queries to a book's chunk rows."""
+
+    def __init__(self, books: Iterable[Tuple[int, str, str]], chunk_book_ids: Sequence[int],
+                 threshold: float = 0.75) -> None:
+        """
+        Args:
+            books: ``(book_id, title, author)`` for every book that may be returned
+            chunk_book_ids: The book id of each chunk row
+            threshold: Minimum trigram similarity for a fuzzy match
+        """
+        self.threshold = threshold
+        self._exact: Dict[str, Set[int]] = defaultdict(set)
+        # Trigram sets of each book's full and short title, and the variants holding each gram
+        self._variants: List[Tuple[int, Set[str]]] = []
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._book_count = 0
+        for book_id, title, author in books:
+            self._book_count += 1
+            for key in self._keys(title, author):
+                self._exact[key].add(book_id)
+            for text in self._titles(title, author):
+                grams = trigrams(text)
+                for gram in grams:
+                    self._postings[gram].add(len(self._variants))
+                self._variants.append((book_id, grams))
+
+        # A book's rows are one slice of the rows sorted by book id
+        ids = np.asarray(chunk_book_ids, dtype=np.int64)
+        self._rows = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self._rows]
+
+    @staticmethod
+    def _strip_author(title: str, author: str) -> str:
+        # Gutenberg page titles often read "<title> by <author>"
+        suffix = f" by {author}"
+        return title[:-len(suffix)] if author and title.lower().endswith(suffix.lower()) else title
+
+    def _titles(self, title: str, author: str) -> Set[str]:
+        """The normalized title without its author, and its short form without a subtitle."""
+        bare = self._strip_author(title, author)
+        titles = {normalize_title(bare), normalize_title(_SUBTITLE.split(bare, 1)[0])}
+        titles.discard("")
+        return titles
+
+    def _keys(self, title: str, author: str) -> Set[str]:
+        keys = {normalize_title(title)}
+        for bare in self._titles(title, author):
+            keys.add(bare)
+            if author and author != "Unknown":
+                keys |= {normalize_title(f"{bare} {author}"), normalize_title(f"{bare} by {author}"),
+                         normalize_title(f"{author} {bare}")}
+        keys.discard("")
+        return keys
+
+    def __len__(self) -> int:
+        return self._book_count
+
+    def lookup(self, query: str) -> Optional[int]:
+        """The one book ``query`` names, or None when it names none or several."""
+        normalized = normalize_title(query)
+        if not normalized:
+            return None
+        exact = self._exact.get(normalized)
+        if exact:
+            return next(iter(exact)) if len(exact) == 1 else None
+
+        grams = trigrams(normalized)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        # A book scores as its closest title variant
+        scores: Dict[int, float] = {}
+        for variant, count in shared.items():
+            book_id, title_grams = self._variants[variant]
+            # Dice coefficient of the two trigram sets
+            score = 2.0 * count / (len(grams) + len(title_grams))
+            scores[book_id] = max(score, scores.get(book_id, 0.0))
+        best_score, best = 0.0, []
+        for book_id, score in scores.items():
+            if score > best_score:
+                best_score, best = score, [book_id]
+            elif score == best_score:
+                best.append(book_id)
+        if best_score < self.threshold or len(best) != 1:
+            return None
+        return best[0]
+
+    def chunks(self, book_id: int, k: int) -> List[int]:
+        """
+        ``k`` of the book's chunk rows, spread evenly through it.
+
+        The ends are skipped where possible, since they hold the license and front
+        matter. The choice is deterministic, so repeat queries hit the same chunks.
+        """
+        lo = int(np.searchsorted(self._sorted_ids, book_id, side="left"))
+        hi = int(np.searchsorted(self._sorted_ids, book_id, side="right"))
+        rows = self._rows[lo:hi]
+        n = len(rows)
+        if n <= k:
+            return [int(row) for row in rows]
+        picks = dict.fromkeys(int(rows[(j + 1) * n // (k + 1)]) for j in range(k))
+        return list(picks)
+
+    def search(self, query: str, k: int) -> Optional[List[int]]:
+        """Chunk rows for the book ``query`` names, or None to fall back to semantic search."""
+        book_id = self.lookup(query)
+        return self.chunks(book_id, k) if book_id is not None else None
+
+def build_title_index(metadata: Any, threshold: float = 0.75) -> TitleIndex:
+    """Index the live books in a ``MetadataStore`` or a legacy list of per-chunk dicts."""
+    books = getattr(metadata, "books", None)
+    if books is not None:
+        return TitleIndex(
+            ((book_id, book["title"], book["author"]) for book_id, book in enumerate(books)
+             if not book.get("removed")),
+            metadata.chunks[:, 0],
+            threshold,
+        )
+    # Legacy metadata.json repeats each book's fields on every chunk
+    book_ids: Dict[Tuple[Any, ...], int] = {}
+    chunk_book_ids = []
+    for meta in metadata:
+        key = (meta["title"], meta["author"], meta.get("source_file"), meta.get("gutenberg_url"))
+        chunk_book_ids.append(book_ids.setdefault(key, len(book_ids)))
+    return TitleIndex(
+        ((book_id, title, author) for (title, author, _, _), book_id in book_ids.items()),
+        chunk_book_ids,
+        threshold,
+    )
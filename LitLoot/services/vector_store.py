@@ -1,17 +1,461 @@
-import faiss
+"""
+Semantic search over the book chunk index.
+
+Nothing is loaded at import time. The encoder, the FAISS index and the metadata
+are loaded on first use, or up front by ``warm_up()``, so the process can answer
+health checks while they load. ``is_ready()`` reports whether warm-up finished.
+
+Queries that name a known book are answered from the title index
+(services/title_index.py) without encoding; everything else is a vector search.
+With ``SEARCH_MODE=books`` that search is two-stage: the nearest books on the
+small book centroid index first, then only their chunks, one hit per book.
+With ``SEARCH_SHARDS`` the chunk vectors live in shard server processes
+(services/shards.py) that are all searched at once; metadata and chunk text
+stay local. With ``EMBEDDING_SERVER`` queries are encoded by a shared embedding
+server process (services/embedding_server.py) instead of a model loaded here.
+
+In a pre-fork deployment ``preload()`` loads everything in the master, before
+workers are forked, so they share one copy instead of loading their own.
+"""
+import asyncio
+import contextvars
+import gc
 import json
+import logging
+import os
+import queue
+import threading
+import time
+import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from config import VECTOR_INDEX_PATH, METADATA_PATH
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import (
+    VECTOR_INDEX_PATH,
+    METADATA_PATH,
+    BOOKS_PATH,
+    CHUNK_META_PATH,
+    BOOK_INDEX_PATH,
+    INDEX_MMAP,
+    SEARCH_WORKERS,
+    EMBEDDING_CACHE_SIZE,
+    SEARCH_BATCH_WINDOW_MS,
+    SEARCH_MAX_BATCH,
+    SEARCH_DEDUPE_OVERFETCH,
+    SEARCH_NPROBE,
+    SEARCH_EF_SEARCH,
+    SEARCH_MODE,
+    SEARCH_BOOK_CANDIDATES,
+    SEARCH_SHARDS,
+    SHARD_TIMEOUT_SECONDS,
+    EMBEDDING_SERVER,
+    EMBEDDING_TIMEOUT_SECONDS,
+    RPC_AUTHKEY,
+    TITLE_FAST_PATH,
+    TITLE_MATCH_THRESHOLD,
+)
+from services.chunk_store import get_chunk_store
+from services.embedding_server import MODEL_NAME, EmbeddingClient
+from services.index_factory import filtered_search_params, read_index, set_search_params
+from services.metadata_store import MetadataStore
+from services.rpc import parse_address
+from services.shards import ShardedIndex
+from services.title_index import build_title_index
+from utils.metrics import Counter, timed
+
+SEARCH_MODES = ("chunks", "books")
+
+if SEARCH_MODE not in SEARCH_MODES:
+    raise ValueError(f"Unknown search mode '{SEARCH_MODE}', expected one of {', '.join(SEARCH_MODES)}")
+
+class Lazy:
+    """A value built on first access, exactly once even under concurrent access."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded = False
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    start = time.perf_counter()
+                    self._value = self._loader()
+                    self._loaded = True
+                    logging.info(f"Loaded {self.name} in {time.perf_counter() - start:.2f}s")
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+def _load_model():
+    if EMBEDDING_SERVER:
+        return EmbeddingClient(parse_address(EMBEDDING_SERVER), RPC_AUTHKEY.encode(), EMBEDDING_TIMEOUT_SECONDS)
+    # Importing sentence_transformers pulls in torch, which alone takes seconds
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
+
+def _load_metadata():
+    if os.path.exists(BOOKS_PATH) and os.path.exists(CHUNK_META_PATH):
+        return MetadataStore(BOOKS_PATH, CHUNK_META_PATH)
+    logging.warning(f"Loading legacy {METADATA_PATH}; run data_prep/convert_metadata.py to shrink it")
+    with open(METADATA_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _load_index():
+    if SEARCH_SHARDS:
+        sharded = ShardedIndex(SEARCH_SHARDS, RPC_AUTHKEY.encode(), SHARD_TIMEOUT_SECONDS, SEARCH_WORKERS)
+        shards = sharded.info()
+        down = [address for address, info in zip(SEARCH_SHARDS, shards) if info is None]
+        if down:
+            # Not fatal: searches leave them out until they come up
+            logging.warning(f"Index shards not answering: {', '.join(down)}")
+        logging.info(f"Searching {len(SEARCH_SHARDS)} index shards holding "
+                     f"{sum(info['vectors'] for info in shards if info)} vectors")
+        return sharded
+    loaded = read_index(VECTOR_INDEX_PATH, mmap=INDEX_MMAP)
+    set_search_params(loaded, nprobe=SEARCH_NPROBE, ef_search=SEARCH_EF_SEARCH)
+    return loaded
+
+def _load_title_index():
+    return build_title_index(get_metadata(), TITLE_MATCH_THRESHOLD)
+
+class BookChunks:
+    """The chunk rows of each book, stored as runs of consecutive rows in the chunk table."""
+
+    def __init__(self, book_ids):
+        book_ids = np.asarray(book_ids)
+        starts = np.flatnonzero(np.r_[True, book_ids[1:] != book_ids[:-1]]) if len(book_ids) else \
+            np.zeros(0, dtype="int64")
+        ends = np.r_[starts[1:], len(book_ids)].astype("int64")
+        order = np.argsort(book_ids[starts], kind="stable")
+        self._books = book_ids[starts][order]
+        self._starts = starts[order]
+        self._ends = ends[order]
+
+    def rows(self, books):
+        """Every chunk row of ``books``, as one int64 array."""
+        parts = []
+        for book in books:
+            lo, hi = np.searchsorted(self._books, [book, book + 1])
+            parts += [np.arange(start, end, dtype="int64") for start, end in zip(self._starts[lo:hi], self._ends[lo:hi])]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype="int64")
+
+def _load_book_index():
+    if SEARCH_SHARDS:
+        logging.warning("Two-stage search does not run on index shards; searching all chunks instead")
+        return None
+    if not os.path.exists(BOOK_INDEX_PATH) or not isinstance(get_metadata(), MetadataStore):
+        logging.warning(f"No book centroid index at {BOOK_INDEX_PATH}; rebuild the vector index to use "
+                        f"two-stage search. Searching all chunks instead")
+        return None
+    return read_index(BOOK_INDEX_PATH)
+
+def _load_book_chunks():
+    return BookChunks(get_metadata().chunks[:, 0])
+
+_model = Lazy("encoder", _load_model)
+_metadata = Lazy("metadata", _load_metadata)
+_index = Lazy("vector index", _load_index)
+_title_index = Lazy("title index", _load_title_index)
+_book_index = Lazy("book centroid index", _load_book_index)
+_book_chunks = Lazy("book chunk map", _load_book_chunks)
+
+def get_model():
+    return _model.get()
+
+def get_metadata():
+    return _metadata.get()
+
+def get_index():
+    return _index.get()
+
+def get_title_index():
+    return _title_index.get()
+
+def get_book_index():
+    """The book centroid index, or None when the index was built without one."""
+    return _book_index.get()
+
+def get_book_chunks():
+    return _book_chunks.get()
+
+_ready = threading.Event()
+_warm_up_error = None
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def warm_up():
+    """Load everything search needs and run one encode so the first request pays nothing."""
+    global _warm_up_error
+    try:
+        get_metadata()
+        get_index()
+        if TITLE_FAST_PATH:
+            get_title_index()
+        if SEARCH_MODE == "books" and get_book_index() is not None:
+            get_book_chunks()
+        get_model().encode(["warm up"])
+        _ready.set()
+        logging.info("Vector store ready")
+    except Exception as e:
+        _warm_up_error = e
+        logging.error(f"Vector store warm-up failed: {str(e)}", exc_info=True)
+        raise
 
-with open(METADATA_PATH, "r", encoding="utf-8") as f:
-    metadata = json.load(f)
+def preload():
+    """
+    Load the index, metadata, chunk store and encoder now, in the pre-fork master.
 
-index = faiss.read_index(VECTOR_INDEX_PATH)
+    Workers forked afterwards share these pages copy-on-write. FAISS and model
+    weights live outside Python objects and are only read by searches, so they
+    stay shared. Nothing is encoded or searched here, so no thread pool exists
+    to be lost in the fork. The loaded objects are moved out of the garbage
+    collector's reach, so collections in the workers do not write to their pages.
+    """
+    get_metadata()
+    get_index()
+    get_chunk_store()
+    if TITLE_FAST_PATH:
+        get_title_index()
+    if SEARCH_MODE == "books" and get_book_index() is not None:
+        get_book_chunks()
+    if not EMBEDDING_SERVER:
+        get_model()
+    gc.freeze()
+    logging.info("Vector store preloaded for forked workers")
+
+def start_warm_up():
+    """Run warm_up on a background thread, so the server can accept health checks meanwhile."""
+    def run():
+        try:
+            warm_up()
+        except Exception:
+            pass  # already logged, and reported by readiness()
+    threading.Thread(target=run, name="vector-store-warm-up", daemon=True).start()
+
+def is_ready():
+    # Without a warm-up the store is ready once the first search has loaded everything
+    return _ready.is_set() or (_model.loaded and _metadata.loaded and _index.loaded)
+
+def readiness():
+    """Status for the readiness endpoint: ``ready``, ``warming_up`` or ``failed`` with the error."""
+    if is_ready():
+        return {"status": "ready"}
+    if _warm_up_error is not None:
+        return {"status": "failed", "error": str(_warm_up_error)}
+    return {"status": "warming_up"}
+
+# Encoding and FAISS release the GIL, so async callers hand them to this pool
+# instead of blocking the event loop
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="vector-search")
+
+def normalize_query(query):
+    """Canonical form used as the embedding cache key. The encoder is uncased, so case is dropped."""
+    return " ".join(query.lower().split())
+
+class EmbeddingCache:
+    """Thread-safe LRU of normalized query -> embedding vector."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def put(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        # Cached vectors are shared between requests, so nobody may modify them
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+
+EMBEDDING_LOOKUPS = Counter("litloot_embedding_cache_total", "Query embedding cache lookups", ["result"])
+
+def embed_queries(queries):
+    """Embed queries as one float32 matrix, encoding only the ones not cached, in one batch."""
+    keys = [normalize_query(q) for q in queries]
+    vectors = [embedding_cache.get(key) for key in keys]
+    missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+    EMBEDDING_LOOKUPS.inc(len(keys) - len(missing), result="hit")
+    if missing:
+        EMBEDDING_LOOKUPS.inc(len(missing), result="miss")
+        with timed("embed"):
+            encoded = np.asarray(get_model().encode(missing), dtype="float32")
+        fresh = dict(zip(missing, encoded))
+        for key, vector in fresh.items():
+            embedding_cache.put(key, vector)
+        vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+    return np.vstack(vectors).astype("float32", copy=False)
+
+def _book_keys(indices):
+    """A key per hit identifying its book, for one-hit-per-book results."""
+    metadata = get_metadata()
+    if isinstance(metadata, MetadataStore):
+        return metadata.chunks[np.maximum(indices, 0), 0].tolist()
+    # Legacy metadata.json has no book ids
+    return [(metadata[i]["title"], metadata[i]["author"]) if i >= 0 else None for i in indices]
+
+def _first_per_book(distances, indices, k):
+    """Each row's best hit per book, at most ``k``, padded with -1 ids like FAISS results."""
+    best_distances = np.full((len(indices), k), np.inf, dtype="float32")
+    best_indices = np.full((len(indices), k), -1, dtype="int64")
+    for row, (row_distances, row_indices) in enumerate(zip(distances, indices)):
+        seen = set()
+        for distance, i, key in zip(row_distances, row_indices, _book_keys(row_indices)):
+            if i < 0 or len(seen) == k:
+                break
+            if key not in seen:
+                best_distances[row, len(seen)] = distance
+                best_indices[row, len(seen)] = i
+                seen.add(key)
+    return best_distances, best_indices
+
+def _two_stage_search(vectors, k):
+    """Per query, the nearest books on the centroid index, then only their chunks, one per book."""
+    index = get_index()
+    book_chunks = get_book_chunks()
+    with timed("book_select"):
+        _, books = get_book_index().search(vectors, max(k, SEARCH_BOOK_CANDIDATES))
+    distances = np.full((len(vectors), k), np.inf, dtype="float32")
+    indices = np.full((len(vectors), k), -1, dtype="int64")
+    with timed("faiss"):
+        for row, (vector, candidates) in enumerate(zip(vectors, books)):
+            rows = book_chunks.rows(candidates[candidates >= 0])
+            if not len(rows):
+                continue
+            # Rank every chunk of the candidate books, so each book's best chunk is found
+            # however many of its chunks outrank the other books'
+            params = filtered_search_params(index, faiss.IDSelectorBatch(rows), exhaustive=True)
+            found_distances, found_indices = index.search(vector[None], len(rows), params=params)
+            distances[row], indices[row] = (a[0] for a in _first_per_book(found_distances, found_indices, k))
+    return distances, indices
+
+def _search_matrix(queries, k, per_book=False):
+    vectors = embed_queries(queries)
+    if SEARCH_MODE == "books" and get_book_index() is not None:
+        return _two_stage_search(vectors, k)
+    index = get_index()
+    if per_book and isinstance(index, ShardedIndex):
+        # Each shard keeps one hit per book from its own chunk metadata, and no book spans shards
+        with timed("faiss"):
+            return index.search(vectors, k, per_book=True, overfetch=SEARCH_DEDUPE_OVERFETCH)
+    with timed("faiss"):
+        distances, indices = index.search(vectors, k * SEARCH_DEDUPE_OVERFETCH if per_book else k)
+    return _first_per_book(distances, indices, k) if per_book else (distances, indices)
+
+def _hits(indices):
+    # FAISS pads with -1 when the index holds fewer than k vectors
+    metadata = get_metadata()
+    return [(metadata[i], int(i)) for i in indices if i >= 0]
+
+class MicroBatcher:
+    """
+    Collects concurrent searches for up to ``window`` seconds and runs them as one
+    batched encode and one batched ``index.search``.
+    """
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each process starts its own worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, name="search-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, query, k):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((query, k, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                # Nearest-neighbour lists for a smaller k are prefixes of the largest one
+                distances, indices = _search_matrix([query for query, _, _ in batch], max(k for _, k, _ in batch))
+                for (_, k, future), row in zip(batch, indices):
+                    future.set_result(_hits(row[:k]))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+_batcher = MicroBatcher(SEARCH_BATCH_WINDOW_MS / 1000.0, SEARCH_MAX_BATCH) if SEARCH_BATCH_WINDOW_MS > 0 else None
 
 def search(query, k=5):
-    embedding = model.encode([query])
-    distances, indices = index.search(np.array(embedding), k)
-    return [(metadata[i], i) for i in indices[0]]
+    if TITLE_FAST_PATH:
+        with timed("title_lookup"):
+            rows = get_title_index().search(query, k)
+        if rows is not None:
+            return _hits(rows)
+    if _batcher is not None:
+        # Encoding and FAISS run on the batcher thread and are timed there, outside this request
+        with timed("batched_search"):
+            return _batcher.submit(query, k)
+    distances, indices = _search_matrix([query], k)
+    return _hits(indices[0])
+
+def search_many(queries, k=5, per_book=False):
+    """
+    Vector search for many queries at once: one batched encode and one ``index.search``
+    (one per query in ``books`` mode, where each query has its own candidate books).
+
+    Returns, per query, up to ``k`` ``(metadata, idx, distance)`` hits, closest first.
+    Distances are the index's (squared L2 for the built-in index types), so smaller is
+    closer. With ``per_book``, only each book's best chunk is kept, which over-fetches
+    ``SEARCH_DEDUPE_OVERFETCH`` times ``k`` chunks to still fill ``k`` books. In ``books``
+    search mode results are always one per book. The title fast path does not apply,
+    so every hit has a distance.
+    """
+    if not queries:
+        return []
+    distances, indices = _search_matrix(list(queries), k, per_book)
+    metadata = get_metadata()
+    return [
+        [(metadata[int(i)], int(i), float(distance)) for i, distance in zip(row_indices, row_distances) if i >= 0]
+        for row_distances, row_indices in zip(distances, indices)
+    ]
+
+async def run_in_search_pool(func, *args):
+    """Run blocking search work on the search pool from a coroutine, in the caller's context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_search_executor, context.run, func, *args)
+
+async def search_async(query, k=5):
+    return await run_in_search_pool(search, query, k)
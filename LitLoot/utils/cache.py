@@ -1,12 +1,498 @@
-from typing import Any, Callable, Dict, TypeVar, cast
-from services.vector_store import search
+"""
+Result cache for expensive model calls.
+
+Two backends share one interface: a bounded in-memory LRU with a TTL, and an
+SQLite file that every worker on the host shares and that survives restarts.
+``TieredCache`` puts the LRU in front of SQLite. Values must be JSON-serializable.
+Keys come from ``make_key``, which hashes the full content instead of a prefix.
+
+``get_or_set`` is single-flight: concurrent misses for one key share a single
+computation, within a process and, through a lock row in the SQLite tier,
+across the workers on a host.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar, cast
+from config import (
+    CACHE_BACKEND,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL_SECONDS,
+    CACHE_SQLITE_PATH,
+    CACHE_LOCK_TTL_SECONDS,
+    CACHE_LOCK_WAIT_SECONDS,
+)
+from utils.metrics import register_collector
 
 T = TypeVar('T')
-_cache: Dict[str, Any] = {}
-
-def get_or_set(key: str, callback: Callable[[], T]) -> T:
-    if key in _cache:
-        return cast(T, _cache[key])
-    value: T = callback()
-    _cache[key] = value
-    return value
\ No newline at end of file
+
+def make_key(namespace: str, *parts: str) -> str:
+    """Build a cache key from the full content of ``parts``, so shared prefixes never collide."""
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return f"{namespace}:{digest.hexdigest()}"
+
+class CacheStats:
+    """Thread-safe hit/miss/eviction counters."""
+
+    FIELDS = ("hits", "misses", "sets", "evictions", "expirations")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {name: 0 for name in self.FIELDS}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+class CacheBackend(ABC):
+    """Interface for cache backends."""
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+
+    @abstractmethod
+    def get(self, key: str, record: bool = True) -> Tuple[bool, Any]:
+        """
+        Return ``(True, value)`` on a hit and ``(False, None)`` on a miss.
+
+        ``record=False`` leaves the hit/miss counters alone, for polling.
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Store ``value`` under ``key``, replacing any previous value."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Drop ``key`` if present."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Drop every entry."""
+
+    def acquire_lock(self, key: str, owner: str, ttl: float) -> bool:
+        """Try to take the cross-process compute lock for ``key``; it expires after ``ttl`` seconds."""
+        # Process-local backends have no other processes to coordinate with
+        return True
+
+    def release_lock(self, key: str, owner: str) -> None:
+        pass
+
+class MemoryCache(CacheBackend):
+    """Process-local LRU bounded by entry count, with an optional TTL."""
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+
+    def get(self, key: str, record: bool = True) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    if record:
+                        self.stats.incr("hits")
+                    return True, value
+                del self._entries[key]
+                self.stats.incr("expirations")
+        if record:
+            self.stats.incr("misses")
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        self.stats.incr("sets")
+        if evicted:
+            self.stats.incr("evictions", evicted)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache in an SQLite file shared by every process on the host.
+
+    WAL mode lets workers read while one writes. Reads never write, so when the
+    file is over ``max_entries`` the oldest-written entries are evicted first.
+    """
+
+    # Trimming costs a COUNT(*), so only do it every this many writes
+    TRIM_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int, ttl: Optional[float] = None) -> None:
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS locks ("
+                " key TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork so children never share one
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str, record: bool = True) -> Tuple[bool, Any]:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            value, expires_at = row
+            if expires_at is None or expires_at > time.time():
+                if record:
+                    self.stats.incr("hits")
+                return True, json.loads(value)
+            self.delete(key)
+            self.stats.incr("expirations")
+        if record:
+            self.stats.incr("misses")
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now, expires_at),
+        )
+        self.stats.incr("sets")
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def trim(self) -> None:
+        """Drop expired entries, then the oldest ones beyond ``max_entries``."""
+        conn = self._connect()
+        expired = conn.execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        ).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        evicted = 0
+        if count > self.max_entries:
+            evicted = conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stored_at LIMIT ?)",
+                (count - self.max_entries,),
+            ).rowcount
+        if expired:
+            self.stats.incr("expirations", expired)
+        if evicted:
+            self.stats.incr("evictions", evicted)
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM cache")
+
+    def acquire_lock(self, key: str, owner: str, ttl: float) -> bool:
+        conn = self._connect()
+        now = time.time()
+        # A lock whose holder died is taken over once it expires
+        conn.execute("DELETE FROM locks WHERE key = ? AND expires_at <= ?", (key, now))
+        acquired = conn.execute(
+            "INSERT OR IGNORE INTO locks (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, owner, now + ttl),
+        ).rowcount
+        return acquired == 1
+
+    def release_lock(self, key: str, owner: str) -> None:
+        self._connect().execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+
+class TieredCache(CacheBackend):
+    """Memory LRU in front of a shared backend; shared hits are promoted into memory."""
+
+    def __init__(self, memory: MemoryCache, shared: CacheBackend) -> None:
+        super().__init__()
+        self.memory = memory
+        self.shared = shared
+
+    def get(self, key: str, record: bool = True) -> Tuple[bool, Any]:
+        hit, value = self.memory.get(key, record)
+        if not hit:
+            hit, value = self.shared.get(key, record)
+            if hit:
+                self.memory.set(key, value)
+        if record:
+            self.stats.incr("hits" if hit else "misses")
+        return hit, value
+
+    def set(self, key: str, value: Any) -> None:
+        self.shared.set(key, value)
+        self.memory.set(key, value)
+        self.stats.incr("sets")
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        self.shared.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.shared.clear()
+
+    def acquire_lock(self, key: str, owner: str, ttl: float) -> bool:
+        return self.shared.acquire_lock(key, owner, ttl)
+
+    def release_lock(self, key: str, owner: str) -> None:
+        self.shared.release_lock(key, owner)
+
+def create_cache(backend: str = CACHE_BACKEND) -> CacheBackend:
+    """Build the configured backend: ``memory``, ``sqlite`` or ``tiered``."""
+    ttl = CACHE_TTL_SECONDS or None
+    if backend == "memory":
+        return MemoryCache(CACHE_MAX_ENTRIES, ttl)
+    if backend == "sqlite":
+        return SQLiteCache(CACHE_SQLITE_PATH, CACHE_MAX_ENTRIES, ttl)
+    if backend == "tiered":
+        return TieredCache(
+            MemoryCache(CACHE_MAX_ENTRIES, ttl),
+            SQLiteCache(CACHE_SQLITE_PATH, CACHE_MAX_ENTRIES, ttl),
+        )
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+_cache: Optional[CacheBackend] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> CacheBackend:
+    """Open the configured cache once per process, on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache()
+    return _cache
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Counters for the cache and, when tiered, for each tier."""
+    cache = get_cache()
+    stats: Dict[str, Any] = cache.stats.snapshot()
+    if isinstance(cache, TieredCache):
+        stats["memory"] = cache.memory.stats.snapshot()
+        stats["shared"] = cache.shared.stats.snapshot()
+    return stats
+
+def _cache_metrics() -> Any:
+    stats = get_cache_stats()
+    tiers = {"all": stats, **{tier: stats[tier] for tier in ("memory", "shared") if tier in stats}}
+    yield ("litloot_cache_events_total", "counter", "Result cache events, per tier",
+           [({"tier": tier, "event": event}, counts[event]) for tier, counts in tiers.items()
+            for event in CacheStats.FIELDS])
+
+register_collector(_cache_metrics)
+
+def _lookup(key: str, record: bool = True) -> Tuple[bool, Any]:
+    try:
+        return get_cache().get(key, record)
+    except Exception as e:
+        # A broken cache must not take quiz generation down with it
+        logging.warning(f"Cache read failed for {key}: {e}")
+        return False, None
+
+def _store(key: str, value: Any) -> None:
+    try:
+        get_cache().set(key, value)
+    except Exception as e:
+        logging.warning(f"Cache write failed for {key}: {e}")
+
+def _acquire(key: str, owner: str) -> bool:
+    try:
+        return get_cache().acquire_lock(key, owner, CACHE_LOCK_TTL_SECONDS)
+    except Exception as e:
+        logging.warning(f"Cache lock failed for {key}: {e}")
+        return True
+
+def _release(key: str, owner: str) -> None:
+    try:
+        get_cache().release_lock(key, owner)
+    except Exception as e:
+        logging.warning(f"Cache unlock failed for {key}: {e}")
+
+async def _off_loop(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    # SQLite calls block, for up to the busy timeout under write contention, so they
+    # run on a worker thread (which also opens the cache on first use); a memory-only
+    # cache is cheap enough to call in place
+    if isinstance(_cache, MemoryCache):
+        return func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+# How often a worker waiting on another process's computation re-checks the cache
+LOCK_POLL_SECONDS = 0.1
+
+class _Flight:
+    """One in-progress computation that other threads can wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+_async_flights: Dict[str, "asyncio.Future[Any]"] = {}
+
+def _compute_once(key: str, callback: Callable[[], T], should_cache: Optional[Callable[[T], bool]]) -> T:
+    """Compute under the cross-process lock, or wait for the process that holds it."""
+    owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+    deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+    while not _acquire(key, owner):
+        time.sleep(LOCK_POLL_SECONDS)
+        hit, cached = _lookup(key, record=False)
+        if hit:
+            return cast(T, cached)
+        if time.monotonic() >= deadline:
+            logging.warning(f"Gave up waiting for another worker to compute {key}")
+            owner = ""
+            break
+    try:
+        # Another worker may have finished between our miss and taking the lock
+        hit, cached = _lookup(key, record=False)
+        if hit:
+            return cast(T, cached)
+        value: T = callback()
+        if should_cache is None or should_cache(value):
+            _store(key, value)
+        return value
+    finally:
+        if owner:
+            _release(key, owner)
+
+async def _compute_once_async(key: str, callback: Callable[[], Awaitable[T]],
+                              should_cache: Optional[Callable[[T], bool]]) -> T:
+    owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+    deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+    while not await _off_loop(_acquire, key, owner):
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+        hit, cached = await _off_loop(_lookup, key, record=False)
+        if hit:
+            return cast(T, cached)
+        if time.monotonic() >= deadline:
+            logging.warning(f"Gave up waiting for another worker to compute {key}")
+            owner = ""
+            break
+    try:
+        hit, cached = await _off_loop(_lookup, key, record=False)
+        if hit:
+            return cast(T, cached)
+        value: T = await callback()
+        if should_cache is None or should_cache(value):
+            await _off_loop(_store, key, value)
+        return value
+    finally:
+        if owner:
+            await _off_loop(_release, key, owner)
+
+def get_or_set(key: str, callback: Callable[[], T],
+               should_cache: Optional[Callable[[T], bool]] = None) -> T:
+    """Return the cached value for ``key``, computing and storing it on a miss.
+
+    Concurrent misses for the same key wait for one computation and share its
+    result (or its exception). ``should_cache`` can veto storing a computed
+    value, e.g. a fallback result.
+    """
+    hit, cached = _lookup(key)
+    if hit:
+        return cast(T, cached)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return cast(T, flight.value)
+
+    try:
+        flight.value = _compute_once(key, callback, should_cache)
+        return cast(T, flight.value)
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+async def get_or_set_async(key: str, callback: Callable[[], Awaitable[T]],
+                           should_cache: Optional[Callable[[T], bool]] = None) -> T:
+    hit, cached = await _off_loop(_lookup, key)
+    if hit:
+        return cast(T, cached)
+
+    pending = _async_flights.get(key)
+    if pending is not None:
+        # shield: a cancelled waiter must not cancel the computation for everyone else
+        return cast(T, await asyncio.shield(pending))
+
+    future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+    _async_flights[key] = future
+    try:
+        value = await _compute_once_async(key, callback, should_cache)
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        # Mark the exception retrieved so an unwaited future does not log a warning
+        future.exception()
+        raise
+    finally:
+        del _async_flights[key]
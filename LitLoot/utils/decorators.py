@@ -1,20 +1,235 @@
+"""
+Retry policy for upstream calls.
+
+Only transient failures are retried: connection errors, timeouts, 408/409/429
+and 5xx responses. Bad requests, auth errors and exhausted quotas fail at once.
+Waits use exponential backoff with full jitter, or the server's ``Retry-After``
+when it sends one. Every call has a deadline. Retries stop once the next wait
+would overrun it, and ``time_left()`` lets the wrapped call bound its own timeout.
+An optional ``CircuitBreaker`` fails calls fast while the upstream is down.
+"""
+import asyncio
+import contextvars
+import email.utils
 import functools
-import time
 import logging
-from typing import Any, Callable, TypeVar, cast
+import random
+import threading
+import time
+from typing import Any, Callable, Optional, TypeVar, cast
+
+import httpx
+import openai
+
+from utils.metrics import Counter
 
 F = TypeVar('F', bound=Callable[..., Any])
 
-def with_retry(attempts: int = 3, delay: float = 2.0) -> Callable[[F], F]:
+RETRYABLE_STATUS = frozenset({408, 409, 429})
+
+RETRIES = Counter("litloot_retries_total", "Retries scheduled after a transient failure", ["call"])
+RETRIES_EXHAUSTED = Counter("litloot_retries_exhausted_total", "Calls that failed after their last retry", ["call"])
+
+class RetryError(RuntimeError):
+    """A transient failure persisted past the attempts or the deadline."""
+
+class ServiceUnavailableError(RuntimeError):
+    """The call was refused locally, before reaching the upstream. Routes answer 503."""
+
+class CircuitOpenError(ServiceUnavailableError):
+    """The upstream is considered down, so the call was not attempted."""
+
+def is_transient(error: BaseException) -> bool:
+    """True for failures worth retrying: the same request may succeed later."""
+    if isinstance(error, openai.RateLimitError):
+        # Out of quota is a 429 too, but waiting will not fix it
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, TimeoutError, ConnectionError))
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from ``Retry-After`` or ``retry-after-ms``."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # HTTP-date form
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Monotonic time by which the current call must finish, shared by nested retried calls
+_deadline: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("retry_deadline", default=None)
+
+def time_left() -> Optional[float]:
+    """Seconds left before the enclosing retried call's deadline, or None outside one."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+class CircuitBreaker:
+    """
+    Fails calls fast after ``failure_threshold`` consecutive transient failures.
+
+    After ``reset_timeout`` seconds one trial call is let through: success closes
+    the circuit, failure opens it again. A trial that never reports back (say it
+    was cancelled) is replaced by a new one after another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, name: str = "upstream") -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._trial_running else "open"
+
+    def before_call(self) -> None:
+        """Raise ``CircuitOpenError`` unless the call may go ahead."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            waited = now - self._opened_at
+            if waited >= self.reset_timeout:
+                self._trial_running = True
+                self._opened_at = now
+                return
+            retry_in = max(0.0, self.reset_timeout - waited)
+        raise CircuitOpenError(f"{self.name} circuit is open; retry in {retry_in:.0f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info(f"{self.name} circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logging.warning(f"{self.name} circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+class RetryPolicy:
+    """The retry decision shared by the sync and async decorators."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 deadline: Optional[float] = 30.0, breaker: Optional[CircuitBreaker] = None,
+                 retryable: Callable[[BaseException], bool] = is_transient) -> None:
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker
+        self.retryable = retryable
+
+    def start(self) -> "contextvars.Token[Optional[float]]":
+        """Enter a call: its deadline is ours or an enclosing call's, whichever is sooner."""
+        deadline = _deadline.get()
+        if self.deadline:
+            own = time.monotonic() + self.deadline
+            deadline = own if deadline is None else min(deadline, own)
+        return _deadline.set(deadline)
+
+    def before_attempt(self, name: str) -> None:
+        remaining = time_left()
+        if remaining is not None and remaining <= 0:
+            raise RetryError(f"{name} ran out of time before it could be attempted")
+        if self.breaker is not None:
+            self.breaker.before_call()
+
+    def on_success(self) -> None:
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def on_error(self, name: str, error: Exception, attempt: int) -> float:
+        """Seconds to wait before the next attempt, or raise if there should not be one."""
+        if isinstance(error, ServiceUnavailableError):
+            # Refused before it reached the upstream, so it says nothing about its health
+            raise error
+        transient = self.retryable(error)
+        if self.breaker is not None:
+            # A non-transient error is still an answer: the upstream is up
+            if transient:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        if not transient:
+            raise error
+        wait = retry_after(error)
+        if wait is None:
+            wait = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        remaining = time_left()
+        if attempt + 1 >= self.attempts or (remaining is not None and wait >= remaining):
+            RETRIES_EXHAUSTED.inc(call=name)
+            raise RetryError(f"{name} failed after {attempt + 1} attempts: {error}") from error
+        logging.warning(f"Retry {attempt + 1}/{self.attempts} for {name} in {wait:.2f}s: {error}")
+        RETRIES.inc(call=name)
+        return wait
+
+def with_retry(**policy: Any) -> Callable[[F], F]:
+    """Retry a function under a ``RetryPolicy`` built from ``policy``."""
+    retry = RetryPolicy(**policy)
     def wrapper(func: F) -> F:
         @functools.wraps(func)
         def retry_fn(*args: Any, **kwargs: Any) -> Any:
-            for i in range(attempts):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    logging.warning(f"Retry {i+1}/{attempts} for {func.__name__}: {e}")
-                    time.sleep(delay * (i + 1))
-            raise RuntimeError(f"{func.__name__} failed after {attempts} attempts.")
+            token = retry.start()
+            try:
+                for attempt in range(retry.attempts):
+                    retry.before_attempt(func.__name__)
+                    try:
+                        result = func(*args, **kwargs)
+                    except Exception as e:
+                        time.sleep(retry.on_error(func.__name__, e, attempt))
+                        continue
+                    retry.on_success()
+                    return result
+                raise RetryError(f"{func.__name__} was not attempted")
+            finally:
+                _deadline.reset(token)
+        return cast(F, retry_fn)
+    return wrapper
+
+def with_async_retry(**policy: Any) -> Callable[[F], F]:
+    """Coroutine version of with_retry; waits with asyncio.sleep so the event loop stays free."""
+    retry = RetryPolicy(**policy)
+    def wrapper(func: F) -> F:
+        @functools.wraps(func)
+        async def retry_fn(*args: Any, **kwargs: Any) -> Any:
+            token = retry.start()
+            try:
+                for attempt in range(retry.attempts):
+                    retry.before_attempt(func.__name__)
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        await asyncio.sleep(retry.on_error(func.__name__, e, attempt))
+                        continue
+                    retry.on_success()
+                    return result
+                raise RetryError(f"{func.__name__} was not attempted")
+            finally:
+                _deadline.reset(token)
         return cast(F, retry_fn)
     return wrapper
@@ -0,0 +1,233 @@
+"""
+Server-side conversation history, keyed by session id.
+
+The client's session only carries a random ``sid``; the turns live in a
+``HistoryStore``: a per-process LRU (``memory``) or an SQLite file shared by
+every worker on the host (``sqlite``). Each session keeps at most
+``HISTORY_MAX_TURNS`` turns; ``services.chat.build_messages`` decides how much
+of that reaches the model.
+
+Works with any dict-like session (Flask or Quart), so both the WSGI and ASGI
+chat routes share it.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, MutableMapping, Optional
+from config import (
+    HISTORY_BACKEND,
+    HISTORY_MAX_SESSIONS,
+    HISTORY_MAX_TURNS,
+    HISTORY_TTL_SECONDS,
+    HISTORY_SQLITE_PATH,
+)
+
+Turn = Dict[str, Any]
+
+class HistoryStore(ABC):
+    """Interface for history backends."""
+
+    @abstractmethod
+    def get(self, sid: str) -> List[Turn]:
+        """The session's turns, oldest first; empty for an unknown session."""
+
+    @abstractmethod
+    def append(self, sid: str, turns: List[Turn]) -> None:
+        """Add ``turns`` to the session, dropping its oldest past the turn limit."""
+
+    @abstractmethod
+    def clear(self, sid: str) -> None:
+        """Forget the session."""
+
+class MemoryHistoryStore(HistoryStore):
+    """Turns per session in this process, least recently used sessions evicted first."""
+
+    def __init__(self, max_sessions: int, max_turns: int) -> None:
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, List[Turn]]" = OrderedDict()
+
+    def get(self, sid: str) -> List[Turn]:
+        with self._lock:
+            turns = self._sessions.get(sid)
+            if turns is None:
+                return []
+            self._sessions.move_to_end(sid)
+            return list(turns)
+
+    def append(self, sid: str, turns: List[Turn]) -> None:
+        with self._lock:
+            stored = self._sessions.setdefault(sid, [])
+            stored.extend(turns)
+            del stored[:-self.max_turns]
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, sid: str) -> None:
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Turns in an SQLite file shared by every process on the host.
+
+    Sessions idle for longer than ``ttl`` are dropped by a periodic sweep.
+    """
+
+    # The sweep scans the sessions table, so only run it every this many writes
+    SWEEP_EVERY = 100
+
+    def __init__(self, path: str, max_turns: int, ttl: Optional[float] = None) -> None:
+        self.path = path
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " sid TEXT NOT NULL,"
+                " turn TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_sid ON turns (sid, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " sid TEXT PRIMARY KEY,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork so children never share one
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid: str) -> List[Turn]:
+        rows = self._connect().execute("SELECT turn FROM turns WHERE sid = ? ORDER BY id", (sid,)).fetchall()
+        return [json.loads(turn) for turn, in rows]
+
+    def append(self, sid: str, turns: List[Turn]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO turns (sid, turn) VALUES (?, ?)", [(sid, json.dumps(turn)) for turn in turns])
+            conn.execute(
+                "DELETE FROM turns WHERE sid = ? AND id NOT IN"
+                " (SELECT id FROM turns WHERE sid = ? ORDER BY id DESC LIMIT ?)",
+                (sid, sid, self.max_turns),
+            )
+            conn.execute("INSERT OR REPLACE INTO sessions (sid, updated_at) VALUES (?, ?)", (sid, time.time()))
+        self._writes += 1
+        if self.ttl and self._writes % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self) -> None:
+        """Drop sessions idle for longer than the TTL."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            cutoff = time.time() - self.ttl
+            conn.execute(
+                "DELETE FROM turns WHERE sid IN (SELECT sid FROM sessions WHERE updated_at <= ?)", (cutoff,)
+            )
+            conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (cutoff,))
+
+    def clear(self, sid: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM turns WHERE sid = ?", (sid,))
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+def create_history_store(backend: str = HISTORY_BACKEND) -> HistoryStore:
+    """Build the configured backend: ``memory`` or ``sqlite``."""
+    if backend == "memory":
+        return MemoryHistoryStore(HISTORY_MAX_SESSIONS, HISTORY_MAX_TURNS)
+    if backend == "sqlite":
+        return SQLiteHistoryStore(HISTORY_SQLITE_PATH, HISTORY_MAX_TURNS, HISTORY_TTL_SECONDS or None)
+    raise ValueError(f"Unknown history backend: {backend}")
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+def get_history_store() -> HistoryStore:
+    """Open the configured history store once per process, on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_history_store()
+    return _store
+
+def session_id(session: MutableMapping[str, Any]) -> str:
+    """Stable id for this client's session, created on first use"""
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
+
+def get_conversation_history(session: MutableMapping[str, Any]) -> List[Turn]:
+    """Get the conversation history for the session"""
+    return get_history_store().get(session_id(session))
+
+def add_to_history(session: MutableMapping[str, Any], role: str, content: str,
+                   books: Optional[List[Dict[str, Any]]] = None) -> None:
+    """Add a message to the conversation history"""
+    message: Turn = {"role": role, "content": content}
+    if books:
+        message["books"] = books
+    get_history_store().append(session_id(session), [message])
+
+def clear_history(session: MutableMapping[str, Any]) -> None:
+    """Clear the conversation history"""
+    get_history_store().clear(session_id(session))
+
+def completed_turns(response: str, found_books: List[Dict[str, Any]]) -> List[Turn]:
+    """
+    The history entries for one answered query: the search results, then the answer.
+
+    The search results turn keeps the books, not their rendered text, so the prompt
+    builder can decide how much of them to show the model.
+    """
+    turns: List[Turn] = []
+    if found_books:
+        turns.append({"role": "assistant", "content": "", "books": found_books})
+    turns.append({"role": "assistant", "content": response})
+    return turns
+
+# Ends the recorded answer of a stream that was cut off
+INTERRUPTED_NOTE = "[response interrupted]"
+
+def interrupted_turns(partial: str, found_books: List[Dict[str, Any]]) -> List[Turn]:
+    """
+    ``completed_turns`` for a streamed answer cut off by a disconnect or an error.
+
+    The query is recorded before streaming starts, so it still gets an answer turn
+    (whatever was streamed) and the next request does not send two user turns in a row.
+    """
+    return completed_turns(f"{partial} {INTERRUPTED_NOTE}".lstrip(), found_books)
+
+def record_turns(sid: str, turns: List[Turn]) -> None:
+    """
+    Append finished turns to the session's history.
+
+    Takes the session id rather than the session, so streamed responses can
+    record their turns after the response has started.
+    """
+    get_history_store().append(sid, turns)
@@ -1,17 +1,38 @@
+"""
+Logging setup and the per-request log decorator.
+
+``configure_logging`` routes every record through a bounded in-memory queue to a
+``QueueListener`` thread that owns the console and file handlers, so requests
+never wait on log I/O. Records are formatted on that thread, and when the queue
+is full new records are dropped rather than blocking the request.
+
+``log_response`` writes one structured line per request (view, status, duration),
+for a sample of requests and for every failure. Request and response payloads are
+only logged at DEBUG, with secret-looking fields redacted and long values truncated.
+"""
+import atexit
 import functools
+import json
 import logging
-from typing import Any, Callable, Dict, TypeVar, cast
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Final, List, Optional, TypeVar, cast
 from flask import request
-from config import DEBUG
-
-# Configure file handler
-file_handler = logging.FileHandler('litloot_debug.log')
-file_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
+from config import (
+    DEBUG,
+    LOG_FILE,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATE,
+    LOG_MAX_PAYLOAD_CHARS,
+    LOG_REDACT_FIELDS,
+)
 
-# Add file handler to root logger
-logging.getLogger().addHandler(file_handler)
+LOG_FORMAT: Final[str] = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
 # Get our custom logger
 logger = logging.getLogger('litloot')
@@ -19,48 +40,141 @@ logger = logging.getLogger('litloot')
 # Type variable for the decorated function
 F = TypeVar('F', bound=Callable[..., Any])
 
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener as they are; drops them if the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so formatting can wait for the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            type(self).dropped += 1
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+def _start_listener(handlers: List[logging.Handler]) -> None:
+    global _listener
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DroppingQueueHandler(log_queue))
+
+def _restart_after_fork() -> None:
+    # The listener thread does not survive fork; without a new one the child's queue just fills up
+    if _listener is not None:
+        _start_listener(list(_listener.handlers))
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def configure_logging(level: Optional[int] = None) -> None:
+    """Send all logging through the background listener. Safe to call more than once."""
+    level = level if level is not None else (logging.DEBUG if DEBUG else logging.INFO)
+    logging.getLogger().setLevel(level)
+    with _listener_lock:
+        if _listener is not None:
+            return
+        formatter = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(formatter)
+        handlers: List[logging.Handler] = [console]
+        if LOG_FILE:
+            file_handler = logging.FileHandler(LOG_FILE)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        _start_listener(handlers)
+    atexit.register(stop_logging)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+class _Json:
+    """Serializes on the listener thread, only if the record is actually emitted."""
+
+    def __init__(self, data: Any) -> None:
+        self.data = data
+
+    def __str__(self) -> str:
+        return json.dumps(self.data, default=str)
+
+def scrub(value: Any, max_chars: int = LOG_MAX_PAYLOAD_CHARS) -> Any:
+    """A copy of ``value`` safe to log: redacted secrets, truncated strings and lists."""
+    if isinstance(value, dict):
+        return {
+            key: "[redacted]" if str(key).lower() in LOG_REDACT_FIELDS else scrub(item, max_chars)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        items = [scrub(item, max_chars) for item in value[:20]]
+        if len(value) > 20:
+            items.append(f"... {len(value) - 20} more")
+        return items
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}... ({len(value)} chars)"
+    return value
+
+def _status(result: Any) -> int:
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1]
+    return getattr(result, "status_code", 200)
+
+def _response_body(result: Any) -> Any:
+    response = result[0] if isinstance(result, tuple) else result
+    if getattr(response, "is_streamed", False):
+        # Reading it here would consume the stream
+        return "<stream>"
+    get_json = getattr(response, "get_json", None)
+    return get_json(silent=True) if get_json else response
+
 def log_response(func: F) -> F:
     """
-    Decorator that logs function responses when in debug mode.
-    Logs the function name, arguments, return value, and request details.
+    Log each call of a Flask view as one structured line.
+
+    The view runs exactly once, whatever happens to the logging around it.
     """
     @functools.wraps(func)
     def wrapper(*args: Any, **kwargs: Any) -> Any:
-        # Always allow the request to proceed
+        start = time.perf_counter()
         try:
-            # Log the function call and request details
-            func_name: str = func.__name__
-            
-            # Log request details
-            request_info: Dict[str, Any] = {
-                "method": request.method,
-                "path": request.path,
-                "headers": dict(request.headers),
-                "args": dict(request.args),
-                "json": request.get_json(silent=True) or {},
-                "form": dict(request.form)
-            }
-            
-            # Use print for debugging to ensure we see the output
-            print(f"\n=== DEBUG LOG: {func_name} ===")
-            print(f"Request details: {request_info}")
-            print(f"Function args: {args}, kwargs: {kwargs}")
-            
-            # Also use logging
-            logger.debug(f"Function {func_name} called with args: {args}, kwargs: {kwargs}")
-            logger.debug(f"Request details: {request_info}")
-            
-            # Call the original function
             result = func(*args, **kwargs)
-            
-            # Log the result
-            print(f"Function result: {result}")
-            logger.debug(f"Function {func_name} returned: {result}")
-            
-            return result
-        except Exception as e:
-            # Log the error but allow the request to proceed
-            print(f"Error in {func.__name__}: {str(e)}")
-            logger.error(f"Error in {func.__name__}: {str(e)}")
-            return func(*args, **kwargs)
-    return cast(F, wrapper) 
\ No newline at end of file
+        except Exception:
+            _log_request(func.__name__, start, None, failed=True)
+            raise
+        _log_request(func.__name__, start, result, failed=False)
+        return result
+    return cast(F, wrapper)
+
+def _log_request(view: str, start: float, result: Any, failed: bool) -> None:
+    try:
+        status = 500 if failed else _status(result)
+        error = failed or status >= 500
+        if not error and random.random() >= LOG_SAMPLE_RATE:
+            return
+        entry: Dict[str, Any] = {
+            "view": view,
+            "method": request.method,
+            "path": request.path,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            entry["request"] = scrub(request.get_json(silent=True) or dict(request.args))
+            if not failed:
+                entry["response"] = scrub(_response_body(result))
+        logger.log(logging.WARNING if error else logging.INFO, "request %s", _Json(entry))
+    except Exception as e:
+        # Logging must never fail the request
+        logger.debug(f"Could not log {view}: {e}")
@@ -0,0 +1,218 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+``Counter`` and ``Histogram`` are updated where the work happens; collectors
+registered with ``register_collector`` report values that already live
+elsewhere (cache stats, breaker state, queue depth) when ``/metrics`` is scraped.
+
+``timed(stage)`` records a stage's duration in ``litloot_stage_seconds`` and, when
+the current request was started with ``start_request``, in that request's
+breakdown, which ``server_timing()`` renders as a ``Server-Timing`` header.
+
+Metrics are per process: with several workers, each one reports its own.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+# (name, type, help, [(labels, value)]) as reported by a collector
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_metrics: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[Family]]] = []
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: Labels) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """``(name, labels, value)`` for every exposed series."""
+
+class Counter(_Metric):
+    """A monotonically increasing count, per label combination."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+class Histogram(_Metric):
+    """Observations bucketed by upper bound, with their count and sum."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: a count per bucket (plus +Inf), and the sum
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        slot = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[slot] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+                samples.append((f"{self.name}_count", labels, cumulative))
+                samples.append((f"{self.name}_sum", labels, self._sums[key]))
+        return samples
+
+def register_collector(collector: Callable[[], Iterable[Family]]) -> None:
+    """Add a callback that reports metric families at scrape time."""
+    _collectors.append(collector)
+
+def render() -> str:
+    """Every metric in the Prometheus text format (version 0.0.4)."""
+    lines: List[str] = []
+    for metric in _metrics:
+        samples = metric.samples()
+        if not samples:
+            continue
+        lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.type}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples]
+    for collector in _collectors:
+        try:
+            families = list(collector())
+        except Exception as e:
+            lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {e}")
+            continue
+        for name, kind, help, samples in families:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram("litloot_stage_seconds", "Time spent in each stage of request handling", ["stage"])
+HTTP_SECONDS = Histogram(
+    "litloot_http_request_seconds", "Time until each HTTP response started", ["endpoint", "method", "status"]
+)
+
+class RequestTimings:
+    """Total time and count per stage for one request; stages may run on several threads."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def stages(self) -> Dict[str, Tuple[float, int]]:
+        with self._lock:
+            return {stage: (total, int(count)) for stage, (total, count) in self._stages.items()}
+
+_timings: "contextvars.ContextVar[Optional[RequestTimings]]" = contextvars.ContextVar("request_timings", default=None)
+
+def start_request() -> RequestTimings:
+    """Collect the stages timed from here on in this context into a fresh breakdown."""
+    timings = RequestTimings()
+    _timings.set(timings)
+    return timings
+
+def finish_request(endpoint: Optional[str], method: str, status: int) -> Optional[float]:
+    """Record the current request's latency; returns it in seconds, or None outside a request."""
+    timings = _timings.get()
+    if timings is None:
+        return None
+    total = time.perf_counter() - timings.started
+    HTTP_SECONDS.observe(total, endpoint=endpoint or "unknown", method=method, status=status)
+    return total
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+@contextlib.contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time the block as ``stage``; works around ``await`` too."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def server_timing(total: Optional[float] = None) -> str:
+    """The current request's breakdown as a ``Server-Timing`` header value, durations in ms."""
+    timings = _timings.get()
+    entries = []
+    if timings is not None:
+        for stage, (seconds, count) in timings.stages().items():
+            entry = f"{stage};dur={seconds * 1000:.1f}"
+            entries.append(entry if count == 1 else f'{entry};desc="{count} calls"')
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
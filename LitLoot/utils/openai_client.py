@@ -1,10 +1,185 @@
+import json
 import os
-from typing import Final
-from openai import OpenAI
-from config import OPENAI_API_KEY
+import threading
+from typing import Any, Dict, Final, Optional
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_RETRY_ATTEMPTS,
+    OPENAI_RETRY_BASE_DELAY,
+    OPENAI_RETRY_MAX_DELAY,
+    OPENAI_DEADLINE_SECONDS,
+    OPENAI_BREAKER_FAILURES,
+    OPENAI_BREAKER_RESET_SECONDS,
+    OPENAI_RPM,
+    OPENAI_TPM,
+    OPENAI_RATE_BURST_SECONDS,
+    OPENAI_QUEUE_SIZE,
+    OPENAI_QUEUE_TIMEOUT_SECONDS,
+)
+from utils.decorators import CircuitBreaker, retry_after, time_left, with_async_retry, with_retry
+from utils.metrics import Counter, register_collector, timed
+from utils.rate_limiter import Scheduler, current_priority, estimate_tokens
 
 # Set the API key in the environment
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
+# One client per process so every request reuses the same keep-alive connection pool.
+# They are created lazily so pre-forked workers never share a pool with their parent.
+_client: Optional[OpenAI] = None
+_async_client: Optional[AsyncOpenAI] = None
+_client_lock: Final[threading.Lock] = threading.Lock()
+
+# One breaker per process for every OpenAI call, sync or async
+openai_breaker: Final[CircuitBreaker] = CircuitBreaker(
+    OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET_SECONDS, name="OpenAI"
+)
+
+# Policy for with_retry / with_async_retry around OpenAI calls. The SDK's own retries
+# are turned off below, so this is the only retry loop.
+OPENAI_RETRY: Final[Dict[str, Any]] = {
+    "attempts": OPENAI_RETRY_ATTEMPTS,
+    "base_delay": OPENAI_RETRY_BASE_DELAY,
+    "max_delay": OPENAI_RETRY_MAX_DELAY,
+    "deadline": OPENAI_DEADLINE_SECONDS,
+    "breaker": openai_breaker,
+}
+
+# Every OpenAI call in the process queues here for its share of the account's quota
+openai_scheduler: Final[Scheduler] = Scheduler(
+    OPENAI_RPM, OPENAI_TPM, OPENAI_QUEUE_SIZE, OPENAI_RATE_BURST_SECONDS, name="OpenAI"
+)
+
+OPENAI_REQUESTS = Counter("litloot_openai_requests_total", "OpenAI completion attempts", ["model", "outcome"])
+OPENAI_TOKENS = Counter("litloot_openai_tokens_total", "Tokens used by OpenAI completions", ["model", "kind"])
+
+BREAKER_STATES: Final[Dict[str, int]] = {"closed": 0, "half_open": 1, "open": 2}
+
+def _openai_metrics() -> Any:
+    yield ("litloot_circuit_state", "gauge", "Circuit breaker state: 0 closed, 1 half open, 2 open",
+           [({"upstream": "openai"}, BREAKER_STATES[openai_breaker.state])])
+    if openai_scheduler.unlimited:
+        # Without limits nothing is queued or counted
+        return
+    stats = openai_scheduler.stats()
+    yield ("litloot_openai_queue_depth", "gauge", "OpenAI calls waiting for quota", [({}, stats["queued"])])
+    yield ("litloot_openai_scheduled_total", "counter", "OpenAI calls let through or shed by the scheduler",
+           [({"result": "granted"}, stats["granted"]), ({"result": "shed"}, stats["shed"])])
+
+register_collector(_openai_metrics)
+
+def request_timeout() -> Dict[str, Any]:
+    """``timeout=`` for an OpenAI call, so one slow attempt cannot outlive the call's deadline."""
+    remaining = time_left()
+    return {} if remaining is None else {"timeout": remaining}
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
 def get_client() -> OpenAI:
-    return OpenAI(api_key=OPENAI_API_KEY) 
\ No newline at end of file
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    http_client=httpx.Client(limits=_limits()),
+                    max_retries=0,
+                )
+    return _client
+
+def get_async_client() -> AsyncOpenAI:
+    """Shared client for the ASGI app; must be used from that app's event loop."""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncOpenAI(
+                    api_key=OPENAI_API_KEY,
+                    http_client=httpx.AsyncClient(limits=_limits()),
+                    max_retries=0,
+                )
+    return _async_client
+
+def _reserve(kwargs: Dict[str, Any]) -> int:
+    # OpenAI counts max_tokens against the TPM limit up front, so we do too
+    prompt = json.dumps(kwargs.get("messages", []), default=str) + json.dumps(kwargs.get("tools", []))
+    return estimate_tokens(prompt) + kwargs.get("max_tokens", 0)
+
+def _queue_timeout() -> float:
+    remaining = time_left()
+    return OPENAI_QUEUE_TIMEOUT_SECONDS if remaining is None else min(remaining, OPENAI_QUEUE_TIMEOUT_SECONDS)
+
+def _settle(model: str, reserved: int, response: Any) -> None:
+    # Streams carry no usage, so their reservation stands
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        openai_scheduler.settle(reserved, usage.total_tokens)
+        OPENAI_TOKENS.inc(usage.prompt_tokens, model=model, kind="prompt")
+        OPENAI_TOKENS.inc(usage.completion_tokens, model=model, kind="completion")
+
+def _outcome(error: Exception) -> str:
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, openai.APIStatusError):
+        return f"http_{error.status_code}"
+    return "error"
+
+def _rate_limited(error: openai.RateLimitError) -> None:
+    # The quota is shared with whatever else uses the key; hold everyone, not just this call
+    openai_scheduler.pause(retry_after(error) or 1.0)
+
+@with_retry(**OPENAI_RETRY)
+def create_completion(client: OpenAI, priority: Optional[int] = None, **kwargs: Any) -> Any:
+    """
+    ``client.chat.completions.create`` through the scheduler, with retries.
+
+    Waits for quota at ``priority`` (default: the caller's ``request_priority``) and
+    raises ``OverloadedError`` if it cannot get it in time. For streams the retries
+    cover opening the stream; a stream that breaks midway is not replayed.
+    """
+    model = kwargs.get("model", "")
+    with timed("openai_queue"):
+        reserved = openai_scheduler.acquire(
+            _reserve(kwargs), current_priority() if priority is None else priority, _queue_timeout()
+        )
+    try:
+        with timed("openai"):
+            response = client.chat.completions.create(**kwargs, **request_timeout())
+    except Exception as e:
+        OPENAI_REQUESTS.inc(model=model, outcome=_outcome(e))
+        if isinstance(e, openai.RateLimitError):
+            _rate_limited(e)
+        raise
+    OPENAI_REQUESTS.inc(model=model, outcome="ok")
+    _settle(model, reserved, response)
+    return response
+
+@with_async_retry(**OPENAI_RETRY)
+async def create_completion_async(client: AsyncOpenAI, priority: Optional[int] = None, **kwargs: Any) -> Any:
+    """Coroutine version of create_completion for an ``AsyncOpenAI`` client."""
+    model = kwargs.get("model", "")
+    with timed("openai_queue"):
+        reserved = await openai_scheduler.acquire_async(
+            _reserve(kwargs), current_priority() if priority is None else priority, _queue_timeout()
+        )
+    try:
+        with timed("openai"):
+            response = await client.chat.completions.create(**kwargs, **request_timeout())
+    except Exception as e:
+        OPENAI_REQUESTS.inc(model=model, outcome=_outcome(e))
+        if isinstance(e, openai.RateLimitError):
+            _rate_limited(e)
+        raise
+    OPENAI_REQUESTS.inc(model=model, outcome="ok")
+    _settle(model, reserved, response)
+    return response
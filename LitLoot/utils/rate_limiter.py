@@ -0,0 +1,265 @@
+"""
+Client-side rate limiting and prioritization for upstream calls.
+
+A ``Scheduler`` holds two token buckets, one for requests and one for tokens per
+minute. Every call reserves its estimated tokens before it is sent, and the
+reservation is corrected from the response's usage afterwards. Calls that cannot
+go at once wait in a bounded priority queue: lower priority numbers first, FIFO
+within a priority. A call that would wait longer than its timeout, or finds the
+queue full, is rejected at once with ``OverloadedError`` rather than piling up.
+A 429 from the upstream pauses the whole queue for its ``Retry-After``.
+
+Works from threads and coroutines alike: a dispatcher thread grants queued
+calls as the buckets refill.
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils.decorators import ServiceUnavailableError
+
+# Lower runs first
+PRIORITY_CHAT = 0
+PRIORITY_QUIZ = 1
+PRIORITY_BACKGROUND = 2
+
+# Rough count for budgeting: ~4 characters per token, plus per-message framing
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+class OverloadedError(ServiceUnavailableError):
+    """The call was shed: the queue is full or the wait would outlast its timeout."""
+
+_priority: "contextvars.ContextVar[int]" = contextvars.ContextVar("request_priority", default=PRIORITY_CHAT)
+
+def current_priority() -> int:
+    return _priority.get()
+
+@contextlib.contextmanager
+def request_priority(priority: int) -> Iterator[None]:
+    """Run the calls made inside the block at ``priority``."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """
+    ``per_minute`` units refilled continuously, holding at most ``burst_seconds`` worth.
+
+    A limit of 0 means unlimited. Requests larger than the bucket are charged
+    the whole bucket, so they still go through, just alone.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float) -> None:
+        self.unlimited = per_minute <= 0
+        self.rate = per_minute / 60.0
+        self.capacity = math.inf if self.unlimited else max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` could be taken."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount: float) -> None:
+        """Return (or, if negative, charge) units after the fact."""
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+class _Waiter:
+    def __init__(self, priority: int, seq: int, tokens: int) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.granted = False
+        self.cancelled = False
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional["asyncio.Future[None]"] = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        elif self.loop is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+def _resolve(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+class Scheduler:
+    """Admission control, priorities and rate limits for one upstream."""
+
+    def __init__(self, rpm: float, tpm: float, max_queue: int, burst_seconds: float = 10.0,
+                 name: str = "upstream") -> None:
+        self.name = name
+        self.max_queue = max_queue
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self._cond = threading.Condition(threading.Lock())
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._pid: Optional[int] = None
+        self._shed = 0
+        self._granted = 0
+
+    @property
+    def unlimited(self) -> bool:
+        return self.requests.unlimited and self.tokens.unlimited
+
+    def _ensure_dispatcher(self) -> None:
+        # Threads do not survive fork, so each process starts its own dispatcher
+        if self._pid != os.getpid():
+            self._heap = []
+            threading.Thread(target=self._run, name=f"{self.name}-scheduler", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        return max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _estimated_wait(self, priority: int, tokens: int, now: float) -> float:
+        """How long a new call would queue: everything at its priority or better goes first."""
+        ahead = [w for w in self._heap if not w.cancelled and w.priority <= priority]
+        requests = len(ahead) + 1
+        total = sum(w.tokens for w in ahead) + tokens
+        waits = [self._paused_until - now]
+        if not self.requests.unlimited:
+            waits.append((requests - self.requests.level) / self.requests.rate)
+        if not self.tokens.unlimited:
+            waits.append((total - self.tokens.level) / self.tokens.rate)
+        return max(waits)
+
+    def _enqueue(self, tokens: int, priority: int, timeout: Optional[float]) -> Optional[_Waiter]:
+        """Take capacity now and return None, or queue a waiter, or shed the call."""
+        with self._cond:
+            self._ensure_dispatcher()
+            now = time.monotonic()
+            if not self._heap and self._wait_time(tokens, now) <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                self._granted += 1
+                return None
+            if len(self._heap) >= self.max_queue:
+                self._shed += 1
+                raise OverloadedError(f"{self.name} queue is full ({self.max_queue} waiting)")
+            if timeout is not None and self._estimated_wait(priority, tokens, now) > timeout:
+                self._shed += 1
+                raise OverloadedError(f"{self.name} quota cannot fit this call within {timeout:.1f}s")
+            waiter = _Waiter(priority, next(self._seq), tokens)
+            heapq.heappush(self._heap, waiter)
+            self._cond.notify()
+            return waiter
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Withdraw a waiter that stopped waiting; False if it was granted meanwhile."""
+        with self._cond:
+            if waiter.granted:
+                return False
+            waiter.cancelled = True
+            self._shed += 1
+            return True
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_CHAT, timeout: Optional[float] = None) -> int:
+        """Block until the call may go. Returns the tokens reserved, for ``settle``."""
+        if self.unlimited:
+            return tokens
+        waiter = self._enqueue(tokens, priority, timeout)
+        if waiter is not None:
+            waiter.event = threading.Event()
+            # The dispatcher may have granted it before the event existed
+            if not waiter.granted and not waiter.event.wait(timeout) and self._give_up(waiter):
+                raise OverloadedError(f"{self.name} call waited {timeout:.1f}s for quota")
+        return tokens
+
+    async def acquire_async(self, tokens: int, priority: int = PRIORITY_CHAT,
+                            timeout: Optional[float] = None) -> int:
+        """Coroutine version of acquire; waits without blocking the event loop."""
+        if self.unlimited:
+            return tokens
+        waiter = self._enqueue(tokens, priority, timeout)
+        if waiter is not None:
+            future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+            waiter.future, waiter.loop = future, asyncio.get_running_loop()
+            if waiter.granted:
+                _resolve(future)
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                if self._give_up(waiter):
+                    raise OverloadedError(f"{self.name} call waited {timeout:.1f}s for quota")
+            except asyncio.CancelledError:
+                self._give_up(waiter)
+                raise
+        return tokens
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct a reservation once the real token usage is known."""
+        with self._cond:
+            self.tokens.give(reserved - used)
+            self._cond.notify()
+
+    def pause(self, seconds: float) -> None:
+        """Hold every queued and new call for ``seconds``, e.g. after a 429."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": sum(1 for w in self._heap if not w.cancelled),
+                "granted": self._granted,
+                "shed": self._shed,
+                "paused_for": max(0.0, self._paused_until - time.monotonic()),
+            }
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                self._cond.wait(timeout=self._dispatch())
+
+    def _dispatch(self) -> Optional[float]:
+        """Grant queued calls in order while capacity lasts; returns seconds until the next could go."""
+        while self._heap:
+            head = self._heap[0]
+            if head.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            wait = self._wait_time(head.tokens, time.monotonic())
+            if wait > 0:
+                return wait
+            heapq.heappop(self._heap)
+            self.requests.take(1)
+            self.tokens.take(head.tokens)
+            self._granted += 1
+            head.grant()
+        return None